@@ -52,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat.tracing.TraceIDMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -162,3 +163,191 @@ SIMPLE_JWT = {
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY", "")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+
+# Number of texts sent per embedding request when indexing documents
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", 100))
+
+# Query embedding coalescing (chat/coalescer.py): under load, queries arriving
+# within WINDOW_MS of each other (up to MAX_BATCH) are embedded in one provider
+# request, with up to WORKERS requests in flight; a query arriving while no
+# other is waiting or in flight is sent at once. A window of 0 embeds each
+# query alone. Callers wait at most AI_REQUEST_TIMEOUT per provider.
+EMBED_COALESCE_WINDOW_MS = float(os.getenv("EMBED_COALESCE_WINDOW_MS", 5))
+EMBED_COALESCE_MAX_BATCH = int(os.getenv("EMBED_COALESCE_MAX_BATCH", 32))
+EMBED_COALESCE_WORKERS = int(os.getenv("EMBED_COALESCE_WORKERS", 4))
+
+# Embedding cache: in-memory LRU entries (0 disables the cache) and an optional
+# SQLite file that keeps embeddings across restarts and processes
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 10000))
+EMBEDDING_CACHE_DB = os.getenv("EMBEDDING_CACHE_DB", "")
+
+# Semantic response cache: reuse the answer to a past question whose embedding
+# has at least this cosine similarity. Size 0 disables the cache.
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", 0.95))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 3600))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1000))
+
+# Vector store snapshots written by `rebuild_vectorstore` and loaded by the server
+# (one directory per version, see chat/snapshots.py). Old versions are kept
+# for rollback; servers check for a newly published version every POLL
+# seconds (0 disables; SIGHUP and POST /vectorstore/reload/ still work).
+# Set RELOAD_ON_SIGHUP in the server's environment to also reload on SIGHUP;
+# it is off by default so management commands keep SIGHUP's default action
+VECTORSTORE_DIR = os.getenv("VECTORSTORE_DIR", str(BASE_DIR / "vectorstore"))
+VECTORSTORE_KEEP_VERSIONS = int(os.getenv("VECTORSTORE_KEEP_VERSIONS", 3))
+VECTORSTORE_RELOAD_POLL_SECONDS = float(os.getenv("VECTORSTORE_RELOAD_POLL_SECONDS", 5))
+VECTORSTORE_RELOAD_ON_SIGHUP = os.getenv("VECTORSTORE_RELOAD_ON_SIGHUP", "false").lower() == "true"
+# Memory-map the snapshot read-only so all worker processes share one copy
+VECTORSTORE_MMAP = os.getenv("VECTORSTORE_MMAP", "true").lower() == "true"
+
+# FAISS index type used when (re)building the vector store: flat (exact),
+# ivf, hnsw or ivfpq (approximate). See chat/indexes.py.
+VECTORSTORE_INDEX_TYPE = os.getenv("VECTORSTORE_INDEX_TYPE", "flat")
+# Providers (google, openai) whose embeddings get an index of their own, so
+# queries can still be searched after failing over to one; empty = all configured
+VECTORSTORE_EMBED_PROVIDERS = [
+    key.strip() for key in os.getenv("VECTORSTORE_EMBED_PROVIDERS", "").split(",") if key.strip()
+]
+VECTORSTORE_IVF_NLIST = int(os.getenv("VECTORSTORE_IVF_NLIST", 1024))
+VECTORSTORE_PQ_M = int(os.getenv("VECTORSTORE_PQ_M", 64))
+VECTORSTORE_HNSW_M = int(os.getenv("VECTORSTORE_HNSW_M", 32))
+VECTORSTORE_HNSW_EF_CONSTRUCTION = int(os.getenv("VECTORSTORE_HNSW_EF_CONSTRUCTION", 200))
+# Default search breadth; both can be overridden per query
+VECTORSTORE_NPROBE = int(os.getenv("VECTORSTORE_NPROBE", 16))
+VECTORSTORE_EF_SEARCH = int(os.getenv("VECTORSTORE_EF_SEARCH", 64))
+
+# Filtered search: selections of up to BRUTE_FORCE_MAX chunks are compared with
+# the query directly instead of searching the index with an ID selector, and
+# the chunk IDs of the last CACHE_SIZE distinct filters are kept
+VECTORSTORE_FILTER_BRUTE_FORCE_MAX = int(os.getenv("VECTORSTORE_FILTER_BRUTE_FORCE_MAX", 4096))
+VECTORSTORE_FILTER_CACHE_SIZE = int(os.getenv("VECTORSTORE_FILTER_CACHE_SIZE", 64))
+
+# OpenMP threads each process lets FAISS use for a search (0 = FAISS's default,
+# one per core). Keep workers x threads per worker x FAISS_OMP_THREADS at about
+# the number of cores; see "Search Threading" in the README.
+FAISS_OMP_THREADS = int(os.getenv("FAISS_OMP_THREADS", 1))
+
+# Search coalescing (chat/coalescer.py): vector searches of concurrent requests
+# arriving within WINDOW_MS (up to MAX_BATCH) share one FAISS search call.
+# 0 searches each query on its own, in the request's thread. A request waits
+# at most TIMEOUT_SECONDS for its batch's results.
+SEARCH_COALESCE_WINDOW_MS = float(os.getenv("SEARCH_COALESCE_WINDOW_MS", 0))
+SEARCH_COALESCE_MAX_BATCH = int(os.getenv("SEARCH_COALESCE_MAX_BATCH", 64))
+SEARCH_COALESCE_TIMEOUT_SECONDS = float(os.getenv("SEARCH_COALESCE_TIMEOUT_SECONDS", 10))
+
+# Per-request timeout (seconds) for calls to the AI providers
+AI_REQUEST_TIMEOUT = float(os.getenv("AI_REQUEST_TIMEOUT", 30))
+# Circuit breakers: a provider is skipped for AI_BREAKER_OPEN_SECONDS once at
+# least AI_BREAKER_FAILURE_RATE of its calls in the last AI_BREAKER_WINDOW_SECONDS
+# (and at least AI_BREAKER_MIN_CALLS calls) failed or took longer than
+# AI_BREAKER_SLOW_CALL_SECONDS. See chat/circuit_breaker.py.
+AI_BREAKER_WINDOW_SECONDS = float(os.getenv("AI_BREAKER_WINDOW_SECONDS", 60))
+AI_BREAKER_MIN_CALLS = int(os.getenv("AI_BREAKER_MIN_CALLS", 5))
+AI_BREAKER_FAILURE_RATE = float(os.getenv("AI_BREAKER_FAILURE_RATE", 0.5))
+AI_BREAKER_SLOW_CALL_SECONDS = float(os.getenv("AI_BREAKER_SLOW_CALL_SECONDS", 10))
+AI_BREAKER_OPEN_SECONDS = float(os.getenv("AI_BREAKER_OPEN_SECONDS", 30))
+
+# Use the offline fake provider (chat/fake_provider.py) instead of Google/OpenAI,
+# for local testing and benchmarks. Latency and failure rate can be injected.
+AI_FAKE_PROVIDER = os.getenv("AI_FAKE_PROVIDER", "false").lower() == "true"
+AI_FAKE_PROVIDER_LATENCY = float(os.getenv("AI_FAKE_PROVIDER_LATENCY", 0))
+AI_FAKE_PROVIDER_FAILURE_RATE = float(os.getenv("AI_FAKE_PROVIDER_FAILURE_RATE", 0))
+
+# Document ingestion pipeline (chat/ingest.py): processes reading and chunking
+# files, threads embedding batches concurrently, embedding batches allowed to
+# wait in the queue, and how often (seconds) rebuilds save a resumable checkpoint
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+INGEST_EMBED_WORKERS = int(os.getenv("INGEST_EMBED_WORKERS", 4))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 8))
+INGEST_CHECKPOINT_SECONDS = float(os.getenv("INGEST_CHECKPOINT_SECONDS", 60))
+
+# Measure chunk sizes in tokens instead of characters: dotted path to a callable
+# returning a string's token count, e.g. "chat.chunker.approx_token_count"
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "")
+
+# Hybrid search: BM25 and vector candidates fetched per query, fused by
+# reciprocal-rank fusion with constant HYBRID_RRF_K. The query embedding is
+# skipped when the best BM25 match scores at least HYBRID_LEXICAL_MIN_SCORE and
+# HYBRID_LEXICAL_RATIO times the runner-up (ratio 0 always embeds).
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", 20))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", 60))
+HYBRID_LEXICAL_RATIO = float(os.getenv("HYBRID_LEXICAL_RATIO", 3.0))
+HYBRID_LEXICAL_MIN_SCORE = float(os.getenv("HYBRID_LEXICAL_MIN_SCORE", 5.0))
+
+# Chat history: page size of /chat-history/ (clients may ask for up to the max
+# with ?page_size=), days messages are kept, and rows deleted per cleanup batch
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", 50))
+CHAT_HISTORY_MAX_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_MAX_PAGE_SIZE", 200))
+CHAT_RETENTION_DAYS = int(os.getenv("CHAT_RETENTION_DAYS", 30))
+CHAT_CLEANUP_BATCH_SIZE = int(os.getenv("CHAT_CLEANUP_BATCH_SIZE", 1000))
+
+# Conversation memory: recent turns kept verbatim (each clipped to
+# CHAT_MEMORY_TURN_TOKENS), the token budget of the rolling summary of older
+# turns, and how long recent turns stay in the cache
+CHAT_MEMORY_TURNS = int(os.getenv("CHAT_MEMORY_TURNS", 3))
+CHAT_MEMORY_TURN_TOKENS = int(os.getenv("CHAT_MEMORY_TURN_TOKENS", 150))
+CHAT_MEMORY_SUMMARY_TOKENS = int(os.getenv("CHAT_MEMORY_SUMMARY_TOKENS", 200))
+CHAT_MEMORY_CACHE_SECONDS = int(os.getenv("CHAT_MEMORY_CACHE_SECONDS", 3600))
+
+# Metrics: GET /metrics/ requires "Authorization: Bearer <METRICS_TOKEN>".
+# Without a token it is only served with DEBUG on (to local development)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Log to the console with each request's trace ID (see chat.tracing)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "filters": {
+        "trace_id": {"()": "chat.tracing.TraceIDFilter"},
+    },
+    "formatters": {
+        "traced": {"format": "%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s"},
+    },
+    "handlers": {
+        "console": {
+            "class": "logging.StreamHandler",
+            "filters": ["trace_id"],
+            "formatter": "traced",
+        },
+    },
+    "root": {"handlers": ["console"], "level": LOG_LEVEL},
+    "loggers": {
+        # Reports its CPU features on import
+        "faiss.loader": {"level": "WARNING"},
+    },
+}
+
+# Context packing (chat/context.py): chunks retrieved per question, how far
+# a vector hit may be from the query, as a multiple of the closest hit's
+# distance, before it is dropped (0 keeps all; relative, so it holds for any
+# embedding model), the fraction of the best BM25 score keyword-only hits need, the MMR
+# trade-off between relevance and diversity (1 disables MMR) and the token
+# budget of the retrieved context in the prompt (0 = unlimited)
+CONTEXT_CANDIDATES = int(os.getenv("CONTEXT_CANDIDATES", 8))
+CONTEXT_DISTANCE_RATIO = float(os.getenv("CONTEXT_DISTANCE_RATIO", 1.5))
+CONTEXT_BM25_RATIO = float(os.getenv("CONTEXT_BM25_RATIO", 0.5))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", 1.0))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 1500))
+
+# Background jobs (chat.jobs, `python manage.py run_worker`): attempts before a
+# job is marked failed, exponential retry backoff (doubling from the base up
+# to the max), queue polling interval, how often a worker signals that its
+# running job is alive, how long a running job may go without a heartbeat
+# before it is assumed abandoned, and days finished jobs are kept
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+JOB_RETRY_BACKOFF_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_SECONDS", 30))
+JOB_RETRY_BACKOFF_MAX_SECONDS = float(os.getenv("JOB_RETRY_BACKOFF_MAX_SECONDS", 3600))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", 2))
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", 30))
+JOB_LOCK_TIMEOUT_SECONDS = int(os.getenv("JOB_LOCK_TIMEOUT_SECONDS", 300))
+JOB_WORKER_PROCESSES = int(os.getenv("JOB_WORKER_PROCESSES", 1))
+JOB_RETENTION_DAYS = int(os.getenv("JOB_RETENTION_DAYS", 7))
+
+# Periodic jobs (`python manage.py run_scheduler`): only the instance holding
+# the database lease runs them. It renews the lease every RENEW seconds; if it
+# fails to for LEASE seconds, another instance takes over. The daily cleanup
+# is queued at CHAT_CLEANUP_HOUR (in TIME_ZONE)
+SCHEDULER_LEASE_SECONDS = int(os.getenv("SCHEDULER_LEASE_SECONDS", 60))
+SCHEDULER_LEASE_RENEW_SECONDS = int(os.getenv("SCHEDULER_LEASE_RENEW_SECONDS", 15))
+CHAT_CLEANUP_HOUR = int(os.getenv("CHAT_CLEANUP_HOUR", 3))
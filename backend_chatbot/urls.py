@@ -21,7 +21,11 @@ from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
 )
-from chat.views import MessageListView, ChatMessageCreateView, VectorStoreStatsView, AIProviderStatusView
+from chat.views import (
+    MessageListView, ChatMessageCreateView, VectorStoreStatsView, VectorStoreReindexView, VectorStoreReloadView,
+    AIProviderStatusView,
+    chat_stream, metrics
+)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -36,7 +40,11 @@ urlpatterns = [
 
     path('chat-history/', MessageListView.as_view(), name='chat_messages'),
     path('chat/', ChatMessageCreateView.as_view(), name='chat_message_create'),
+    path('chat/stream/', chat_stream, name='chat_stream'),
     path('vectorstore/stats/', VectorStoreStatsView.as_view(), name='vectorstore_stats'),
+    path('vectorstore/reindex/', VectorStoreReindexView.as_view(), name='vectorstore_reindex'),
+    path('vectorstore/reload/', VectorStoreReloadView.as_view(), name='vectorstore_reload'),
     path('ai/status/', AIProviderStatusView.as_view(), name='ai_provider_status'),
+    path('metrics/', metrics, name='metrics'),
 
 ]
@@ -1,3 +1,16 @@
 from django.contrib import admin
+from .models import Job, SchedulerLease
 
-# Register your models here.
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ("id", "name", "status", "attempts", "max_attempts", "run_after", "started_at", "finished_at", "duration")
+    list_filter = ("status", "name")
+    readonly_fields = (
+        "started_at", "heartbeat_at", "finished_at", "locked_by", "last_error", "duration", "unique_key", "created_at",
+    )
+
+
+@admin.register(SchedulerLease)
+class SchedulerLeaseAdmin(admin.ModelAdmin):
+    list_display = ("name", "holder", "expires_at")
@@ -1,17 +1,46 @@
+from collections import namedtuple
 from django.conf import settings
-from .gemini_client import embed_text as gemini_embed, chat_with_context as gemini_chat
+from . import gemini_client
 from .openai_client import OpenAIClient
+from .fake_provider import FakeProvider
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .embedding_cache import embedding_cache
+from .metrics import ai_call_seconds, ai_fallbacks, ai_circuit_rejections
 import logging
+import time
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+# ``client`` is anything with the OpenAIClient interface: EMBED_MODEL, EMBED_DIM,
+# MAX_EMBED_BATCH, embed_texts, chat_with_context, stream_chat_with_context
+Provider = namedtuple("Provider", "key name client")
+
+
+def embedding_namespace(provider: Provider) -> str:
+    """
+    Name of the vector space ``provider`` embeds into, "key:model:dim".
+    Vectors are only comparable within one namespace, so the vector store
+    keeps an index per namespace.
+    """
+    return f"{provider.key}:{provider.client.EMBED_MODEL}:{provider.client.EMBED_DIM}"
+
+
+def namespace_dim(namespace: str) -> int:
+    return int(namespace.rsplit(":", 1)[1])
+
 class AIClient:
     """
     Unified AI client that prioritizes Google (Gemini) over OpenAI.
     Priority: Google > OpenAI
+
+    Each provider has a circuit breaker. A provider that keeps failing or
+    responding slowly is skipped without being called until its breaker
+    lets a probe request through, so requests go straight to the fallback
+    instead of waiting for the failing provider to time out every time.
     """
     
-    def __init__(self):
+    def __init__(self, providers: list = None):
         self.google_available = bool(settings.GOOGLE_API_KEY and settings.GOOGLE_API_KEY.strip())
         self.openai_available = bool(settings.OPENAI_API_KEY and settings.OPENAI_API_KEY.strip())
         
@@ -23,84 +52,244 @@ class AIClient:
                 logger.error(f"Failed to initialize OpenAI client: {e}")
                 self.openai_available = False
         
-        if not self.google_available and not self.openai_available:
+        providers = self._default_providers() if providers is None else providers
+        if not providers:
             raise ValueError("No AI API keys configured. Please set GOOGLE_API_KEY or OPENAI_API_KEY.")
+        self.set_providers(providers)
+
+    def set_providers(self, providers: list):
+        """Replace the providers (in priority order), with fresh circuit breakers."""
+        self.providers = providers
+        self.breakers = {
+            provider.key: CircuitBreaker(
+                provider.name,
+                window_seconds=settings.AI_BREAKER_WINDOW_SECONDS,
+                min_calls=settings.AI_BREAKER_MIN_CALLS,
+                failure_rate=settings.AI_BREAKER_FAILURE_RATE,
+                slow_call_seconds=settings.AI_BREAKER_SLOW_CALL_SECONDS,
+                open_seconds=settings.AI_BREAKER_OPEN_SECONDS,
+            )
+            for provider in self.providers
+        }
+
+    def _default_providers(self):
+        """Configured providers in priority order."""
+        if settings.AI_FAKE_PROVIDER:
+            fake = FakeProvider(
+                latency=settings.AI_FAKE_PROVIDER_LATENCY,
+                failure_rate=settings.AI_FAKE_PROVIDER_FAILURE_RATE,
+            )
+            return [Provider("fake", "Fake Provider", fake)]
+
+        providers = []
+        if self.google_available:
+            providers.append(Provider("google", "Google Gemini", gemini_client))
+        if self.openai_available:
+            providers.append(Provider("openai", "OpenAI", self.openai_client))
+        return providers
     
     def get_active_provider(self):
-        """Returns the name of the currently active AI provider."""
-        if self.google_available:
-            return "Google Gemini"
-        elif self.openai_available:
-            return "OpenAI"
-        else:
-            return "None"
+        """Returns the name of the provider the next request will be sent to."""
+        for provider in self.providers:
+            if self.breakers[provider.key].is_available():
+                return provider.name
+        return "None"
     
+    def provider_key(self, name: str) -> str:
+        """Key of the provider called ``name``, as returned by ``chat_with_context``."""
+        return next((provider.key for provider in self.providers if provider.name == name), "")
+
+    def is_fallback(self, key: str) -> bool:
+        """Whether work served by provider ``key`` skipped a higher-priority provider."""
+        return bool(self.providers) and key != self.providers[0].key
+
+    def embedding_namespaces(self, keys: list = None):
+        """
+        Embedding namespaces of the providers (only those in ``keys``, if
+        given), in priority order.
+        """
+        return [
+            embedding_namespace(provider) for provider in self.providers
+            if not keys or provider.key in keys
+        ]
+
     def embed_text(self, text: str):
         """
         Generate text embeddings using the available provider.
         Priority: Google > OpenAI
         """
-        if self.google_available:
-            try:
-                return gemini_embed(text)
-            except Exception as e:
-                logger.error(f"Google embedding failed: {e}")
-                if self.openai_available:
-                    logger.info("Falling back to OpenAI for embeddings")
-                    try:
-                        return self.openai_client.embed_text(text)
-                    except Exception as e2:
-                        logger.error(f"OpenAI embedding fallback failed: {e2}")
-                        raise e2
-                else:
-                    raise e
-        
-        elif self.openai_available:
-            try:
-                return self.openai_client.embed_text(text)
-            except Exception as e:
-                logger.error(f"OpenAI embedding failed: {e}")
-                raise e
-        
-        else:
-            raise ValueError("No AI provider available for embeddings")
+        return self.embed_texts([text])[0]
     
-    def chat_with_context(self, prompt: str, context: str):
+    def embed_query(self, text: str, namespaces: list):
         """
-        Generate chat response using the available provider.
+        Embed ``text`` with the first available provider whose namespace is
+        in ``namespaces`` (those the vector store has an index for), so the
+        vector can always be searched. Returns ``(namespace, vector)``.
         Priority: Google > OpenAI
         """
-        if self.google_available:
+        namespace, embeddings = self.embed_queries([text], namespaces)
+        return namespace, embeddings[0]
+
+    def embed_queries(self, texts: list[str], namespaces: list):
+        """
+        ``embed_query`` for several texts at once, in one provider request
+        (per MAX_EMBED_BATCH). All are embedded by the same provider, so
+        they share one namespace. Returns ``(namespace, vectors)``.
+        """
+        providers = [provider for provider in self.providers if embedding_namespace(provider) in namespaces]
+        if not providers:
+            raise ValueError(
+                f"None of the configured AI providers embeds into the vector store's namespaces "
+                f"({', '.join(namespaces)}); rebuild it with `python manage.py rebuild_vectorstore`"
+            )
+        provider, embeddings = self._with_fallback("embedding", self._embedder(texts), providers)
+        return embedding_namespace(provider), embeddings
+
+    def embed_texts(self, texts: list[str], batch_size: int = None, namespace: str = None):
+        """
+        Generate embeddings for many texts, sending them to the provider in
+        batches instead of one request per text. Results keep input order.
+        With ``namespace`` only the provider embedding into it is used, with
+        no fallback, so all the vectors of an index come from one model.
+        Without it, the provider that embeds the first batch embeds them all:
+        vectors of different providers are never mixed in one result.
+        Priority: Google > OpenAI
+        """
+        providers = None
+        if namespace is not None:
+            providers = [provider for provider in self.providers if embedding_namespace(provider) == namespace]
+            if not providers:
+                raise ValueError(f"No configured AI provider embeds into {namespace}")
+        batch_size = batch_size or settings.EMBEDDING_BATCH_SIZE
+        embeddings = []
+        for start in range(0, len(texts), batch_size):
+            provider, batch = self._with_fallback(
+                "embedding", self._embedder(texts[start:start + batch_size]), providers
+            )
+            providers = [provider]
+            embeddings.extend(batch)
+        return embeddings
+
+    def _embedder(self, texts: list[str]):
+        """A ``_with_fallback`` call embedding one batch, split further to respect each provider's limit."""
+        def embed(provider):
+            # Cache hits need no request, so only misses go through the breaker
+            return _cached_embed(
+                provider.key, provider.client.EMBED_MODEL,
+                lambda batch: self._call(provider, provider.client.embed_texts, batch),
+                provider.client.MAX_EMBED_BATCH, texts
+            )
+        return embed
+    
+    def chat_with_context(self, prompt: str, context: str, history: str = ""):
+        """
+        Generate chat response using the available provider. ``history`` is
+        the conversation so far (see chat.memory), or "" for a first message.
+        Returns ``(provider name, response)``: the provider that answered,
+        which after a failover isn't necessarily ``get_active_provider()``.
+        Priority: Google > OpenAI
+        """
+        provider, response = self._with_fallback(
+            "chat",
+            lambda provider: self._call(provider, provider.client.chat_with_context, prompt, context, history)
+        )
+        logger.info(f"Response generated using {provider.name}")
+        return provider.name, response
+
+    def _call(self, provider: Provider, fn, *args):
+        """Call ``fn(*args)`` on ``provider`` through its circuit breaker."""
+        breaker = self.breakers[provider.key]
+        if not breaker.allow_request():
+            ai_circuit_rejections.inc(provider=provider.key)
+            raise CircuitOpenError(f"{provider.name} circuit breaker is open")
+        start = time.monotonic()
+        try:
+            result = fn(*args)
+        except Exception:
+            latency = time.monotonic() - start
+            breaker.record_failure(latency)
+            ai_call_seconds.observe(latency, provider=provider.key, operation=fn.__name__, outcome="error")
+            raise
+        latency = time.monotonic() - start
+        breaker.record_success(latency)
+        ai_call_seconds.observe(latency, provider=provider.key, operation=fn.__name__, outcome="success")
+        return result
+
+    def _with_fallback(self, operation: str, call, providers: list = None):
+        """
+        Return ``(provider, call(provider))`` for the first provider, in
+        priority order, that succeeds (out of ``providers``, default all).
+        Providers with an open circuit are skipped; if none succeeds the
+        last error is raised.
+        """
+        error = None
+        for provider in self.providers if providers is None else providers:
+            if error is not None:
+                logger.info(f"Falling back to {provider.name} for {operation}")
+                ai_fallbacks.inc(operation=operation, provider=provider.key)
             try:
-                response = gemini_chat(prompt, context)
-                logger.info(f"Response generated using Google Gemini")
-                return response
+                return provider, call(provider)
+            except CircuitOpenError as e:
+                logger.warning(f"Skipping {provider.name} for {operation}: circuit breaker is open")
+                error = error or e
             except Exception as e:
-                logger.error(f"Google chat failed: {e}")
-                if self.openai_available:
-                    logger.info("Falling back to OpenAI for chat")
-                    try:
-                        response = self.openai_client.chat_with_context(prompt, context)
-                        logger.info(f"Response generated using OpenAI (fallback)")
-                        return response
-                    except Exception as e2:
-                        logger.error(f"OpenAI chat fallback failed: {e2}")
-                        raise e2
-                else:
-                    raise e
-        
-        elif self.openai_available:
+                logger.error(f"{provider.name} {operation} failed: {e}")
+                error = e
+        raise error
+    
+    async def stream_chat_with_context(self, prompt: str, context: str, history: str = ""):
+        """
+        Async generator yielding ``(provider, text)`` pieces of the response as
+        they are generated. Falls back to the next provider only if one fails
+        before producing any output; a failure mid-stream is raised to the
+        caller. The breaker judges latency by the time to the first piece.
+        Priority: Google > OpenAI
+        """
+        error = None
+        for provider in self.providers:
+            breaker = self.breakers[provider.key]
+            if not breaker.allow_request():
+                ai_circuit_rejections.inc(provider=provider.key)
+                logger.warning(f"Skipping {provider.name} for streaming chat: circuit breaker is open")
+                error = error or CircuitOpenError(f"{provider.name} circuit breaker is open")
+                continue
+            if error is not None:
+                logger.info(f"Falling back to {provider.name} for streaming chat")
+                ai_fallbacks.inc(operation="streaming chat", provider=provider.key)
+
+            start = time.monotonic()
+            started = False
             try:
-                response = self.openai_client.chat_with_context(prompt, context)
-                logger.info(f"Response generated using OpenAI")
-                return response
+                async for text in provider.client.stream_chat_with_context(prompt, context, history):
+                    if not started:
+                        started = True
+                        self._record_stream(provider, breaker, time.monotonic() - start)
+                    yield provider.name, text
+                if not started:
+                    # Empty but successful response
+                    self._record_stream(provider, breaker, time.monotonic() - start)
+                return
             except Exception as e:
-                logger.error(f"OpenAI chat failed: {e}")
-                raise e
-        
-        else:
-            raise ValueError("No AI provider available for chat")
+                logger.error(f"{provider.name} streaming chat failed: {e}")
+                if started:
+                    raise
+                breaker.record_failure(time.monotonic() - start)
+                ai_call_seconds.observe(
+                    time.monotonic() - start, provider=provider.key,
+                    operation="stream_chat_with_context", outcome="error"
+                )
+                error = e
+            finally:
+                if not started:
+                    # Cancelled (e.g. client disconnected) before any output
+                    breaker.release()
+        raise error
     
+    @staticmethod
+    def _record_stream(provider, breaker, latency):
+        breaker.record_success(latency)
+        ai_call_seconds.observe(latency, provider=provider.key, operation="stream_chat_with_context", outcome="success")
+
     def get_provider_status(self):
         """Returns status information about available providers."""
         return {
@@ -108,8 +297,33 @@ class AIClient:
             "openai_available": self.openai_available,
             "active_provider": self.get_active_provider(),
             "google_api_key_set": bool(settings.GOOGLE_API_KEY and settings.GOOGLE_API_KEY.strip()),
-            "openai_api_key_set": bool(settings.OPENAI_API_KEY and settings.OPENAI_API_KEY.strip())
+            "openai_api_key_set": bool(settings.OPENAI_API_KEY and settings.OPENAI_API_KEY.strip()),
+            "circuit_breakers": {
+                provider.name: self.breakers[provider.key].get_status() for provider in self.providers
+            },
+            "embedding_cache": embedding_cache.get_stats()
         }
 
+def _split_batches(embed_fn, texts, max_batch):
+    """Call ``embed_fn`` on consecutive slices of at most ``max_batch`` texts."""
+    embeddings = []
+    for start in range(0, len(texts), max_batch):
+        embeddings.extend(embed_fn(texts[start:start + max_batch]))
+    return embeddings
+
+def _cached_embed(provider, model, embed_fn, max_batch, texts):
+    """
+    Embed ``texts`` with ``embed_fn``, serving repeats from the embedding
+    cache and only sending cache misses (deduplicated) to the provider.
+    """
+    vectors = embedding_cache.get_many(provider, model, texts)
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+    if missing:
+        fresh = [np.asarray(vector, dtype="float32") for vector in _split_batches(embed_fn, missing, max_batch)]
+        embedding_cache.set_many(provider, model, missing, fresh)
+        by_text = dict(zip(missing, fresh))
+        vectors = [by_text[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+    return vectors
+
 # Global instance
 ai_client = AIClient()
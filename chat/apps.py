@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.conf import settings
 import sys
 
 
@@ -7,9 +8,16 @@ class ChatConfig(AppConfig):
     name = 'chat'
 
     def ready(self):
-        import chat.signals  # Ensure signals are imported to connect them
-        
+        # Pin FAISS's thread pool before any search runs
+        from chat.indexes import configure_threads
+        configure_threads()
+
         # Initialize vector store only for runserver command
         if len(sys.argv) > 1 and sys.argv[1] == 'runserver':
             from chat.views import initialize_vector_store
-            initialize_vector_store()
\ No newline at end of file
+            initialize_vector_store()
+
+        # Servers started with VECTORSTORE_RELOAD_ON_SIGHUP reload the vector store on SIGHUP
+        if settings.VECTORSTORE_RELOAD_ON_SIGHUP:
+            from chat.snapshots import index_manager
+            index_manager.install_signal_handler()
@@ -0,0 +1,207 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+import numpy as np
+
+# Identifiers such as "ST-7842", "v1.2" or "chat/stream" are kept whole (and
+# also indexed by their parts) so exact-match lookups work
+TOKEN = re.compile(r"[a-z0-9]+(?:[-_./:#][a-z0-9]+)*")
+TOKEN_SEPARATORS = re.compile(r"[-_./:#]")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it of on or our "
+    "that the their this to was we what when where which who why will with you your".split()
+)
+
+# Standard BM25 parameters: term frequency saturation and length normalisation
+K1 = 1.5
+B = 0.75
+
+# On-disk layout: the postings of term vocabulary[i] are
+# posting_ids/posting_tfs[term_offsets[i]:term_offsets[i + 1]]
+BM25_VOCABULARY_FILENAME = "bm25_vocabulary.json"
+BM25_ARRAY_FILENAMES = {
+    "term_offsets": "bm25_term_offsets.npy",
+    "posting_ids": "bm25_posting_ids.npy",
+    "posting_tfs": "bm25_posting_tfs.npy",
+    "doc_ids": "bm25_doc_ids.npy",
+    "doc_lengths": "bm25_doc_lengths.npy",
+}
+
+
+def tokenize(text: str):
+    tokens = []
+    for match in TOKEN.finditer(text.lower()):
+        token = match.group()
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in TOKEN_SEPARATORS.split(token) if part and part not in STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    """
+    Inverted index scoring chunks with BM25, keyed by the same chunk IDs as
+    the FAISS index.
+
+    Like ChunkStore, the postings are stored as flat arrays (CSR: one
+    offsets array per term into concatenated chunk IDs and term counts),
+    which can be memory-mapped. Chunks added after loading go to a small
+    in-memory delta and removed chunks are masked out at query time; both
+    are merged into the arrays when the index is written.
+    """
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.term_offsets = np.zeros(1, dtype="int64")
+        self.posting_ids = np.zeros(0, dtype="int64")
+        self.posting_tfs = np.zeros(0, dtype="int32")
+        # Sorted chunk IDs and their lengths in tokens
+        self.doc_ids = np.zeros(0, dtype="int64")
+        self.doc_lengths = np.zeros(0, dtype="int32")
+        # term -> [(chunk_id, tf), ...] and chunk_id -> length, for chunks added since loading
+        self.delta_postings = {}
+        self.delta_lengths = {}
+        self.removed = set()
+        self.count = 0
+        self.total_length = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, chunk_ids, texts):
+        for chunk_id, text in zip(chunk_ids, texts):
+            chunk_id = int(chunk_id)
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                self.delta_postings.setdefault(term, []).append((chunk_id, tf))
+            length = sum(counts.values())
+            self.delta_lengths[chunk_id] = length
+            self.count += 1
+            self.total_length += length
+
+    def remove(self, chunk_ids):
+        for chunk_id in map(int, chunk_ids):
+            if chunk_id in self.removed:
+                continue
+            length = self._lengths(np.array([chunk_id], dtype="int64"))[0]
+            if length < 0:
+                continue  # Not in the index
+            self.removed.add(chunk_id)
+            self.count -= 1
+            self.total_length -= int(length)
+
+    def _lengths(self, ids):
+        """Token lengths of ``ids``; -1 for unknown IDs."""
+        lengths = np.full(len(ids), -1, dtype="int64")
+        rows = np.searchsorted(self.doc_ids, ids)
+        rows = np.minimum(rows, max(len(self.doc_ids) - 1, 0))
+        found = (self.doc_ids[rows] == ids) if len(self.doc_ids) else np.zeros(len(ids), dtype=bool)
+        lengths[found] = self.doc_lengths[rows[found]]
+        for i in np.flatnonzero(~found).tolist():
+            lengths[i] = self.delta_lengths.get(int(ids[i]), -1)
+        return lengths
+
+    def _postings(self, term):
+        """Live ``(chunk_ids, term_counts)`` arrays for ``term``."""
+        parts_ids, parts_tfs = [], []
+        row = self.vocabulary.get(term)
+        if row is not None:
+            start, end = self.term_offsets[row], self.term_offsets[row + 1]
+            parts_ids.append(np.asarray(self.posting_ids[start:end]))
+            parts_tfs.append(np.asarray(self.posting_tfs[start:end]))
+        delta = self.delta_postings.get(term)
+        if delta:
+            parts_ids.append(np.fromiter((chunk_id for chunk_id, _ in delta), dtype="int64", count=len(delta)))
+            parts_tfs.append(np.fromiter((tf for _, tf in delta), dtype="int32", count=len(delta)))
+        if not parts_ids:
+            return None, None
+
+        ids, tfs = np.concatenate(parts_ids), np.concatenate(parts_tfs)
+        if self.removed:
+            keep = ~np.isin(ids, np.fromiter(self.removed, dtype="int64", count=len(self.removed)))
+            ids, tfs = ids[keep], tfs[keep]
+        return ids, tfs
+
+    def search(self, query: str, top_k: int = 10, allowed=None):
+        """
+        Return up to ``top_k`` ``(chunk_id, score)`` pairs, best first. With
+        ``allowed`` (a sorted array of chunk IDs) only those chunks are ranked.
+        """
+        if not self.count:
+            return []
+        avg_length = self.total_length / self.count or 1.0
+        all_ids, all_scores = [], []
+        for term in set(tokenize(query)):
+            ids, tfs = self._postings(term)
+            if ids is None or not len(ids):
+                continue
+            idf = math.log(1 + (self.count - len(ids) + 0.5) / (len(ids) + 0.5))
+            lengths = self._lengths(ids)
+            tfs = tfs.astype("float64")
+            all_ids.append(ids)
+            all_scores.append(idf * tfs * (K1 + 1) / (tfs + K1 * (1 - B + B * lengths / avg_length)))
+        if not all_ids:
+            return []
+
+        ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores))
+        if allowed is not None:
+            keep = np.isin(ids, allowed, assume_unique=True)
+            ids, scores = ids[keep], scores[keep]
+        top = np.argsort(-scores, kind="stable")[:top_k]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+    # -- persistence -----------------------------------------------------
+
+    def write(self, path: str, suffix: str = ""):
+        """Merge the delta and removals into flat arrays and write them under ``path``."""
+        removed = np.fromiter(self.removed, dtype="int64", count=len(self.removed))
+        terms = sorted(set(self.vocabulary) | set(self.delta_postings))
+        offsets = np.zeros(len(terms) + 1, dtype="int64")
+        ids_parts, tfs_parts = [], []
+        vocabulary = []
+        for term in terms:
+            ids, tfs = self._postings(term)
+            if ids is None or not len(ids):
+                continue
+            vocabulary.append(term)
+            ids_parts.append(ids)
+            tfs_parts.append(tfs)
+            offsets[len(vocabulary)] = offsets[len(vocabulary) - 1] + len(ids)
+        offsets = offsets[:len(vocabulary) + 1]
+
+        delta_ids = np.fromiter(self.delta_lengths, dtype="int64", count=len(self.delta_lengths))
+        delta_lengths = np.fromiter(self.delta_lengths.values(), dtype="int32", count=len(self.delta_lengths))
+        doc_ids = np.concatenate([np.asarray(self.doc_ids), delta_ids])
+        doc_lengths = np.concatenate([np.asarray(self.doc_lengths), delta_lengths])
+        keep = ~np.isin(doc_ids, removed)
+        order = np.argsort(doc_ids[keep], kind="stable")
+
+        columns = {
+            "term_offsets": offsets,
+            "posting_ids": np.concatenate(ids_parts) if ids_parts else np.zeros(0, dtype="int64"),
+            "posting_tfs": np.concatenate(tfs_parts) if tfs_parts else np.zeros(0, dtype="int32"),
+            "doc_ids": doc_ids[keep][order],
+            "doc_lengths": doc_lengths[keep][order],
+        }
+        for name, filename in BM25_ARRAY_FILENAMES.items():
+            with open(os.path.join(path, filename + suffix), "wb") as f:
+                np.save(f, columns[name])
+        with open(os.path.join(path, BM25_VOCABULARY_FILENAME + suffix), "w", encoding="utf-8") as f:
+            json.dump(vocabulary, f, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: bool = True):
+        """Load arrays written by ``write``, memory-mapped read-only if ``mmap_mode``."""
+        index = cls()
+        for name, filename in BM25_ARRAY_FILENAMES.items():
+            setattr(index, name, np.load(os.path.join(path, filename), mmap_mode="r" if mmap_mode else None))
+        with open(os.path.join(path, BM25_VOCABULARY_FILENAME), "r", encoding="utf-8") as f:
+            index.vocabulary = {term: row for row, term in enumerate(json.load(f))}
+        index.count = len(index.doc_ids)
+        index.total_length = int(np.sum(index.doc_lengths, dtype="int64"))
+        return index
@@ -0,0 +1,165 @@
+from django.utils.module_loading import import_string
+import re
+
+# A sentence ends at . ! or ? followed by whitespace
+SENTENCE_END = re.compile(r"[.!?]\s+")
+WORD = re.compile(r"\S+")
+WHITESPACE = re.compile(r"\s+")
+
+
+def approx_token_count(text: str) -> int:
+    """Rough token count for English text (about 4 characters per token)."""
+    return max(1, (len(text) + 3) // 4)
+
+
+def load_tokenizer(path: str):
+    """
+    Resolve a CHUNK_TOKENIZER setting: a dotted path to a callable that
+    returns the number of tokens in a string, or "" to measure characters.
+    """
+    return import_string(path) if path else None
+
+
+class Chunker:
+    """
+    Splits text into overlapping chunks along sentence boundaries.
+
+    Works in one pass over sentence spans: the text is never copied or
+    re-joined, and chunks are returned as ``(start, end)`` offsets into the
+    source, so chunk text is only sliced out when it is needed. The text
+    of each chunk has its whitespace runs collapsed to single spaces, so
+    the offsets still locate it in the source but its length may differ.
+
+    Sizes are in characters, or in tokens when a ``tokenizer`` (callable
+    returning a token count) is given. A chunk is closed before the sentence
+    that would push it over ``chunk_size``; the next chunk starts with up to
+    ``chunk_overlap`` of the previous one's tail, cut at a word boundary.
+    A sentence that is larger than ``chunk_size`` on its own is split at
+    word boundaries into pieces that still fit once the overlap is added.
+    """
+
+    def __init__(self, chunk_size: int = 500, chunk_overlap: int = 50, tokenizer=None):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.tokenizer = tokenizer
+
+    def _length(self, text: str, start: int, end: int) -> int:
+        if self.tokenizer is None:
+            return end - start
+        return self.tokenizer(text[start:end])
+
+    def sentence_spans(self, text: str):
+        """Yield ``(start, end)`` of each sentence, without surrounding whitespace."""
+        start = WHITESPACE.match(text).end() if text[:1].isspace() else 0
+        text_end = len(text.rstrip())
+        for match in SENTENCE_END.finditer(text, start, text_end):
+            yield start, match.start() + 1
+            start = match.end()
+        if start < text_end:
+            yield start, text_end
+
+    def _pieces(self, text: str):
+        """Sentence spans with their lengths; oversized sentences are split at words."""
+        # Leave room for the overlap so a split sentence doesn't overflow its chunk
+        limit = max(1, self.chunk_size - self.chunk_overlap)
+        for start, end in self.sentence_spans(text):
+            length = self._length(text, start, end)
+            if length <= self.chunk_size:
+                yield start, end, length
+            elif self.tokenizer is None:
+                yield from self._split_characters(text, start, end, limit)
+            else:
+                yield from self._split_tokens(text, start, end, limit)
+
+    def _split_characters(self, text: str, start: int, end: int, limit: int):
+        while end - start > limit:
+            cut = text.rfind(" ", start, start + limit + 1)
+            if cut <= start:
+                cut = start + limit  # No space to cut at
+            piece_end = len(text[start:cut].rstrip()) + start
+            yield start, piece_end, piece_end - start
+            start = WHITESPACE.match(text, cut).end() if text[cut:cut + 1].isspace() else cut
+        if start < end:
+            yield start, end, end - start
+
+    def _split_tokens(self, text: str, start: int, end: int, limit: int):
+        piece_start, piece_end, piece_length = None, None, 0
+        for word in WORD.finditer(text, start, end):
+            word_length = self._length(text, word.start(), word.end())
+            if piece_start is not None and piece_length + word_length > limit:
+                yield piece_start, piece_end, piece_length
+                piece_start = None
+            if piece_start is None:
+                piece_start, piece_length = word.start(), 0
+            piece_end = word.end()
+            piece_length += word_length
+        if piece_start is not None:
+            yield piece_start, piece_end, piece_length
+
+    def _overlap(self, text: str, start: int, end: int):
+        """Start offset and length of the tail of ``text[start:end]`` carried into the next chunk."""
+        if self.chunk_overlap <= 0:
+            return end, 0
+        if self.tokenizer is None:
+            if end - start <= self.chunk_overlap:
+                return start, end - start
+            # Skip the partial word at the start of the overlap window
+            space = WHITESPACE.search(text, end - self.chunk_overlap, end)
+            overlap_start = space.end() if space else end - self.chunk_overlap
+            return overlap_start, end - overlap_start
+
+        # Walk back word by word while the tail fits in chunk_overlap tokens
+        overlap_start, length, position = end, 0, end
+        while position > start:
+            word_end = position
+            while position > start and not text[position - 1].isspace():
+                position -= 1
+            word_length = self._length(text, position, word_end)
+            if length + word_length > self.chunk_overlap:
+                break
+            overlap_start, length = position, length + word_length
+            while position > start and text[position - 1].isspace():
+                position -= 1
+        return overlap_start, length
+
+    def split(self, text: str):
+        """Return the ``(start, end)`` offsets of each chunk of ``text``."""
+        spans = []
+        chunk_start, chunk_end, chunk_length = None, None, 0
+        for start, end, length in self._pieces(text):
+            if chunk_start is not None and chunk_length + length > self.chunk_size:
+                spans.append((chunk_start, chunk_end))
+                chunk_start, chunk_length = self._overlap(text, chunk_start, chunk_end)
+                if chunk_length == 0:
+                    chunk_start = None
+            if chunk_start is None:
+                chunk_start = start
+            elif self.tokenizer is None:
+                # Count the separator between the overlap/previous sentence and this one
+                chunk_length += start - chunk_end
+            chunk_end = end
+            chunk_length += length
+        if chunk_start is not None:
+            spans.append((chunk_start, chunk_end))
+        return spans
+
+    def chunks(self, text: str, metadata: dict = None):
+        """
+        Split ``text`` into chunk dicts (``text`` plus ``metadata`` with the
+        chunk's index, the chunk count and its ``start``/``end`` offsets).
+        Chunk text is whitespace-normalized; the offsets refer to ``text``.
+        """
+        spans = self.split(text)
+        return [
+            {
+                "text": WHITESPACE.sub(" ", text[start:end]),
+                "metadata": {
+                    **(metadata or {}),
+                    "chunk_index": i,
+                    "total_chunks": len(spans),
+                    "start": start,
+                    "end": end,
+                },
+            }
+            for i, (start, end) in enumerate(spans)
+        ]
@@ -0,0 +1,301 @@
+import mmap
+import os
+import re
+import numpy as np
+
+# On-disk chunk columns. Row i describes the chunk with ID chunk_ids[i]; its
+# text is chunks.bin[text_offsets[i]:text_offsets[i + 1]] (UTF-8) and it came
+# from characters starts[i]:ends[i] of its source file. Rows are sorted by
+# chunk ID so lookups are a binary search.
+CHUNK_TEXT_FILENAME = "chunks.bin"
+CHUNK_ARRAY_FILENAMES = {
+    "chunk_ids": "chunk_ids.npy",
+    "text_offsets": "text_offsets.npy",
+    "file_ids": "file_ids.npy",
+    "chunk_indexes": "chunk_indexes.npy",
+    "starts": "starts.npy",
+    "ends": "ends.npy",
+}
+
+# file_ids value for chunks that were not loaded from a file
+NO_FILE = -1
+
+# Metadata fields search results can be filtered on (see ChunkStore.select).
+# Both are properties of a chunk's file, so a filter is resolved over the
+# small file table and then applied to the file_ids column.
+FILTER_FIELDS = ("filename", "category")
+
+# Trailing sequence number of a file name stem, e.g. the "_001" in hr_policy_001.txt
+SEQUENCE_SUFFIX = re.compile(r"[-_ ]?\d+$")
+
+
+def file_category(filename: str) -> str:
+    """A file's category: its name without extension and sequence number, e.g. "hr_policy"."""
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    return (SEQUENCE_SUFFIX.sub("", stem) or stem).lower()
+
+
+class ChunkStore:
+    """
+    Columnar storage for chunk texts and metadata, keyed by chunk ID.
+
+    Instead of one dict per chunk (with a nested metadata dict repeating the
+    file's name, path and chunk count), chunks are stored as:
+
+    - one concatenated UTF-8 text buffer plus an offsets array
+    - an interned file table and an int array of file IDs per chunk
+    - int arrays of chunk indexes and of start/end offsets in the source
+
+    Chunk dicts are only built for the IDs that are looked up, e.g. the
+    top-k search hits. Removed rows are masked out and dropped when the
+    store is written. Metadata that doesn't fit the columns is kept in a
+    small per-chunk dict.
+
+    A store loaded with ``mmap_mode=True`` maps the columns and text buffer
+    read-only, so processes loading the same snapshot share the memory.
+    """
+
+    def __init__(self):
+        self.chunk_ids = np.zeros(0, dtype="int64")
+        self.text_offsets = np.zeros(1, dtype="int64")
+        self.file_ids = np.zeros(0, dtype="int32")
+        self.chunk_indexes = np.zeros(0, dtype="int32")
+        self.starts = np.zeros(0, dtype="int64")
+        self.ends = np.zeros(0, dtype="int64")
+        self.alive = np.zeros(0, dtype=bool)
+        self.text = bytearray()
+        # [{"filename", "file_path", "total_chunks"}, ...] and its reverse lookup
+        self.files = []
+        self.file_lookup = {}
+        self.extra = {}
+        self.count = 0
+        # Bumped by every add/remove, so cached selections can tell they are stale
+        self.generation = 0
+
+    # -- reading ---------------------------------------------------------
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.ids().tolist())
+
+    def __contains__(self, chunk_id):
+        return self._row(chunk_id) is not None
+
+    def __getitem__(self, chunk_id):
+        row = self._row(chunk_id)
+        if row is None:
+            raise KeyError(chunk_id)
+        return self._build(row)
+
+    def get(self, chunk_id, default=None):
+        row = self._row(chunk_id)
+        return default if row is None else self._build(row)
+
+    def ids(self):
+        """IDs of all live chunks, in ascending order."""
+        return self.chunk_ids[self.alive]
+
+    def filenames(self):
+        """Names of the files that have at least one live chunk."""
+        file_ids = np.unique(self.file_ids[self.alive])
+        return sorted({self.files[file_id]["filename"] for file_id in file_ids.tolist() if file_id != NO_FILE})
+
+    def categories(self):
+        """Categories (see ``file_category``) of the files that have at least one live chunk."""
+        return sorted({file_category(filename) for filename in self.filenames()})
+
+    def select(self, filters):
+        """
+        IDs, ascending, of the live chunks matching every ``(field, values)``
+        pair of ``filters``: the chunk's file ``field`` (one of
+        FILTER_FIELDS) is one of ``values``. Chunks that didn't come from a
+        file never match.
+        """
+        keep = np.ones(len(self.files) + 1, dtype=bool)
+        # The trailing entry is indexed by NO_FILE (-1)
+        keep[-1] = False
+        for field, values in filters:
+            values = set(values)
+            for file_id, info in enumerate(self.files):
+                value = file_category(info["filename"]) if field == "category" else info[field]
+                if value not in values:
+                    keep[file_id] = False
+        return self.chunk_ids[keep[self.file_ids] & self.alive]
+
+    def _row(self, chunk_id):
+        row = int(np.searchsorted(self.chunk_ids, chunk_id))
+        if row < len(self.chunk_ids) and self.chunk_ids[row] == chunk_id and self.alive[row]:
+            return row
+        return None
+
+    def _build(self, row):
+        start, end = int(self.text_offsets[row]), int(self.text_offsets[row + 1])
+        chunk_id = int(self.chunk_ids[row])
+        file_id = int(self.file_ids[row])
+
+        if file_id == NO_FILE:
+            metadata = self.extra.get(chunk_id)
+        else:
+            file_info = self.files[file_id]
+            metadata = {
+                "filename": file_info["filename"],
+                "file_path": file_info["file_path"],
+                "category": file_category(file_info["filename"]),
+                "chunk_index": int(self.chunk_indexes[row]),
+                "total_chunks": file_info["total_chunks"],
+            }
+            if self.starts[row] >= 0:
+                metadata["start"] = int(self.starts[row])
+                metadata["end"] = int(self.ends[row])
+            metadata.update(self.extra.get(chunk_id, {}))
+        return {"text": bytes(self.text[start:end]).decode("utf-8"), "metadata": metadata}
+
+    # -- writing ---------------------------------------------------------
+
+    def add(self, chunk_ids, chunks):
+        """Append chunks; ``chunk_ids`` must be larger than every existing ID."""
+        if not len(chunks):
+            return
+        if len(self.chunk_ids) and chunk_ids[0] <= self.chunk_ids[-1]:
+            raise ValueError("Chunk IDs must be added in increasing order")
+        if not isinstance(self.text, bytearray):
+            # First write after loading a snapshot: copy the text into memory
+            self.text = bytearray(self.text)
+
+        file_ids = np.full(len(chunks), NO_FILE, dtype="int32")
+        chunk_indexes = np.full(len(chunks), -1, dtype="int32")
+        source_starts = np.full(len(chunks), -1, dtype="int64")
+        source_ends = np.full(len(chunks), -1, dtype="int64")
+        ends = np.zeros(len(chunks), dtype="int64")
+        for i, (chunk_id, chunk) in enumerate(zip(chunk_ids, chunks)):
+            metadata = dict(chunk.get("metadata") or {})
+            filename = metadata.pop("filename", None)
+            file_path = metadata.pop("file_path", None)
+            total_chunks = metadata.pop("total_chunks", None)
+            chunk_index = metadata.pop("chunk_index", None)
+            start = metadata.pop("start", -1)
+            end = metadata.pop("end", -1)
+            # Derived from the filename when read back
+            metadata.pop("category", None)
+
+            if filename is not None and chunk_index is not None:
+                file_ids[i] = self._intern_file(filename, file_path, total_chunks)
+                chunk_indexes[i] = chunk_index
+                source_starts[i] = start
+                source_ends[i] = end
+            else:
+                metadata = chunk.get("metadata")
+            if metadata:
+                self.extra[int(chunk_id)] = metadata
+
+            self.text += chunk["text"].encode("utf-8")
+            ends[i] = len(self.text)
+
+        self.chunk_ids = np.concatenate([self.chunk_ids, np.asarray(chunk_ids, dtype="int64")])
+        self.text_offsets = np.concatenate([self.text_offsets, ends])
+        self.file_ids = np.concatenate([self.file_ids, file_ids])
+        self.chunk_indexes = np.concatenate([self.chunk_indexes, chunk_indexes])
+        self.starts = np.concatenate([self.starts, source_starts])
+        self.ends = np.concatenate([self.ends, source_ends])
+        self.alive = np.concatenate([self.alive, np.ones(len(chunks), dtype=bool)])
+        self.count += len(chunks)
+        self.generation += 1
+
+    def remove(self, chunk_ids):
+        rows = [row for row in map(self._row, chunk_ids) if row is not None]
+        if rows:
+            if not self.alive.flags.writeable:
+                self.alive = self.alive.copy()
+            self.alive[rows] = False
+            self.count -= len(rows)
+            self.generation += 1
+            for chunk_id in chunk_ids:
+                self.extra.pop(int(chunk_id), None)
+
+    def _intern_file(self, filename, file_path, total_chunks):
+        key = (filename, file_path, total_chunks)
+        if key not in self.file_lookup:
+            self.file_lookup[key] = len(self.files)
+            self.files.append({"filename": filename, "file_path": file_path, "total_chunks": total_chunks})
+        return self.file_lookup[key]
+
+    # -- persistence -----------------------------------------------------
+
+    def write(self, path: str, suffix: str = ""):
+        """
+        Write the live chunks as flat columns under ``path``, each file name
+        ending in ``suffix``. Removed rows and unused files are dropped.
+
+        Returns the small part that is stored as JSON: the file table and
+        the per-chunk extra metadata.
+        """
+        rows = np.flatnonzero(self.alive)
+        used_files = np.unique(self.file_ids[rows])
+        used_files = used_files[used_files != NO_FILE]
+        file_map = np.full(len(self.files) + 1, NO_FILE, dtype="int32")
+        file_map[used_files] = np.arange(len(used_files), dtype="int32")
+        files = [self.files[file_id] for file_id in used_files.tolist()]
+
+        with open(os.path.join(path, CHUNK_TEXT_FILENAME + suffix), "wb") as f:
+            if len(rows) == len(self.alive):
+                # Nothing removed: the buffer can be written as is
+                offsets = np.asarray(self.text_offsets)
+                f.write(self.text[:offsets[-1]])
+            else:
+                offsets = np.zeros(len(rows) + 1, dtype="int64")
+                for i, row in enumerate(rows.tolist()):
+                    data = self.text[self.text_offsets[row]:self.text_offsets[row + 1]]
+                    f.write(data)
+                    offsets[i + 1] = offsets[i] + len(data)
+
+        columns = {
+            "chunk_ids": self.chunk_ids[rows],
+            "text_offsets": offsets,
+            # NO_FILE (-1) indexes the trailing NO_FILE entry of file_map
+            "file_ids": file_map[self.file_ids[rows]],
+            "chunk_indexes": self.chunk_indexes[rows],
+            "starts": self.starts[rows],
+            "ends": self.ends[rows],
+        }
+        for name, filename in CHUNK_ARRAY_FILENAMES.items():
+            with open(os.path.join(path, filename + suffix), "wb") as f:
+                np.save(f, columns[name])
+
+        return {
+            "files": files,
+            "extra": {str(chunk_id): metadata for chunk_id, metadata in self.extra.items()},
+        }
+
+    @classmethod
+    def load(cls, path: str, files: list, extra: dict, mmap_mode: bool = True):
+        """Load columns written by ``write``, memory-mapped read-only if ``mmap_mode``."""
+        store = cls()
+        arrays = {
+            name: np.load(os.path.join(path, filename), mmap_mode="r" if mmap_mode else None)
+            for name, filename in CHUNK_ARRAY_FILENAMES.items()
+        }
+        store.chunk_ids = arrays["chunk_ids"]
+        store.text_offsets = arrays["text_offsets"]
+        store.file_ids = arrays["file_ids"]
+        store.chunk_indexes = arrays["chunk_indexes"]
+        store.starts = arrays["starts"]
+        store.ends = arrays["ends"]
+        store.alive = np.ones(len(store.chunk_ids), dtype=bool)
+        store.count = len(store.chunk_ids)
+        store.files = files
+        store.file_lookup = {
+            (info["filename"], info["file_path"], info["total_chunks"]): file_id
+            for file_id, info in enumerate(files)
+        }
+        store.extra = {int(chunk_id): metadata for chunk_id, metadata in extra.items()}
+
+        with open(os.path.join(path, CHUNK_TEXT_FILENAME), "rb") as f:
+            if not mmap_mode:
+                store.text = bytearray(f.read())
+            elif os.fstat(f.fileno()).st_size == 0:
+                store.text = b""  # mmap can't map an empty file
+            else:
+                store.text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return store
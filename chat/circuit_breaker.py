@@ -0,0 +1,131 @@
+from collections import deque
+import threading
+import time
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a provider whose circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Tracks the health of one AI provider from the outcome of recent calls.
+
+    Calls are recorded in a rolling window of ``window_seconds``. A call
+    counts as bad when it raised or took longer than ``slow_call_seconds``.
+    Once the window holds at least ``min_calls`` calls and the share of bad
+    ones reaches ``failure_rate``, the breaker opens and the provider is
+    skipped without being called.
+
+    After ``open_seconds`` the breaker goes half-open and lets a single probe
+    call through: success closes it again, failure re-opens it for another
+    ``open_seconds``.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, window_seconds: float = 60, min_calls: int = 5,
+                 failure_rate: float = 0.5, slow_call_seconds: float = 10, open_seconds: float = 30):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.lock = threading.Lock()
+        # (finished_at, ok, latency) per call, oldest first
+        self.calls = deque()
+        self.state = self.CLOSED
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow_request(self) -> bool:
+        """Whether the provider may be called now. Claims the probe when half-open."""
+        with self.lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    self.rejected += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self.probe_in_flight = False
+
+            if self.state == self.HALF_OPEN:
+                if self.probe_in_flight:
+                    self.rejected += 1
+                    return False
+                self.probe_in_flight = True
+            return True
+
+    def is_available(self) -> bool:
+        """Like ``allow_request`` but without claiming the half-open probe."""
+        with self.lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self.opened_at >= self.open_seconds
+            return not (self.state == self.HALF_OPEN and self.probe_in_flight)
+
+    def record_success(self, latency: float):
+        self._record(latency <= self.slow_call_seconds, latency)
+
+    def record_failure(self, latency: float):
+        self._record(False, latency)
+
+    def _record(self, ok: bool, latency: float):
+        now = time.monotonic()
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.probe_in_flight = False
+                if ok:
+                    self.state = self.CLOSED
+                    self.calls.clear()
+                else:
+                    self._open(now)
+                return
+            if self.state == self.OPEN:
+                # A call let through before the breaker tripped; nothing to decide
+                return
+
+            self.calls.append((now, ok, latency))
+            self._prune(now)
+            bad = sum(1 for _, call_ok, _ in self.calls if not call_ok)
+            if len(self.calls) >= self.min_calls and bad / len(self.calls) >= self.failure_rate:
+                self._open(now)
+
+    def _open(self, now: float):
+        self.state = self.OPEN
+        self.opened_at = now
+        self.times_opened += 1
+        self.calls.clear()
+
+    def _prune(self, now: float):
+        while self.calls and now - self.calls[0][0] > self.window_seconds:
+            self.calls.popleft()
+
+    def release(self):
+        """Give back a half-open probe whose call ended without an outcome (e.g. cancelled)."""
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                self.probe_in_flight = False
+
+    def get_status(self):
+        with self.lock:
+            self._prune(time.monotonic())
+            calls = len(self.calls)
+            bad = sum(1 for _, ok, _ in self.calls if not ok)
+            latencies = sorted(latency for _, _, latency in self.calls)
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = max(0.0, self.open_seconds - (time.monotonic() - self.opened_at))
+            return {
+                "state": self.state,
+                "window_calls": calls,
+                "failure_rate": round(bad / calls, 4) if calls else 0.0,
+                "p50_latency_ms": round(latencies[calls // 2] * 1000, 1) if calls else None,
+                "max_latency_ms": round(latencies[-1] * 1000, 1) if calls else None,
+                "retry_in_seconds": round(retry_in, 1) if retry_in is not None else None,
+                "times_opened": self.times_opened,
+                "rejected_calls": self.rejected,
+            }
@@ -0,0 +1,230 @@
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from .ai_client import ai_client
+from .metrics import embedding_batch_size, search_batch_size
+import asyncio
+import logging
+import queue
+import threading
+import time
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Coalescer:
+    """
+    Micro-batches work from concurrent requests.
+
+    Each caller's item goes into a queue. A dispatcher thread takes the first
+    waiting item, collects whatever else arrives within ``window_ms`` (or
+    until ``max_batch`` items are waiting) and hands the items to
+    ``process`` in one call per batch key, then resolves each caller's
+    Future with its result. An item that arrives while the coalescer is
+    idle (no other item waiting, no batch in flight) is processed at once,
+    so the window only costs latency under load. Up to ``workers`` batches
+    are processed at once, so a slow batch doesn't hold back the next one.
+    If ``process`` raises, every item of its batch fails with the error.
+    ``window_ms`` of 0 disables batching: subclasses then do each item on
+    its own, in the caller's thread.
+    """
+
+    name = "coalescer"
+
+    def __init__(self, window_ms: float = 5, max_batch: int = 32, workers: int = 4):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.workers = workers
+        self.enabled = window_ms > 0 and max_batch > 1
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.dispatcher = None
+        self.executor = None
+        # Batches handed to the executor and not finished yet
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+
+    def process(self, key, items: list) -> list:
+        """Results for ``items`` (all queued with ``key``), in order."""
+        raise NotImplementedError
+
+    def submit(self, key, item) -> Future:
+        """Queue ``item`` to be processed with others of the same (hashable) ``key``."""
+        self._start()
+        future = Future()
+        self.queue.put((key, item, future))
+        return future
+
+    def wait(self, future: Future, timeout: float):
+        """
+        ``future.result()``, giving up after ``timeout`` seconds. The item
+        is dropped from its batch if the batch hasn't started yet.
+        """
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            logger.warning(f"{self.name}: no result after {timeout:.1f}s")
+            raise
+
+    async def await_result(self, future: Future, timeout: float):
+        """``wait`` for asyncio code: awaits the result without blocking the event loop."""
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            logger.warning(f"{self.name}: no result after {timeout:.1f}s")
+            raise
+
+    def _start(self):
+        # Started on first use, so each worker process gets its own thread
+        if self.dispatcher is not None:
+            return
+        with self.lock:
+            if self.dispatcher is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{self.name}-batch")
+                self.dispatcher = threading.Thread(target=self._dispatch, name=self.name, daemon=True)
+                self.dispatcher.start()
+
+    def _dispatch(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window
+            # Idle: there is nothing to batch with, so don't wait for the window
+            while len(batch) < self.max_batch and (self.in_flight or not self.queue.empty()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            by_key = {}
+            for key, item, future in batch:
+                by_key.setdefault(key, []).append((item, future))
+            for key, entries in by_key.items():
+                with self.in_flight_lock:
+                    self.in_flight += 1
+                self.executor.submit(self._process_batch, key, entries)
+
+    def _process_batch(self, key, entries: list):
+        try:
+            # Callers that gave up (cancelled futures) are left out
+            entries = [(item, future) for item, future in entries if future.set_running_or_notify_cancel()]
+            if not entries:
+                return
+            try:
+                results = self.process(key, [item for item, _ in entries])
+            except Exception as e:
+                for _, future in entries:
+                    future.set_exception(e)
+                return
+            for (_, future), result in zip(entries, results):
+                future.set_result(result)
+        finally:
+            with self.in_flight_lock:
+                self.in_flight -= 1
+
+
+class EmbeddingCoalescer(Coalescer):
+    """
+    Embeds the queries of concurrent requests with one
+    ``ai_client.embed_queries`` call per batch. Under load that turns N
+    concurrent provider requests into one, keeping upstream QPS and rate
+    limits in check, for a few milliseconds of added latency. Queries
+    searched against different namespaces are batched separately.
+
+    A caller waits at most AI_REQUEST_TIMEOUT per namespace (each provider
+    call is bounded by it, and a batch falls back through at most that many
+    providers) plus the window.
+    """
+
+    name = "embed-coalescer"
+
+    def __init__(self, window_ms: float = 5, max_batch: int = 32, workers: int = 4, client=None):
+        super().__init__(window_ms, max_batch, workers)
+        self.client = client or ai_client
+
+    def embed(self, text: str, namespaces: list):
+        """Embed ``text`` like ``ai_client.embed_query``, batched with concurrent callers."""
+        if not self.enabled:
+            return self.client.embed_query(text, namespaces)
+        return self.wait(self.submit(tuple(namespaces), text), self._timeout(namespaces))
+
+    async def aembed(self, text: str, namespaces: list):
+        """``embed`` for asyncio code: waits for the batch without blocking the event loop."""
+        if not self.enabled:
+            return await sync_to_async(self.client.embed_query, thread_sensitive=False)(text, namespaces)
+        return await self.await_result(self.submit(tuple(namespaces), text), self._timeout(namespaces))
+
+    def _timeout(self, namespaces):
+        return settings.AI_REQUEST_TIMEOUT * max(len(namespaces), 1) + self.window
+
+    def process(self, namespaces, texts):
+        embedding_batch_size.observe(len(texts))
+        namespace, vectors = self.client.embed_queries(texts, list(namespaces))
+        return [(namespace, vector) for vector in vectors]
+
+
+class SearchCoalescer(Coalescer):
+    """
+    Runs the vector searches of concurrent requests as one
+    ``VectorStore.search_many`` call per batch, so they share a single FAISS
+    search (and its OpenMP threads) instead of each competing for the cores.
+    Searches of different stores, namespaces, ``top_k`` or filters are
+    batched separately.
+    """
+
+    name = "search-coalescer"
+
+    def __init__(self, window_ms: float = 0, max_batch: int = 64, workers: int = 1, timeout: float = 10):
+        super().__init__(window_ms, max_batch, workers)
+        self.timeout = timeout
+
+    def search(self, vector_store, query_vec, top_k: int = 3, lexical: list = None, namespace: str = None,
+               filters=None):
+        """``vector_store.search_by_vector``, batched with concurrent callers."""
+        if not self.enabled:
+            return vector_store.search_by_vector(
+                query_vec, top_k=top_k, lexical=lexical, namespace=namespace, filters=filters
+            )
+        future = self.submit(self._key(vector_store, namespace, top_k, filters), (query_vec, lexical))
+        return self.wait(future, self.timeout)
+
+    async def asearch(self, vector_store, query_vec, top_k: int = 3, lexical: list = None, namespace: str = None,
+                      filters=None):
+        """``search`` for asyncio code: waits for the batch without blocking the event loop."""
+        if not self.enabled:
+            return await sync_to_async(vector_store.search_by_vector, thread_sensitive=False)(
+                query_vec, top_k=top_k, lexical=lexical, namespace=namespace, filters=filters
+            )
+        future = self.submit(self._key(vector_store, namespace, top_k, filters), (query_vec, lexical))
+        return await self.await_result(future, self.timeout)
+
+    @staticmethod
+    def _key(vector_store, namespace, top_k, filters):
+        return vector_store, namespace, top_k, vector_store.normalize_filters(filters)
+
+    def process(self, key, queries):
+        vector_store, namespace, top_k, filters = key
+        search_batch_size.observe(len(queries))
+        query_vecs = np.vstack([np.asarray(query_vec, dtype="float32").reshape(1, -1) for query_vec, _ in queries])
+        return vector_store.search_many(
+            query_vecs, top_k, lexicals=[lexical for _, lexical in queries], namespace=namespace, filters=filters
+        )
+
+
+# Global instances
+embedding_coalescer = EmbeddingCoalescer(
+    window_ms=settings.EMBED_COALESCE_WINDOW_MS,
+    max_batch=settings.EMBED_COALESCE_MAX_BATCH,
+    workers=settings.EMBED_COALESCE_WORKERS,
+)
+search_coalescer = SearchCoalescer(
+    window_ms=settings.SEARCH_COALESCE_WINDOW_MS,
+    max_batch=settings.SEARCH_COALESCE_MAX_BATCH,
+    workers=1,
+    timeout=settings.SEARCH_COALESCE_TIMEOUT_SECONDS,
+)
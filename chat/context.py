@@ -0,0 +1,188 @@
+from django.conf import settings
+import numpy as np
+from .chunker import approx_token_count, load_tokenizer
+
+
+class ContextPacker:
+    """
+    Turns ranked search hits into the passages sent to the LLM.
+
+    1. Relevance cutoff: vector hits further from the query than
+       ``distance_ratio`` times the distance of the closest hit (0 disables)
+       are dropped (no cut is made when the closest hit matches exactly,
+       at distance 0), as are keyword-only hits scoring under ``bm25_ratio``
+       times the best BM25 score. Both are relative to the best hit, so
+       they don't depend on the scale of the embedding model's distances.
+       The best hit is always kept, so k follows the query instead of
+       being fixed.
+    2. Optional MMR (``mmr_lambda`` < 1): hits are re-ranked by maximal
+       marginal relevance using their stored vectors, so near-duplicates
+       give way to chunks adding something new.
+    3. Consecutive chunks of the same file are merged into one passage and
+       the text they share (the chunker's overlap) is kept once; the
+       chunks' ``start``/``end`` offsets tell whether they overlap at all.
+    4. Passages are added, best first, while they fit in ``token_budget``
+       prompt tokens; the first one is cut to fit if it is too long alone.
+
+    Packed passages look like search results (``text`` and ``metadata``),
+    with ``last_chunk_index`` and ``chunk_ids`` added for merged chunks.
+    """
+
+    def __init__(self, distance_ratio: float = 0.0, bm25_ratio: float = 0.0, mmr_lambda: float = 1.0,
+                 token_budget: int = 0, tokenizer=None):
+        self.distance_ratio = distance_ratio
+        self.bm25_ratio = bm25_ratio
+        self.mmr_lambda = mmr_lambda
+        self.token_budget = token_budget
+        self.count_tokens = tokenizer or approx_token_count
+
+    def pack(self, docs: list, query_vec=None, vector_store=None, namespace: str = None):
+        """
+        Pack ``docs`` (ranked search results). MMR needs the ``query_vec``
+        the docs were searched with, and the ``vector_store`` and
+        ``namespace`` to look their vectors up in; without them it is
+        skipped.
+        """
+        docs = self.select(docs)
+        if self.mmr_lambda < 1 and query_vec is not None and vector_store is not None and len(docs) > 2:
+            docs = self.diversify(docs, query_vec, vector_store, namespace)
+        return self.fit(self.merge(docs))
+
+    def select(self, docs: list):
+        """The hits that pass the relevance cutoff, in rank order."""
+        if not docs:
+            return []
+        best_bm25 = max((doc.get("bm25_score", 0.0) for doc in docs), default=0.0)
+        best_distance = min((doc["distance"] for doc in docs if "distance" in doc), default=0.0)
+        # A ratio of an exact match's distance (0) would cut every other hit
+        cut = self.distance_ratio and best_distance > 0
+        max_distance = self.distance_ratio * best_distance
+
+        def relevant(doc):
+            if "distance" in doc and (not cut or doc["distance"] <= max_distance):
+                return True
+            return "bm25_score" in doc and doc["bm25_score"] >= self.bm25_ratio * best_bm25
+
+        return [docs[0], *(doc for doc in docs[1:] if relevant(doc))]
+
+    def diversify(self, docs: list, query_vec, vector_store, namespace: str = None):
+        """Re-rank ``docs`` by maximal marginal relevance (cosine similarities)."""
+        namespace = namespace or vector_store.namespaces[0]
+        vectors = [vector_store._reconstruct(doc.get("id"), namespace) for doc in docs]
+        if any(vector is None for vector in vectors):
+            return docs
+        vectors = _unit(np.vstack(vectors))
+        relevance = vectors @ _unit(np.asarray(query_vec, dtype="float32").reshape(1, -1))[0]
+        similarity = vectors @ vectors.T
+
+        chosen = [0]
+        remaining = list(range(1, len(docs)))
+        while remaining:
+            redundancy = similarity[np.ix_(remaining, chosen)].max(axis=1)
+            scores = self.mmr_lambda * relevance[remaining] - (1 - self.mmr_lambda) * redundancy
+            chosen.append(remaining.pop(int(np.argmax(scores))))
+        return [docs[i] for i in chosen]
+
+    def merge(self, docs: list):
+        """
+        Merge hits that are consecutive chunks of the same file into
+        passages, ordered by their best-ranked chunk.
+        """
+        by_file = {}
+        for rank, doc in enumerate(docs):
+            metadata = doc.get("metadata") or {}
+            key = metadata.get("filename") if "chunk_index" in metadata else None
+            by_file.setdefault(key or ("", rank), []).append((rank, doc))
+
+        passages = []
+        for hits in by_file.values():
+            hits.sort(key=lambda hit: (hit[1].get("metadata") or {}).get("chunk_index", 0))
+            run = [hits[0]]
+            for hit in hits[1:]:
+                previous = run[-1][1]["metadata"]
+                if hit[1]["metadata"]["chunk_index"] == previous["chunk_index"] + 1:
+                    run.append(hit)
+                else:
+                    passages.append(_join(run))
+                    run = [hit]
+            passages.append(_join(run))
+        passages.sort(key=lambda passage: passage[0])
+        return [passage for _, passage in passages]
+
+    def fit(self, passages: list):
+        """The passages that fit in the token budget, best first."""
+        if not self.token_budget:
+            return passages
+        packed, used = [], 0
+        for passage in passages:
+            tokens = self.count_tokens(passage["text"])
+            if not packed and tokens > self.token_budget:
+                # The best passage alone is over budget; send as much of it as fits
+                packed.append({**passage, "text": self._truncate(passage["text"], self.token_budget)})
+                break
+            if used + tokens <= self.token_budget:
+                packed.append(passage)
+                used += tokens
+        return packed
+
+    def _truncate(self, text: str, max_tokens: int) -> str:
+        """Cut ``text`` at a word boundary to at most ``max_tokens`` tokens."""
+        while len(text) > 1 and self.count_tokens(text) > max_tokens:
+            limit = max(1, int(len(text) * max_tokens / self.count_tokens(text)) - 1)
+            cut = text.rfind(" ", 0, limit)
+            text = text[:cut if cut > 0 else limit].rstrip()
+        return text
+
+
+def _join(run):
+    """Merge a run of consecutive chunks, ``[(rank, doc), ...]``, into ``(best rank, passage)``."""
+    rank, first = min(hit[0] for hit in run), run[0][1]
+    if len(run) == 1:
+        return rank, first
+    text = first["text"]
+    previous = first["metadata"]
+    for _, doc in run[1:]:
+        metadata = doc["metadata"]
+        if "start" in metadata and "end" in previous and previous["end"] <= metadata["start"]:
+            # The offsets show the chunks don't overlap in the source file
+            addition = doc["text"]
+        else:
+            # Chunk text is whitespace-normalized, so find the shared text itself
+            addition = doc["text"][_overlap_length(text, doc["text"]):].lstrip()
+        if addition:
+            text += " " + addition
+        previous = metadata
+
+    last = run[-1][1]["metadata"]
+    metadata = {**first["metadata"], "last_chunk_index": last["chunk_index"]}
+    if "end" in last:
+        metadata["end"] = last["end"]
+    return rank, {
+        **first,
+        "text": text,
+        "metadata": metadata,
+        "chunk_ids": [doc.get("id") for _, doc in run],
+    }
+
+
+def _overlap_length(previous: str, text: str, limit: int = 1000) -> int:
+    """Length of the longest prefix of ``text`` that ``previous`` ends with (up to ``limit`` characters)."""
+    for length in range(min(len(previous), len(text), limit), 0, -1):
+        if previous.endswith(text[:length]):
+            return length
+    return 0
+
+
+def _unit(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+# Global instance
+context_packer = ContextPacker(
+    distance_ratio=settings.CONTEXT_DISTANCE_RATIO,
+    bm25_ratio=settings.CONTEXT_BM25_RATIO,
+    mmr_lambda=settings.CONTEXT_MMR_LAMBDA,
+    token_budget=settings.CONTEXT_TOKEN_BUDGET,
+    tokenizer=load_tokenizer(settings.CHUNK_TOKENIZER),
+)
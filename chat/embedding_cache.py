@@ -0,0 +1,117 @@
+from django.conf import settings
+from cachetools import LRUCache
+import hashlib
+import logging
+import sqlite3
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of embedding vectors.
+
+    Entries are keyed by (provider, model, sha256(text)) so a vector is only
+    reused for the exact model that produced it. Lookups go to an in-memory
+    LRU first and then to an optional SQLite file that survives restarts and
+    can be shared by several processes.
+    """
+
+    def __init__(self, maxsize: int = 10000, db_path: str = ""):
+        self.enabled = maxsize > 0
+        self.memory = LRUCache(maxsize=max(maxsize, 1))
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+
+        self.db = None
+        if self.enabled and db_path:
+            try:
+                self.db = sqlite3.connect(db_path, check_same_thread=False)
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+                )
+                self.db.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Embedding cache database unavailable ({db_path}): {e}")
+                self.db = None
+
+    @staticmethod
+    def make_key(provider: str, model: str, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{provider}:{model}:{digest}"
+
+    def get_many(self, provider: str, model: str, texts: list[str]):
+        """Return cached vectors for ``texts``, with None for every miss."""
+        if not self.enabled:
+            return [None] * len(texts)
+
+        keys = [self.make_key(provider, model, text) for text in texts]
+        vectors = []
+        with self.lock:
+            for key in keys:
+                vectors.append(self.memory.get(key))
+
+            missing = [i for i, vector in enumerate(vectors) if vector is None]
+            if missing and self.db is not None:
+                placeholders = ",".join("?" * len(missing))
+                rows = dict(self.db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    [keys[i] for i in missing],
+                ).fetchall())
+                for i in missing:
+                    blob = rows.get(keys[i])
+                    if blob is not None:
+                        vectors[i] = np.frombuffer(blob, dtype="float32")
+                        self.memory[keys[i]] = vectors[i]
+                        self.persistent_hits += 1
+
+            hit_count = sum(vector is not None for vector in vectors)
+            self.hits += hit_count
+            self.misses += len(texts) - hit_count
+        return vectors
+
+    def set_many(self, provider: str, model: str, texts: list[str], vectors):
+        if not self.enabled:
+            return
+
+        items = [
+            (self.make_key(provider, model, text), np.asarray(vector, dtype="float32"))
+            for text, vector in zip(texts, vectors)
+        ]
+        with self.lock:
+            for key, vector in items:
+                self.memory[key] = vector
+            if self.db is not None:
+                try:
+                    self.db.executemany(
+                        "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                        [(key, vector.tobytes()) for key, vector in items],
+                    )
+                    self.db.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to persist embeddings: {e}")
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "persistent": self.db is not None,
+            "size": len(self.memory),
+            "max_size": self.memory.maxsize if self.enabled else 0,
+            "hits": self.hits,
+            "persistent_hits": self.persistent_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# Global instance
+embedding_cache = EmbeddingCache(
+    maxsize=settings.EMBEDDING_CACHE_SIZE,
+    db_path=settings.EMBEDDING_CACHE_DB,
+)
@@ -0,0 +1,64 @@
+import asyncio
+import hashlib
+import random
+import time
+import numpy as np
+
+
+class FakeProviderError(Exception):
+    """Failure injected by FakeProvider."""
+
+
+class FakeProvider:
+    """
+    Offline stand-in for an AI provider with the same interface as
+    OpenAIClient, for local testing and benchmarks without API keys.
+
+    Embeddings are deterministic unit vectors seeded from the text, so the
+    same text always gets the same vector. Chat answers echo the question.
+    ``latency`` (seconds) is added to every call and ``failure_rate`` of the
+    calls raise FakeProviderError, to exercise timeouts and circuit breakers.
+    """
+
+    CHAT_MODEL = "fake-chat"
+    EMBED_MODEL = "fake-embedding"
+    MAX_EMBED_BATCH = 2048
+
+    def __init__(self, dim: int = 768, latency: float = 0.0, failure_rate: float = 0.0, seed: int = None):
+        self.dim = dim
+        self.EMBED_DIM = dim
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+
+    def _fail_maybe(self):
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise FakeProviderError("Injected fake provider failure")
+
+    def _vector(self, text: str):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype("float32")
+        return vector / np.linalg.norm(vector)
+
+    def embed_text(self, text: str):
+        return self.embed_texts([text])[0]
+
+    def embed_texts(self, texts: list[str]):
+        time.sleep(self.latency)
+        self._fail_maybe()
+        return [self._vector(text) for text in texts]
+
+    def _answer(self, prompt: str, context: str, history: str):
+        return (f"This is a test answer to: {prompt} "
+                f"(context: {len(context)} characters, history: {len(history)} characters)")
+
+    def chat_with_context(self, prompt: str, context: str, history: str = ""):
+        time.sleep(self.latency)
+        self._fail_maybe()
+        return self._answer(prompt, context, history)
+
+    async def stream_chat_with_context(self, prompt: str, context: str, history: str = ""):
+        await asyncio.sleep(self.latency)
+        self._fail_maybe()
+        for i, word in enumerate(self._answer(prompt, context, history).split(" ")):
+            yield word if i == 0 else " " + word
@@ -6,15 +6,34 @@ genai.configure(api_key=settings.GOOGLE_API_KEY)
 chat_model = genai.GenerativeModel("gemini-1.5-flash")
 embed_model = genai.GenerativeModel("embedding-001")
 
+EMBED_MODEL = "models/embedding-001"
+EMBED_DIM = 768
+# Bound every call so a hung request counts as a failure instead of blocking
+REQUEST_OPTIONS = {"timeout": settings.AI_REQUEST_TIMEOUT}
+# Largest number of texts the Gemini API accepts in one embedding request
+MAX_EMBED_BATCH = 100
+
 def embed_text(text: str):
     result = genai.embed_content(
-        model="models/embedding-001",
-        content=text
+        model=EMBED_MODEL,
+        content=text,
+        request_options=REQUEST_OPTIONS
     )
     return result["embedding"]
 
-def chat_with_context(prompt: str, context: str):
-    full_prompt = f"""
+def embed_texts(texts: list[str]):
+    """Embed up to MAX_EMBED_BATCH texts in a single request."""
+    result = genai.embed_content(
+        model=EMBED_MODEL,
+        content=list(texts),
+        request_options=REQUEST_OPTIONS
+    )
+    return result["embedding"]
+
+def build_prompt(prompt: str, context: str, history: str = ""):
+    if history:
+        history = f"Conversation so far:\n    {history}\n"
+    return f"""
     You are a helpful assistant that represents our company. 
     Always answer as if you are the company itself, not an AI model. 
     Do not say things like "based on the provided text" or mention context. 
@@ -24,9 +43,21 @@ def chat_with_context(prompt: str, context: str):
     Context:
     {context}
 
+    {history}
     User: {prompt}
     Company Assistant:
     """
 
-    response = chat_model.generate_content(full_prompt)
+def chat_with_context(prompt: str, context: str, history: str = ""):
+    response = chat_model.generate_content(build_prompt(prompt, context, history), request_options=REQUEST_OPTIONS)
     return response.text
+
+async def stream_chat_with_context(prompt: str, context: str, history: str = ""):
+    """Yield the response text piece by piece as Gemini generates it."""
+    response = await chat_model.generate_content_async(
+        build_prompt(prompt, context, history), stream=True, request_options=REQUEST_OPTIONS
+    )
+    async for chunk in response:
+        # Chunks without parts (e.g. the final safety/usage chunk) carry no text
+        if chunk.parts:
+            yield chunk.text
@@ -0,0 +1,111 @@
+import faiss
+import logging
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Index types supported by VectorStore (see create_index)
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+
+# IVF types need training data before anything can be added
+TRAINED_INDEX_TYPES = ("ivf", "ivfpq")
+
+# k-means in FAISS wants roughly this many training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+
+
+def ivf_nlist(n: int) -> int:
+    """Inverted lists for an IVF index trained on ``n`` vectors."""
+    return max(1, min(settings.VECTORSTORE_IVF_NLIST, n // MIN_POINTS_PER_CENTROID))
+
+# PQ uses 8-bit codes, i.e. 256 centroids per sub-quantizer
+PQ_NBITS = 8
+
+# FAISS's own default thread count (one per core), before configure_threads
+DEFAULT_OMP_THREADS = faiss.omp_get_max_threads()
+
+
+def configure_threads(threads: int = None):
+    """
+    Set the number of OpenMP threads FAISS uses in this process (default:
+    settings.FAISS_OMP_THREADS; 0 restores FAISS's default of one per core).
+    """
+    threads = settings.FAISS_OMP_THREADS if threads is None else threads
+    faiss.omp_set_num_threads(threads if threads > 0 else DEFAULT_OMP_THREADS)
+
+
+def create_index(index_type: str, dim: int, train_vectors=None):
+    """
+    Create an empty index of ``index_type`` that supports ``add_with_ids``,
+    ``remove_ids`` and ``reconstruct`` by chunk ID.
+
+    - ``flat``: exact brute-force L2 search (IndexFlatL2)
+    - ``hnsw``: HNSW graph; fast and accurate, but vectors can't be removed in
+      place (VectorStore rebuilds the graph instead)
+    - ``ivf``: inverted file with exact vectors, searches ``nprobe`` lists
+    - ``ivfpq``: inverted file with product-quantized vectors, the smallest
+      index in memory at the cost of some recall
+
+    IVF types are trained on ``train_vectors``; the number of lists is capped
+    so that small corpora still have enough points per centroid.
+    """
+    if index_type == "flat":
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+
+    if index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, settings.VECTORSTORE_HNSW_M)
+        hnsw.hnsw.efConstruction = settings.VECTORSTORE_HNSW_EF_CONSTRUCTION
+        hnsw.hnsw.efSearch = settings.VECTORSTORE_EF_SEARCH
+        return faiss.IndexIDMap2(hnsw)
+
+    if index_type in TRAINED_INDEX_TYPES:
+        if train_vectors is None or len(train_vectors) == 0:
+            raise ValueError(f"A '{index_type}' index needs training vectors")
+        n = len(train_vectors)
+        nlist = ivf_nlist(n)
+
+        if index_type == "ivfpq" and n >= 2 ** PQ_NBITS:
+            factory = f"IVF{nlist},PQ{_pq_subquantizers(dim)}x{PQ_NBITS}"
+        else:
+            if index_type == "ivfpq":
+                logger.warning(f"Only {n} vectors; too few to train PQ codes, using IVF-Flat instead")
+            factory = f"IVF{nlist},Flat"
+
+        index = faiss.index_factory(dim, factory)
+        index.train(train_vectors)
+        # A hashtable direct map keeps reconstruct() working after remove_ids()
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+        index.nprobe = min(settings.VECTORSTORE_NPROBE, nlist)
+        return index
+
+    raise ValueError(f"Unknown index type '{index_type}'. Choose from: {', '.join(INDEX_TYPES)}")
+
+
+def search_params(index_type: str, nprobe: int = None, ef_search: int = None, selector=None, index=None):
+    """
+    Per-query search parameters, or None to use the values stored in the index.
+    ``nprobe`` applies to IVF types and ``ef_search`` to HNSW. ``selector`` (a
+    faiss.IDSelector) restricts the search to the chunk IDs it accepts; as
+    parameter objects override every setting, the ``index`` searched is then
+    needed for its own nprobe/efSearch.
+    """
+    if selector is not None:
+        if index_type in TRAINED_INDEX_TYPES:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=nprobe or faiss.extract_index_ivf(index).nprobe)
+        if index_type == "hnsw":
+            hnsw = faiss.downcast_index(index.index).hnsw
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=ef_search or hnsw.efSearch)
+        return faiss.SearchParameters(sel=selector)
+    if index_type in TRAINED_INDEX_TYPES and nprobe:
+        return faiss.SearchParametersIVF(nprobe=nprobe)
+    if index_type == "hnsw" and ef_search:
+        return faiss.SearchParametersHNSW(efSearch=ef_search)
+    return None
+
+
+def _pq_subquantizers(dim: int):
+    """Largest divisor of ``dim`` not above VECTORSTORE_PQ_M."""
+    m = min(settings.VECTORSTORE_PQ_M, dim)
+    while dim % m:
+        m -= 1
+    return m
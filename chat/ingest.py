@@ -0,0 +1,354 @@
+from collections import deque
+from django.conf import settings
+from tqdm import tqdm
+import hashlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import numpy as np
+from .ai_client import ai_client, namespace_dim
+from .indexes import create_index, TRAINED_INDEX_TYPES
+
+# Subdirectory of the snapshot directory that rebuilds checkpoint into
+CHECKPOINT_DIRNAME = "checkpoint"
+
+
+def content_hash(data) -> str:
+    """SHA-256 hex digest of ``data`` (str or bytes)."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class FileJob:
+    """One new or changed file on its way through the pipeline."""
+
+    def __init__(self, filename, file_hash, chunks, chunk_hashes, vectors, stale_ids):
+        self.filename = filename
+        self.file_hash = file_hash
+        self.chunks = chunks
+        self.chunk_hashes = chunk_hashes
+        # {namespace: one slot per chunk}; reused vectors are filled in up front
+        self.vectors = vectors
+        self.remaining = sum(vector is None for slots in vectors.values() for vector in slots)
+        # IDs of this file's previous chunks, dropped once the new ones are in
+        self.stale_ids = stale_ids
+
+
+class IngestAborted(Exception):
+    """Raised inside the pipeline once another stage has failed."""
+
+
+class Ingester:
+    """
+    Pipelined ingestion of a folder of text files into a VectorStore.
+
+    Stages run concurrently so the slow embedding calls overlap with
+    reading and chunking, and several embedding requests are in flight at
+    once:
+
+    1. the calling thread walks the folder and hands files to a process pool
+       that reads, hashes and chunks them (unchanged files stop here)
+    2. chunks that need a vector are grouped into batches and put on a
+       bounded queue, so chunking can't run arbitrarily far ahead
+    3. ``embed_workers`` threads embed the batches; each batch is for one
+       embedding namespace, so the store's indexes are built in parallel
+    4. a single writer thread adds each file to the index once all of its
+       chunks have vectors, and updates the manifest
+
+    With ``checkpoint_path`` the writer saves a snapshot there every
+    ``checkpoint_seconds``, and when a stage fails. Loading that snapshot
+    and ingesting again resumes the run: files recorded in the manifest
+    are skipped by their hash.
+    """
+
+    def __init__(self, store, workers: int = None, embed_workers: int = None, queue_size: int = None,
+                 checkpoint_path: str = None, checkpoint_seconds: float = None, progress: bool = False):
+        self.store = store
+        self.workers = workers or settings.INGEST_WORKERS
+        self.embed_workers = embed_workers or settings.INGEST_EMBED_WORKERS
+        self.queue_size = queue_size or settings.INGEST_QUEUE_SIZE
+        self.batch_size = store.embed_batch_size or settings.EMBEDDING_BATCH_SIZE
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_seconds = (
+            settings.INGEST_CHECKPOINT_SECONDS if checkpoint_seconds is None else checkpoint_seconds
+        )
+        self.progress = progress
+
+    def run(self, folder_path: str):
+        """Ingest ``folder_path`` and return a dict of counters describing what changed."""
+        store = self.store
+        self.stats = {
+            "added_files": 0, "changed_files": 0, "removed_files": 0, "unchanged_files": 0,
+            "embedded_chunks": 0, "reused_chunks": 0, "removed_chunks": 0,
+        }
+        filenames = sorted(f for f in os.listdir(folder_path) if f.endswith(".txt"))
+        known_hashes = {filename: entry["hash"] for filename, entry in store.manifest.items()}
+
+        removed_ids = []
+        for filename in set(store.manifest) - set(filenames):
+            removed_ids.extend(chunk_id for chunk_id, _ in store.manifest.pop(filename)["chunks"])
+            self.stats["removed_files"] += 1
+            tqdm.write(f"Removed: {filename}")
+        store.remove_chunks(removed_ids)
+        self.stats["removed_chunks"] = len(removed_ids)
+
+        # IVF indexes are trained once at the end on every vector; until then
+        # chunks go into flat indexes, which can also be checkpointed
+        final_index_type = None
+        if store.index is None and store.index_type in TRAINED_INDEX_TYPES:
+            final_index_type = store.index_type
+            store.index_type = "flat"
+            for namespace in store.indexes:
+                store.indexes[namespace] = create_index("flat", namespace_dim(namespace))
+
+        self.embed_queue = queue.Queue(maxsize=self.queue_size)
+        self.write_queue = queue.Queue()
+        self.failed = threading.Event()
+        self.error = None
+        # Guards job counters; index_lock guards the index and manifest
+        self.lock = threading.Lock()
+        self.index_lock = threading.Lock()
+        self.stale_ids = []
+        self.last_checkpoint = time.monotonic()
+        self.bar = tqdm(total=len(filenames), unit="file", desc="Ingesting", disable=not self.progress)
+
+        # Start the chunking processes before any thread, so nothing is forked mid-lock
+        pool = None
+        if self.workers > 1 and len(filenames) > 1:
+            pool = multiprocessing.Pool(
+                min(self.workers, len(filenames)),
+                initializer=_init_chunker,
+                initargs=(store.chunker,),
+            )
+        threads = [threading.Thread(target=self._embed_worker, daemon=True) for _ in range(self.embed_workers)]
+        threads.append(threading.Thread(target=self._writer, daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            self._walk(folder_path, filenames, known_hashes, pool)
+        except IngestAborted:
+            pass
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            if pool is not None:
+                if self.failed.is_set():
+                    pool.terminate()
+                else:
+                    pool.close()
+                pool.join()
+            # Workers keep draining the queue after a failure, so these can't block forever
+            for _ in range(self.embed_workers):
+                self.embed_queue.put(None)
+            for thread in threads[:-1]:
+                thread.join()
+            self.write_queue.put(None)
+            threads[-1].join()
+            self.bar.close()
+
+        if self.error is not None:
+            if self.checkpoint_path and store.index is not None and store.index.ntotal:
+                # Keep what was finished so the next run only does the rest
+                self._checkpoint()
+            raise self.error
+
+        with self.index_lock:
+            store.remove_chunks(self.stale_ids)
+            self.stats["removed_chunks"] += len(self.stale_ids)
+        if final_index_type:
+            store.rebuild_index(final_index_type)
+        return self.stats
+
+    # -- stage 1: walk and chunk -------------------------------------------
+
+    def _walk(self, folder_path, filenames, known_hashes, pool):
+        # One batch per namespace being filled
+        batches = {namespace: [] for namespace in self.store.indexes}
+        for filename, file_hash, chunks, chunk_hashes in self._prepared_files(
+            folder_path, filenames, known_hashes, pool
+        ):
+            if self.failed.is_set():
+                raise IngestAborted()
+            if chunks is None:
+                self.stats["unchanged_files"] += 1
+                self.bar.update(1)
+                continue
+
+            with self.index_lock:
+                entry = self.store.manifest.get(filename)
+                old_ids = {}
+                if entry:
+                    self.stats["changed_files"] += 1
+                    old_ids = {chunk_hash: chunk_id for chunk_id, chunk_hash in entry["chunks"]}
+                else:
+                    self.stats["added_files"] += 1
+                vectors = {
+                    namespace: [self.store._reconstruct(old_ids.get(chunk_hash), namespace)
+                                for chunk_hash in chunk_hashes]
+                    for namespace in self.store.indexes
+                }
+            job = FileJob(filename, file_hash, chunks, chunk_hashes, vectors, list(old_ids.values()))
+            # Counted per chunk, however many namespaces it is embedded into
+            embedded = sum(
+                any(slots[i] is None for slots in vectors.values()) for i in range(len(chunks))
+            )
+            self.stats["reused_chunks"] += len(chunks) - embedded
+            self.stats["embedded_chunks"] += embedded
+
+            if job.remaining == 0:
+                self.write_queue.put(job)
+                continue
+            for namespace, slots in vectors.items():
+                batch = batches[namespace]
+                for i, vector in enumerate(slots):
+                    if vector is None:
+                        batch.append((job, i))
+                        if len(batch) >= self.batch_size:
+                            self._put(self.embed_queue, (namespace, batch))
+                            batch = batches[namespace] = []
+        for namespace, batch in batches.items():
+            if batch:
+                self._put(self.embed_queue, (namespace, batch))
+
+    def _prepared_files(self, folder_path, filenames, known_hashes, pool):
+        """Yield ``_prepare_file`` results in order, keeping the pool busy but bounded."""
+        if pool is None:
+            for filename in filenames:
+                yield _prepare_file(self.store.chunker, folder_path, filename, known_hashes.get(filename))
+            return
+
+        pending = deque()
+        for filename in filenames:
+            pending.append(pool.apply_async(
+                _prepare_file_in_worker, (folder_path, filename, known_hashes.get(filename))
+            ))
+            if len(pending) >= 2 * self.workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    # -- stage 2: embed ----------------------------------------------------
+
+    def _embed_worker(self):
+        while True:
+            item = self.embed_queue.get()
+            if item is None:
+                return
+            if self.failed.is_set():
+                continue
+            namespace, batch = item
+            try:
+                embeddings = ai_client.embed_texts(
+                    [job.chunks[i]["text"] for job, i in batch], batch_size=len(batch), namespace=namespace
+                )
+            except BaseException as e:
+                self._fail(e)
+                continue
+
+            completed = []
+            with self.lock:
+                for (job, i), embedding in zip(batch, embeddings):
+                    job.vectors[namespace][i] = np.asarray(embedding, dtype="float32")
+                    job.remaining -= 1
+                    if job.remaining == 0:
+                        completed.append(job)
+            for job in completed:
+                self.write_queue.put(job)
+
+    # -- stage 3: write ----------------------------------------------------
+
+    def _writer(self):
+        while True:
+            job = self.write_queue.get()
+            if job is None:
+                return
+            if self.failed.is_set():
+                continue
+            try:
+                self._commit(job)
+                if self.checkpoint_path and time.monotonic() - self.last_checkpoint >= self.checkpoint_seconds:
+                    self._checkpoint()
+            except BaseException as e:
+                self._fail(e)
+
+    def _commit(self, job: FileJob):
+        store = self.store
+        with self.index_lock:
+            ids = store._add_vectors(
+                job.chunks, {namespace: np.vstack(slots) for namespace, slots in job.vectors.items()}
+            ) if job.chunks else []
+            store.manifest[job.filename] = {
+                "hash": job.file_hash,
+                "chunks": [[chunk_id, chunk_hash] for chunk_id, chunk_hash in zip(ids, job.chunk_hashes)],
+            }
+            self.stale_ids.extend(job.stale_ids)
+        self.bar.update(1)
+
+    def _checkpoint(self):
+        with self.index_lock:
+            # Drop replaced chunks first so the checkpoint has no duplicates
+            self.store.remove_chunks(self.stale_ids)
+            self.stats["removed_chunks"] += len(self.stale_ids)
+            self.stale_ids = []
+            self.store.save(self.checkpoint_path)
+        self.last_checkpoint = time.monotonic()
+        tqdm.write(f"Checkpoint saved to {self.checkpoint_path} ({len(self.store.documents)} chunks)")
+
+    # -- helpers -------------------------------------------------------------
+
+    def _put(self, q, item):
+        """``q.put(item)`` that gives up once another stage has failed."""
+        while True:
+            if self.failed.is_set():
+                raise IngestAborted()
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _fail(self, error):
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        self.failed.set()
+
+
+def _prepare_file(chunker, folder_path, filename, known_hash):
+    """
+    Hash ``filename`` and, unless the hash equals ``known_hash``, split it
+    into chunks with ``chunker`` (a chat.chunker.Chunker).
+    Returns ``(filename, file_hash, chunks or None, chunk_hashes or None)``.
+    """
+    file_path = os.path.join(folder_path, filename)
+    with open(file_path, "rb") as f:
+        # Hash in blocks; unchanged files are never held in memory whole
+        file_hash = hashlib.file_digest(f, "sha256").hexdigest()
+        if file_hash == known_hash:
+            return filename, file_hash, None, None
+        f.seek(0)
+        text = f.read().decode("utf-8")
+
+    base_metadata = {
+        "filename": filename,
+        "file_path": file_path
+    }
+    chunks = chunker.chunks(text, base_metadata)
+    return filename, file_hash, chunks, [content_hash(chunk["text"]) for chunk in chunks]
+
+
+# Chunker of a pool worker process, set up by _init_chunker
+_chunker = None
+
+
+def _init_chunker(chunker):
+    global _chunker
+    _chunker = chunker
+
+
+def _prepare_file_in_worker(folder_path, filename, known_hash):
+    return _prepare_file(_chunker, folder_path, filename, known_hash)
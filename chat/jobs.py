@@ -0,0 +1,257 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+import hashlib
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from .models import Job
+from .tracing import trace_id_var
+
+logger = logging.getLogger(__name__)
+
+# Job name -> handler, filled in by @job
+JOB_HANDLERS = {}
+
+# last_error of a unique job dropped because an identical one was queued again
+SUPERSEDED = "Superseded by the same job queued again"
+
+
+def job(name: str):
+    """Register the decorated function as the handler of jobs called ``name``."""
+    def register(fn):
+        JOB_HANDLERS[name] = fn
+        return fn
+    return register
+
+
+def enqueue(name: str, payload: dict = None, delay: float = 0, max_attempts: int = None, unique: bool = False):
+    """
+    Queue a ``name`` job, run with ``payload`` as keyword arguments by a
+    worker after ``delay`` seconds. With ``unique``, nothing is queued if
+    the same job (name and payload) is already waiting; the existing job is
+    returned instead, so a burst of triggers costs a single run. The
+    database enforces this (a unique constraint on the waiting jobs'
+    ``unique_key``), so concurrent callers can't both queue one.
+    """
+    if name not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job: {name}")
+    payload = payload or {}
+    fields = dict(
+        name=name,
+        payload=payload,
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+        run_after=timezone.now() + timedelta(seconds=delay),
+    )
+    if not unique:
+        return Job.objects.create(**fields)
+
+    key = unique_key(name, payload)
+    while True:
+        pending = Job.objects.filter(unique_key=key, status=Job.QUEUED).first()
+        if pending is not None:
+            return pending
+        try:
+            with transaction.atomic():
+                return Job.objects.create(unique_key=key, **fields)
+        except IntegrityError:
+            # Another caller queued it since we looked; return theirs (or
+            # try again if a worker claimed it in the meantime)
+            continue
+
+
+def unique_key(name: str, payload: dict) -> str:
+    """Key identifying jobs with the same ``name`` and ``payload``, for ``enqueue(unique=True)``."""
+    return hashlib.sha256(json.dumps([name, payload], sort_keys=True).encode()).hexdigest()
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter, in seconds, after ``attempts`` failed attempts."""
+    delay = min(settings.JOB_RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1), settings.JOB_RETRY_BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class Worker:
+    """
+    Runs queued jobs one at a time, oldest due first.
+
+    Jobs are claimed with a conditional UPDATE (queued -> running), so any
+    number of workers, in any number of processes or hosts, can poll the
+    same table and each job is run by exactly one of them. A job that
+    raises is queued again after an exponential backoff until it has had
+    ``max_attempts`` attempts, then marked failed. While a job runs its
+    worker refreshes ``heartbeat_at`` every JOB_HEARTBEAT_SECONDS; jobs
+    whose heartbeat is older than JOB_LOCK_TIMEOUT_SECONDS (their worker
+    died) are queued again, however long a live job takes.
+    """
+
+    def __init__(self, name: str = None, poll_seconds: float = None):
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_seconds = settings.JOB_POLL_SECONDS if poll_seconds is None else poll_seconds
+        self.stopping = False
+
+    def stop(self):
+        """Finish the current job, then return from ``run``."""
+        self.stopping = True
+
+    def run(self, once: bool = False):
+        """Process jobs until stopped, or until the queue is empty if ``once``."""
+        logger.info(f"Job worker {self.name} started")
+        while not self.stopping:
+            close_old_connections()
+            self.requeue_stale()
+            job = self.claim()
+            if job is None:
+                if once:
+                    break
+                time.sleep(self.poll_seconds)
+                continue
+            self.execute(job)
+        close_old_connections()
+        logger.info(f"Job worker {self.name} stopped")
+
+    def requeue_stale(self):
+        now = timezone.now()
+        cutoff = now - timedelta(seconds=settings.JOB_LOCK_TIMEOUT_SECONDS)
+        stale = Job.objects.filter(
+            Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff),
+            status=Job.RUNNING,
+        )
+        # A unique job that was queued again meanwhile will do the same work
+        superseded = stale.filter(
+            Exists(Job.objects.filter(unique_key=OuterRef("unique_key"), status=Job.QUEUED))
+        ).update(status=Job.FAILED, locked_by="", finished_at=now, last_error=SUPERSEDED)
+        try:
+            requeued = stale.update(status=Job.QUEUED, locked_by="", run_after=now)
+        except IntegrityError:
+            # Raced with enqueue(unique=True); sorted out on the next poll
+            requeued = 0
+        if requeued:
+            logger.warning(f"Re-queued {requeued} jobs abandoned by their workers")
+        if superseded:
+            logger.warning(f"Dropped {superseded} abandoned jobs: the same jobs are already queued again")
+
+    def claim(self):
+        """Take the next due job, or return None if there is none."""
+        while True:
+            now = timezone.now()
+            candidate = (
+                Job.objects.filter(status=Job.QUEUED, run_after__lte=now)
+                .order_by("run_after", "id").values_list("id", flat=True).first()
+            )
+            if candidate is None:
+                return None
+            claimed = Job.objects.filter(pk=candidate, status=Job.QUEUED).update(
+                status=Job.RUNNING, locked_by=self.name, started_at=now, heartbeat_at=now,
+                attempts=F("attempts") + 1,
+            )
+            if claimed:
+                return Job.objects.get(pk=candidate)
+            # Another worker got it first; try the next one
+
+    def heartbeat(self, job: Job):
+        """Record that ``job`` is still running, so ``requeue_stale`` leaves it alone."""
+        Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=self.name).update(heartbeat_at=timezone.now())
+
+    def _beat(self, job: Job, stop: threading.Event):
+        """Heartbeat thread: call ``heartbeat`` every JOB_HEARTBEAT_SECONDS until ``stop`` is set."""
+        try:
+            while not stop.wait(settings.JOB_HEARTBEAT_SECONDS):
+                try:
+                    self.heartbeat(job)
+                except DatabaseError as e:
+                    logger.warning(f"Heartbeat of job {job.name} #{job.pk} failed: {e}")
+        finally:
+            # This thread's own database connection
+            connection.close()
+
+    def execute(self, job: Job):
+        handler = JOB_HANDLERS.get(job.name)
+        label = f"{job.name} #{job.pk}"
+        # Log lines written by the job carry its ID instead of a request's
+        token = trace_id_var.set(f"job-{job.pk}")
+        start = time.monotonic()
+        stop = threading.Event()
+        beat = threading.Thread(target=self._beat, args=(job, stop), name=f"heartbeat-{job.pk}", daemon=True)
+        beat.start()
+        try:
+            if handler is None:
+                raise ValueError(f"No handler registered for job {job.name!r}")
+            handler(**job.payload)
+        except Exception as e:
+            job.last_error = "".join(traceback.format_exception(e))[-5000:]
+            if handler is not None and job.attempts < job.max_attempts:
+                job.status = Job.QUEUED
+                job.run_after = timezone.now() + timedelta(seconds=retry_delay(job.attempts))
+                logger.warning(f"Job {label} failed (attempt {job.attempts}/{job.max_attempts}), "
+                               f"retrying at {job.run_after:%H:%M:%S}: {e}")
+            else:
+                job.status = Job.FAILED
+                job.finished_at = timezone.now()
+                logger.error(f"Job {label} failed permanently after {job.attempts} attempts: {e}")
+        else:
+            job.status = Job.SUCCEEDED
+            job.finished_at = timezone.now()
+            job.last_error = ""
+            logger.info(f"Job {label} succeeded in {time.monotonic() - start:.2f}s")
+        finally:
+            stop.set()
+            beat.join()
+        job.locked_by = ""
+        job.duration = time.monotonic() - start
+        fields = ["status", "run_after", "finished_at", "last_error", "locked_by", "duration"]
+        try:
+            with transaction.atomic():
+                job.save(update_fields=fields)
+        except IntegrityError:
+            # Retrying a unique job that was queued again while it ran; the queued one will do it
+            job.status, job.finished_at, job.last_error = Job.FAILED, timezone.now(), SUPERSEDED
+            job.save(update_fields=fields)
+            logger.warning(f"Job {label} not retried: the same job is already queued")
+        trace_id_var.reset(token)
+
+
+# -- built-in jobs -----------------------------------------------------------
+
+@job("send_verification_email")
+def send_verification_email(user_id: int):
+    from django.contrib.auth.models import User
+    from django.core.mail import send_mail
+
+    user = User.objects.filter(pk=user_id).first()
+    if user is None or not user.email:
+        return
+    send_mail(
+        subject='Verify your email',
+        message='Thank you for signing up. Please verify your email address.',
+        from_email='no-reply@example.com',
+        recipient_list=[user.email],
+        fail_silently=False,
+    )
+
+
+@job("rebuild_vectorstore")
+def rebuild_vectorstore(**options):
+    """Run `manage.py rebuild_vectorstore` with ``options`` (e.g. full=True)."""
+    from django.core.management import call_command
+    from .indexes import configure_threads
+
+    try:
+        call_command("rebuild_vectorstore", **options)
+    finally:
+        # The command sets its own FAISS thread count; restore this process's
+        configure_threads()
+
+
+@job("cleanup_old_messages")
+def cleanup_old_messages():
+    from .scheduler import cleanup_old_messages
+
+    cleanup_old_messages()
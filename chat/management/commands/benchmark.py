@@ -0,0 +1,377 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+import gc
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import numpy as np
+
+
+class Command(BaseCommand):
+    help = (
+        'End-to-end benchmark on synthetic corpora with a fake AI provider: ingestion throughput, '
+        'search latency, memory and /chat/ requests per second. Runs offline.'
+    )
+
+    # The real providers may be unconfigured; everything here runs on the fake one
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='1000,10000',
+            help='Comma-separated corpus sizes in chunks, up to 1000000 (default: 1000,10000)'
+        )
+        parser.add_argument('--dim', type=int, default=768, help='Embedding dimension (default: 768)')
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0.0,
+            help='Seconds the fake provider waits per call, to mimic network latency (default: 0)'
+        )
+        parser.add_argument(
+            '--index-type',
+            default=settings.VECTORSTORE_INDEX_TYPE,
+            help=f'FAISS index type (default: {settings.VECTORSTORE_INDEX_TYPE})'
+        )
+        parser.add_argument('--chunk-size', type=int, default=500, help='Chunk size in characters (default: 500)')
+        parser.add_argument('--chunk-overlap', type=int, default=50, help='Chunk overlap (default: 50)')
+        parser.add_argument(
+            '--chunks-per-file',
+            type=int,
+            default=50,
+            help='Approximate chunks per synthetic file (default: 50)'
+        )
+        parser.add_argument('--queries', type=int, default=200, help='Search queries per size (default: 200)')
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=200,
+            help='/chat/ requests per size for the load test; 0 skips it (default: 200)'
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=8,
+            help='Concurrent /chat/ clients (default: 8)'
+        )
+        parser.add_argument('--workers', type=int, help='Chunking processes (default: settings.INGEST_WORKERS)')
+        parser.add_argument(
+            '--embed-workers',
+            type=int,
+            help='Embedding threads (default: settings.INGEST_EMBED_WORKERS)'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the corpus and queries')
+        parser.add_argument('--workdir', help='Directory for corpora and snapshots (default: a temp dir)')
+        parser.add_argument('--json', help='Also write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError('--sizes must be comma-separated integers')
+        if not sizes or min(sizes) < 1:
+            raise CommandError('--sizes must be positive')
+
+        # Chat modules create the AI client on import; make sure that never needs API keys
+        settings.AI_FAKE_PROVIDER = True
+        from chat.ai_client import ai_client, Provider
+        from chat.embedding_cache import embedding_cache
+        from chat.fake_provider import FakeProvider
+        from chat.response_cache import response_cache
+
+        ai_client.set_providers([Provider(
+            "fake", "Fake Provider", FakeProvider(dim=options['dim'], latency=options['latency'], seed=options['seed'])
+        )])
+        # Measure the pipeline itself, not cache hits
+        embedding_cache.enabled = False
+        response_cache.enabled = False
+
+        workdir = options['workdir'] or tempfile.mkdtemp(prefix='chatbot-benchmark-')
+        os.makedirs(workdir, exist_ok=True)
+        databases = self._setup_database(workdir) if options['requests'] else None
+        results = []
+        try:
+            for size in sizes:
+                self.stdout.write(self.style.SUCCESS(f'\n=== {size} chunks ==='))
+                results.append(self._run_size(size, workdir, options))
+        finally:
+            if databases is not None:
+                self.runner.teardown_databases(databases)
+            if not options['workdir']:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+        report = {'environment': self._environment(options), 'results': results}
+        self._print_table(results)
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f'Results written to {options["json"]}')
+
+    # -- one corpus size ---------------------------------------------------
+
+    def _run_size(self, size, workdir, options):
+        from chat.ai_client import ai_client
+        from chat.vectorstore import VectorStore
+
+        rng = np.random.default_rng(options['seed'])
+        corpus_dir = os.path.join(workdir, f'corpus-{size}')
+        snapshot_dir = os.path.join(workdir, f'snapshot-{size}')
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+        os.makedirs(snapshot_dir)
+
+        start = time.perf_counter()
+        sentences, files = _write_corpus(corpus_dir, size, options, rng)
+        self.stdout.write(f'Generated {files} files in {time.perf_counter() - start:.1f}s')
+
+        gc.collect()
+        rss_before = _rss_mb()
+        store = VectorStore(
+            chunk_size=options['chunk_size'],
+            chunk_overlap=options['chunk_overlap'],
+            index_type=options['index_type'],
+            tokenizer='',
+        )
+        start = time.perf_counter()
+        store.load_from_folder(corpus_dir, workers=options['workers'], embed_workers=options['embed_workers'])
+        ingest_seconds = time.perf_counter() - start
+        chunks = len(store.documents)
+        rss_ingested = _rss_mb()
+        self.stdout.write(f'Ingested {chunks} chunks in {ingest_seconds:.1f}s')
+
+        start = time.perf_counter()
+        store.save(snapshot_dir)
+        save_seconds = time.perf_counter() - start
+        del store
+        gc.collect()
+        rss_released = _rss_mb()
+
+        start = time.perf_counter()
+        store = VectorStore.load(snapshot_dir)
+        load_seconds = time.perf_counter() - start
+
+        # Natural-language queries are a few corpus sentences; identifier
+        # queries name one file's reference code, for the BM25 shortcut
+        queries = [
+            ' '.join(sentences[i] for i in rng.integers(0, len(sentences), size=2))
+            for _ in range(options['queries'])
+        ]
+        identifiers = [_identifier(i) for i in rng.integers(0, files, size=options['queries'])]
+        vectors = np.asarray(ai_client.embed_texts(queries), dtype='float32')
+
+        result = {
+            'chunks': chunks,
+            'files': files,
+            'ingest': {
+                'seconds': round(ingest_seconds, 3),
+                'chunks_per_second': round(chunks / ingest_seconds, 1) if ingest_seconds else None,
+                'save_seconds': round(save_seconds, 3),
+                'load_seconds': round(load_seconds, 3),
+            },
+            'search_ms': {
+                'hybrid': _percentiles(lambda q: store.search(q, top_k=4), queries),
+                'identifier': _percentiles(lambda q: store.search(q, top_k=4), identifiers),
+                'vector': _percentiles(lambda v: store.search_by_vector(v, top_k=4), vectors),
+            },
+            'memory_mb': {
+                'rss_before_ingest': rss_before,
+                'rss_after_ingest': rss_ingested,
+                'ingest_delta': round(rss_ingested - rss_before, 1),
+                'rss_after_load': _rss_mb(),
+                'load_delta': round(_rss_mb() - rss_released, 1),
+                'peak_rss': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+                'snapshot_on_disk': round(_disk_mb(snapshot_dir), 1),
+            },
+        }
+        if options['requests']:
+            result['chat'] = self._load_test(store, queries, options)
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+        shutil.rmtree(snapshot_dir, ignore_errors=True)
+        return result
+
+    # -- /chat/ load test --------------------------------------------------
+
+    def _setup_database(self, workdir):
+        from django.test.runner import DiscoverRunner
+        from django.test.utils import setup_test_environment
+
+        database = settings.DATABASES['default']
+        if database['ENGINE'] == 'django.db.backends.sqlite3':
+            # A file, not SQLite's shared in-memory database, so concurrent writers wait for the lock
+            database.setdefault('TEST', {})['NAME'] = os.path.join(workdir, 'benchmark.sqlite3')
+        setup_test_environment()
+        self.runner = DiscoverRunner(verbosity=0)
+        return self.runner.setup_databases()
+
+    def _load_test(self, store, queries, options):
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIClient
+        from chat.snapshots import index_manager
+
+        user, _ = User.objects.get_or_create(username='benchmark')
+        index_manager.swap(store)
+        total, concurrency = options['requests'], options['concurrency']
+        latencies, statuses = [], {}
+        lock = threading.Lock()
+        next_request = iter(range(total))
+
+        def client_loop():
+            client = APIClient()
+            client.force_authenticate(user)
+            while True:
+                with lock:
+                    i = next(next_request, None)
+                if i is None:
+                    return
+                start = time.perf_counter()
+                try:
+                    outcome = client.post('/chat/', {'message': queries[i % len(queries)]}, format='json').status_code
+                except Exception as e:
+                    outcome = type(e).__name__
+                elapsed = (time.perf_counter() - start) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[outcome] = statuses.get(outcome, 0) + 1
+
+        threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+        index_manager.swap(None)
+
+        self.stdout.write(f'/chat/: {total} requests in {wall:.1f}s with {concurrency} clients')
+        return {
+            'requests': total,
+            'concurrency': concurrency,
+            'requests_per_second': round(total / wall, 1),
+            'latency_ms': _summary(latencies),
+            'status_codes': {str(code): count for code, count in sorted(statuses.items(), key=str)},
+        }
+
+    # -- reporting ---------------------------------------------------------
+
+    def _environment(self, options):
+        import faiss
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, timeout=10
+            ).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            commit = None
+        return {
+            'commit': commit,
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'faiss': faiss.__version__,
+            'cpus': os.cpu_count(),
+            'options': {
+                key: options[key] for key in (
+                    'dim', 'latency', 'index_type', 'chunk_size', 'chunk_overlap', 'chunks_per_file',
+                    'queries', 'requests', 'concurrency', 'workers', 'embed_workers', 'seed',
+                )
+            },
+        }
+
+    def _print_table(self, results):
+        self.stdout.write(
+            f'\n{"chunks":>9} {"ingest/s":>10} {"hybrid p50":>11} {"p99 ms":>8} {"vector p50":>11} '
+            f'{"rss MB":>8} {"chat rps":>9} {"chat p95":>9}'
+        )
+        for row in results:
+            chat = row.get('chat') or {}
+            self.stdout.write(
+                f'{row["chunks"]:>9} {row["ingest"]["chunks_per_second"] or 0:>10.1f} '
+                f'{row["search_ms"]["hybrid"]["p50"]:>11.3f} {row["search_ms"]["hybrid"]["p99"]:>8.3f} '
+                f'{row["search_ms"]["vector"]["p50"]:>11.3f} {row["memory_mb"]["rss_after_ingest"]:>8.1f} '
+                f'{chat.get("requests_per_second", 0):>9.1f} {chat.get("latency_ms", {}).get("p95", 0):>9.1f}'
+            )
+
+
+def _identifier(file_number) -> str:
+    return f'REF-{int(file_number):07d}'
+
+
+def _write_corpus(folder, size, options, rng):
+    """
+    Write text files that chunk into about ``size`` chunks. Sentences come
+    from a fixed pool of random words with a Zipf-like frequency, so BM25
+    sees a realistic vocabulary; each file starts with a unique reference
+    code. Returns the sentence pool and the number of files.
+    """
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    letters = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+    words = [''.join(rng.choice(letters, size=rng.integers(3, 10))) for _ in range(5000)]
+    weights = 1.0 / np.arange(1, len(words) + 1)
+    weights /= weights.sum()
+    sentences = []
+    for _ in range(20000):
+        picked = rng.choice(len(words), size=rng.integers(6, 18), p=weights)
+        sentence = ' '.join(words[i] for i in picked)
+        sentences.append(sentence[0].upper() + sentence[1:] + '.')
+
+    # A chunk holds about chunk_size - overlap characters of new text
+    sentence_length = sum(map(len, sentences)) / len(sentences) + 1
+    per_chunk = max(1, round((options['chunk_size'] - options['chunk_overlap']) / sentence_length))
+    per_file = max(1, options['chunks_per_file'])
+    files = max(1, -(-size // per_file))
+    remaining = size
+    for file_number in range(files):
+        file_chunks = min(per_file, remaining)
+        remaining -= file_chunks
+        picks = rng.integers(0, len(sentences), size=file_chunks * per_chunk)
+        text = f'Reference {_identifier(file_number)}.\n' + ' '.join(sentences[i] for i in picks)
+        with open(os.path.join(folder, f'doc_{file_number:07d}.txt'), 'w', encoding='utf-8') as f:
+            f.write(text)
+    return sentences, files
+
+
+def _percentiles(fn, items):
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return _summary(latencies)
+
+
+def _summary(latencies_ms):
+    if not latencies_ms:
+        return {}
+    return {
+        'p50': round(float(np.percentile(latencies_ms, 50)), 3),
+        'p95': round(float(np.percentile(latencies_ms, 95)), 3),
+        'p99': round(float(np.percentile(latencies_ms, 99)), 3),
+        'mean': round(float(np.mean(latencies_ms)), 3),
+        'max': round(float(np.max(latencies_ms)), 3),
+    }
+
+
+def _rss_mb() -> float:
+    """Current resident set size of this process, in MB."""
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _disk_mb(path) -> float:
+    total = 0
+    for root, _, filenames in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in filenames)
+    return total / (1024 * 1024)
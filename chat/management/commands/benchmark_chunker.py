@@ -0,0 +1,185 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+import json
+import random
+import re
+import time
+from chat.chunker import Chunker, load_tokenizer
+
+
+class LegacyChunker:
+    """The previous VectorStore chunker, kept here as the benchmark baseline."""
+
+    def __init__(self, chunk_size=500, chunk_overlap=50):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def _split_text_into_chunks(self, text: str, metadata: dict = None):
+        """Split text into overlapping chunks while preserving sentence boundaries."""
+        # Clean up text
+        text = re.sub(r'\s+', ' ', text.strip())
+        
+        # Split by sentences first
+        sentences = re.split(r'(?<=[.!?])\s+', text)
+        
+        chunks = []
+        current_chunk = ""
+        current_length = 0
+        
+        for sentence in sentences:
+            sentence_length = len(sentence)
+            
+            # If adding this sentence would exceed chunk_size, save current chunk
+            if current_length + sentence_length > self.chunk_size and current_chunk:
+                chunks.append({
+                    "text": current_chunk.strip(),
+                    "metadata": {
+                        **(metadata or {}),
+                        "chunk_index": len(chunks),
+                        "total_chunks": None  # Will be set later
+                    }
+                })
+                
+                # Start new chunk with overlap
+                overlap_text = self._get_overlap_text(current_chunk, self.chunk_overlap)
+                current_chunk = overlap_text + " " + sentence if overlap_text else sentence
+                current_length = len(current_chunk)
+            else:
+                # Add sentence to current chunk
+                if current_chunk:
+                    current_chunk += " " + sentence
+                else:
+                    current_chunk = sentence
+                current_length = len(current_chunk)
+        
+        # Don't forget the last chunk
+        if current_chunk.strip():
+            chunks.append({
+                "text": current_chunk.strip(),
+                "metadata": {
+                    **(metadata or {}),
+                    "chunk_index": len(chunks),
+                    "total_chunks": None
+                }
+            })
+        
+        # Update total_chunks count
+        for chunk in chunks:
+            chunk["metadata"]["total_chunks"] = len(chunks)
+        
+        return chunks
+
+    def _get_overlap_text(self, text: str, overlap_size: int):
+        """Get the last overlap_size characters from text, preferring word boundaries."""
+        if len(text) <= overlap_size:
+            return text
+        
+        # Try to find a good word boundary within the overlap region
+        overlap_text = text[-overlap_size:]
+        space_index = overlap_text.find(' ')
+        
+        if space_index != -1:
+            return overlap_text[space_index:].strip()
+        return overlap_text
+
+
+class Command(BaseCommand):
+    help = 'Compare the speed of the sentence-span chunker with the previous implementation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size-mb', type=float, default=20, help='Size of the synthetic input in MB (default: 20)')
+        parser.add_argument(
+            '--corpus',
+            choices=('prose', 'unpunctuated'),
+            default='prose',
+            help='Synthetic text: sentences and paragraphs, or one long run of words (default: prose)'
+        )
+        parser.add_argument('--input', help='Benchmark this text file instead of synthetic text')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Chunk size (default: 500)')
+        parser.add_argument('--chunk-overlap', type=int, default=50, help='Chunk overlap (default: 50)')
+        parser.add_argument(
+            '--tokenizer',
+            default=settings.CHUNK_TOKENIZER,
+            help='Token counter for the new chunker (default: settings.CHUNK_TOKENIZER, "" = characters)'
+        )
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per chunker; the fastest is reported (default: 3)')
+        parser.add_argument('--json', help='Also write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['input']:
+            with open(options['input'], 'r', encoding='utf-8') as f:
+                text = f.read()
+        else:
+            text = self._synthetic_text(int(options['size_mb'] * 1024 * 1024), options['corpus'])
+        size_mb = len(text.encode('utf-8')) / (1024 * 1024)
+
+        try:
+            tokenizer = load_tokenizer(options['tokenizer'])
+        except ImportError as e:
+            raise CommandError(f'Cannot load tokenizer {options["tokenizer"]!r}: {e}')
+
+        legacy = LegacyChunker(options['chunk_size'], options['chunk_overlap'])
+        chunker = Chunker(options['chunk_size'], options['chunk_overlap'], tokenizer)
+        runs = [
+            ('legacy', lambda: legacy._split_text_into_chunks(text)),
+            # Offsets only, as the ingestion pipeline could use them
+            ('spans', lambda: chunker.split(text)),
+            # Offsets plus chunk dicts with the sliced text, like VectorStore
+            ('chunks', lambda: chunker.chunks(text)),
+        ]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Chunking {size_mb:.1f} MB ({options["corpus"] if not options["input"] else options["input"]}), '
+            f'chunk_size={options["chunk_size"]}, chunk_overlap={options["chunk_overlap"]}, '
+            f'unit={"tokens" if tokenizer else "characters"}'
+        ))
+        self.stdout.write(f'\n{"chunker":<8} {"seconds":>8} {"MB/s":>8} {"chunks":>9} {"max chars":>10}')
+        results = []
+        for name, run in runs:
+            best = None
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                output = run()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            if name == 'spans':
+                lengths = [end - start for start, end in output]
+            else:
+                lengths = [len(chunk['text']) for chunk in output]
+            row = {
+                'chunker': name,
+                'seconds': round(best, 4),
+                'mb_per_second': round(size_mb / best, 2) if best else None,
+                'chunks': len(output),
+                'max_chunk_chars': max(lengths, default=0),
+            }
+            results.append(row)
+            self.stdout.write(
+                f'{name:<8} {row["seconds"]:>8.3f} {row["mb_per_second"] or 0:>8.2f} '
+                f'{row["chunks"]:>9} {row["max_chunk_chars"]:>10}'
+            )
+
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as f:
+                json.dump({'size_mb': round(size_mb, 2), 'options': {
+                    key: options[key] for key in ('corpus', 'input', 'chunk_size', 'chunk_overlap', 'tokenizer')
+                }, 'results': results}, f, indent=2)
+            self.stdout.write(f'Results written to {options["json"]}')
+
+    def _synthetic_text(self, size, corpus):
+        rng = random.Random(0)
+        words = (
+            'the company policy product customer support team order refund account update '
+            'shipping service request employee manager report data system user access'
+        ).split()
+        parts, total = [], 0
+        while total < size:
+            sentence = ' '.join(rng.choice(words) for _ in range(rng.randint(4, 30)))
+            if corpus == 'prose':
+                sentence = sentence.capitalize() + rng.choice('..!?')
+                sentence += '\n\n' if rng.random() < 0.1 else ' '
+            else:
+                sentence += ' '
+            parts.append(sentence)
+            total += len(sentence)
+        return ''.join(parts)
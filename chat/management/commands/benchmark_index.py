@@ -0,0 +1,164 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+import faiss
+import json
+import time
+import numpy as np
+from chat.vectorstore import VectorStore
+from chat.snapshots import snapshot_path
+from chat.indexes import INDEX_TYPES, configure_threads, create_index, search_params
+
+
+class Command(BaseCommand):
+    help = 'Report recall@k and search latency of each FAISS index type against the flat baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--synthetic',
+            type=int,
+            default=0,
+            help='Benchmark N synthetic clustered vectors instead of the vector store snapshot'
+        )
+        parser.add_argument(
+            '--dim',
+            type=int,
+            default=768,
+            help='Dimension of synthetic vectors (default: 768)'
+        )
+        parser.add_argument(
+            '--input',
+            default=settings.VECTORSTORE_DIR,
+            help='Snapshot directory to take the current version\'s vectors from (default: settings.VECTORSTORE_DIR)'
+        )
+        parser.add_argument(
+            '--index-types',
+            default=','.join(INDEX_TYPES),
+            help=f'Comma-separated index types to compare (default: {",".join(INDEX_TYPES)})'
+        )
+        parser.add_argument('--queries', type=int, default=200, help='Number of queries (default: 200)')
+        parser.add_argument('--top-k', type=int, default=10, help='k for recall@k (default: 10)')
+        parser.add_argument(
+            '--nprobe',
+            default='1,4,16,64',
+            help='Comma-separated nprobe values to try for IVF indexes (default: 1,4,16,64)'
+        )
+        parser.add_argument(
+            '--ef-search',
+            default='16,32,64,128',
+            help='Comma-separated efSearch values to try for HNSW (default: 16,32,64,128)'
+        )
+        parser.add_argument(
+            '--batch',
+            type=int,
+            default=1,
+            help='Queries per FAISS search call, as with VectorStore.search_many; latencies are per call (default: 1)'
+        )
+        parser.add_argument(
+            '--threads',
+            type=int,
+            default=None,
+            help='FAISS OpenMP threads, 0 for one per core (default: settings.FAISS_OMP_THREADS)'
+        )
+        parser.add_argument('--json', help='Also write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        index_types = [t.strip() for t in options['index_types'].split(',') if t.strip()]
+        unknown = set(index_types) - set(INDEX_TYPES)
+        if unknown:
+            raise CommandError(f'Unknown index types: {", ".join(sorted(unknown))}')
+
+        configure_threads(options['threads'])
+        batch = max(1, options['batch'])
+        vectors = self._load_vectors(options)
+        n, dim = vectors.shape
+        top_k = min(options['top_k'], n)
+        rng = np.random.default_rng(0)
+
+        # Queries are corpus vectors with a little noise, like a paraphrased question
+        sample = vectors[rng.integers(0, n, size=options['queries'])]
+        queries = (sample + rng.normal(scale=0.05 * vectors.std(), size=sample.shape)).astype('float32')
+        ids = np.arange(n, dtype='int64')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Benchmarking {n} vectors (dim={dim}), {len(queries)} queries, recall@{top_k}, '
+            f'{batch} per search call, {faiss.omp_get_max_threads()} FAISS threads'
+        ))
+
+        baseline = create_index('flat', dim)
+        baseline.add_with_ids(vectors, ids)
+        _, truth = baseline.search(queries, top_k)
+
+        results = []
+        for index_type in index_types:
+            start = time.perf_counter()
+            index = baseline if index_type == 'flat' else create_index(index_type, dim, vectors)
+            if index is not baseline:
+                index.add_with_ids(vectors, ids)
+            build_seconds = time.perf_counter() - start
+
+            for param_name, value in self._param_grid(index_type, options):
+                params = search_params(index_type, **({param_name: value} if param_name else {}))
+                latencies, recalls = [], []
+                for offset in range(0, len(queries), batch):
+                    start = time.perf_counter()
+                    _, found = index.search(queries[offset:offset + batch], top_k, params=params)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    recalls.extend(
+                        len(set(row) & set(expected)) / top_k
+                        for row, expected in zip(found, truth[offset:offset + batch])
+                    )
+
+                results.append({
+                    'index_type': index_type,
+                    'param': f'{param_name}={value}' if param_name else '',
+                    'build_seconds': round(build_seconds, 3),
+                    f'recall_at_{top_k}': round(float(np.mean(recalls)), 4),
+                    'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+                    'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+                    'mean_ms': round(float(np.mean(latencies)), 3),
+                    'queries_per_second': round(len(queries) / (sum(latencies) / 1000), 1),
+                })
+
+        self._print_table(results, top_k)
+        if options['json']:
+            with open(options['json'], 'w', encoding='utf-8') as f:
+                json.dump({'vectors': n, 'dim': dim, 'top_k': top_k, 'results': results}, f, indent=2)
+            self.stdout.write(f'Results written to {options["json"]}')
+
+    def _load_vectors(self, options):
+        if options['synthetic']:
+            n, dim = options['synthetic'], options['dim']
+            rng = np.random.default_rng(42)
+            # Clustered data; uniform random vectors have no neighbourhood structure
+            centers = rng.normal(size=(max(1, n // 100), dim))
+            labels = rng.integers(0, len(centers), size=n)
+            return (centers[labels] + rng.normal(scale=0.3, size=(n, dim))).astype('float32')
+
+        path = snapshot_path(options['input'])
+        if path is None:
+            raise CommandError(
+                f'No snapshot in {options["input"]}; run rebuild_vectorstore or pass --synthetic N'
+            )
+        store = VectorStore.load(path)
+        ids = store.documents.ids()
+        return store.index.reconstruct_batch(ids)
+
+    def _param_grid(self, index_type, options):
+        if index_type in ('ivf', 'ivfpq'):
+            return [('nprobe', int(v)) for v in options['nprobe'].split(',')]
+        if index_type == 'hnsw':
+            return [('ef_search', int(v)) for v in options['ef_search'].split(',')]
+        return [(None, None)]
+
+    def _print_table(self, results, top_k):
+        recall_key = f'recall_at_{top_k}'
+        self.stdout.write(
+            f'\n{"index":<8} {"param":<14} {"build s":>8} {"recall@" + str(top_k):>10} '
+            f'{"p50 ms":>8} {"p95 ms":>8} {"mean ms":>8} {"qps":>9}'
+        )
+        for row in results:
+            self.stdout.write(
+                f'{row["index_type"]:<8} {row["param"]:<14} {row["build_seconds"]:>8.3f} '
+                f'{row[recall_key]:>10.4f} {row["p50_ms"]:>8.3f} {row["p95_ms"]:>8.3f} {row["mean_ms"]:>8.3f} '
+                f'{row["queries_per_second"]:>9.1f}'
+            )
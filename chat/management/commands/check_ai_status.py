@@ -14,12 +14,18 @@ class Command(BaseCommand):
         self.stdout.write(f"OpenAI Available: {'✅' if status['openai_available'] else '❌'}")
         self.stdout.write(f"Google API Key Set: {'✅' if status['google_api_key_set'] else '❌'}")
         self.stdout.write(f"OpenAI API Key Set: {'✅' if status['openai_api_key_set'] else '❌'}")
+
+        cache = status['embedding_cache']
+        self.stdout.write(self.style.SUCCESS('\n=== Embedding Cache ==='))
+        self.stdout.write(f"Enabled: {'✅' if cache['enabled'] else '❌'} (persistent: {'✅' if cache['persistent'] else '❌'})")
+        self.stdout.write(f"Entries: {cache['size']}/{cache['max_size']}")
+        self.stdout.write(f"Hits: {cache['hits']} (persistent: {cache['persistent_hits']}), Misses: {cache['misses']}, Hit rate: {cache['hit_rate']:.1%}")
         
         # Test connectivity
         self.stdout.write(self.style.SUCCESS('\n=== Testing Connectivity ==='))
         try:
-            test_response = ai_client.chat_with_context("Hello", "Test context")
-            self.stdout.write(f"✅ Chat test successful with {ai_client.get_active_provider()}")
+            provider, test_response = ai_client.chat_with_context("Hello", "Test context")
+            self.stdout.write(f"✅ Chat test successful with {provider}")
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"❌ Chat test failed: {e}"))
         
@@ -28,3 +34,15 @@ class Command(BaseCommand):
             self.stdout.write(f"✅ Embedding test successful (dimension: {len(embedding)})")
         except Exception as e:
             self.stdout.write(self.style.ERROR(f"❌ Embedding test failed: {e}"))
+
+        self.stdout.write(self.style.SUCCESS('\n=== Circuit Breakers (this process) ==='))
+        for provider, breaker in ai_client.get_provider_status()['circuit_breakers'].items():
+            state = breaker['state']
+            style = self.style.SUCCESS if state == 'closed' else self.style.ERROR if state == 'open' else self.style.WARNING
+            line = f"{provider}: {style(state)} - {breaker['window_calls']} recent calls, failure rate {breaker['failure_rate']:.1%}"
+            if breaker['p50_latency_ms'] is not None:
+                line += f", p50 {breaker['p50_latency_ms']} ms, max {breaker['max_latency_ms']} ms"
+            if breaker['retry_in_seconds'] is not None:
+                line += f", probe in {breaker['retry_in_seconds']}s"
+            self.stdout.write(line)
+            self.stdout.write(f"  Opened {breaker['times_opened']} times, {breaker['rejected_calls']} calls skipped")
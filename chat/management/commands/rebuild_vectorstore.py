@@ -1,7 +1,24 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 import os
+import shutil
+from chat.ai_client import ai_client
 from chat.vectorstore import VectorStore
+from chat.indexes import INDEX_TYPES, configure_threads
+from chat.ingest import CHECKPOINT_DIRNAME
+from chat.snapshots import publish, snapshot_path
+from chat.jobs import enqueue
+
+
+def describe_score(result):
+    """
+    The score a search result was ranked by. Hybrid results carry an RRF
+    score, and keyword-only ones (decisive BM25 matches) have no distance.
+    """
+    for key, label in (('rrf_score', 'rrf score'), ('distance', 'distance'), ('bm25_score', 'bm25 score')):
+        if key in result:
+            return f'{label}: {result[key]:.4f}'
+    return 'no score'
 
 
 class Command(BaseCommand):
@@ -12,13 +29,75 @@ class Command(BaseCommand):
             '--chunk-size',
             type=int,
             default=500,
-            help='Size of each chunk in characters (default: 500)'
+            help='Size of each chunk in characters, or tokens if CHUNK_TOKENIZER is set (default: 500)'
         )
         parser.add_argument(
             '--chunk-overlap',
             type=int,
             default=50,
-            help='Overlap between chunks in characters (default: 50)'
+            help='Overlap between chunks in characters, or tokens if CHUNK_TOKENIZER is set (default: 50)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.EMBEDDING_BATCH_SIZE,
+            help='Number of chunks per embedding request (default: settings.EMBEDDING_BATCH_SIZE)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.INGEST_WORKERS,
+            help='Processes reading and chunking files (default: settings.INGEST_WORKERS)'
+        )
+        parser.add_argument(
+            '--embed-workers',
+            type=int,
+            default=settings.INGEST_EMBED_WORKERS,
+            help='Concurrent embedding requests (default: settings.INGEST_EMBED_WORKERS)'
+        )
+        parser.add_argument(
+            '--output',
+            default=settings.VECTORSTORE_DIR,
+            help='Directory to publish the new snapshot version in (default: settings.VECTORSTORE_DIR)'
+        )
+        parser.add_argument(
+            '--index-type',
+            choices=INDEX_TYPES,
+            default=settings.VECTORSTORE_INDEX_TYPE,
+            help='FAISS index type (default: settings.VECTORSTORE_INDEX_TYPE)'
+        )
+        parser.add_argument(
+            '--providers',
+            default=','.join(settings.VECTORSTORE_EMBED_PROVIDERS),
+            help='Comma-separated providers (google, openai) to build an embedding index for; '
+                 'empty for every configured one (default: settings.VECTORSTORE_EMBED_PROVIDERS)'
+        )
+        parser.add_argument(
+            '--faiss-threads',
+            type=int,
+            default=0,
+            help='OpenMP threads FAISS uses for training and adding vectors, 0 for one per core (default: 0)'
+        )
+        parser.add_argument(
+            '--retrain',
+            action='store_true',
+            help='Rebuild the index from the stored vectors (retrains IVF centroids) without re-embedding'
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Ignore the existing snapshot and any checkpoint, and re-embed every document'
+        )
+        parser.add_argument(
+            '--keep-versions',
+            type=int,
+            default=settings.VECTORSTORE_KEEP_VERSIONS,
+            help='Snapshot versions to keep for rollback, 0 for all (default: settings.VECTORSTORE_KEEP_VERSIONS)'
+        )
+        parser.add_argument(
+            '--enqueue',
+            action='store_true',
+            help='Queue the rebuild for a job worker (`manage.py run_worker`) instead of running it now'
         )
         parser.add_argument(
             '--show-stats',
@@ -27,21 +106,73 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
+        if options['enqueue']:
+            job = enqueue('rebuild_vectorstore', {
+                key: options[key] for key in (
+                    'chunk_size', 'chunk_overlap', 'batch_size', 'workers', 'embed_workers',
+                    'output', 'index_type', 'providers', 'faiss_threads', 'retrain', 'full', 'keep_versions',
+                    'show_stats',
+                )
+            }, unique=True)
+            self.stdout.write(self.style.SUCCESS(f'Queued rebuild as job #{job.pk}'))
+            return
+
+        # Unlike a server process (FAISS_OMP_THREADS), a rebuild may use every core
+        configure_threads(options['faiss_threads'])
+
         chunk_size = options['chunk_size']
         chunk_overlap = options['chunk_overlap']
         
+        output = options['output']
+        index_type = options['index_type']
+
         self.stdout.write(
             self.style.SUCCESS(
-                f'Building vector store with chunk_size={chunk_size}, chunk_overlap={chunk_overlap}'
+                f'Building {index_type} vector store with chunk_size={chunk_size}, chunk_overlap={chunk_overlap}'
             )
         )
 
-        # Create new vector store with specified parameters
-        vector_store = VectorStore(
-            dim=768, 
-            chunk_size=chunk_size, 
-            chunk_overlap=chunk_overlap
-        )
+        checkpoint = os.path.join(output, CHECKPOINT_DIRNAME)
+        if options['full'] and os.path.exists(checkpoint):
+            shutil.rmtree(checkpoint)
+
+        vector_store = None
+        resumed = False
+        if not options['full'] and VectorStore.exists(checkpoint):
+            # An earlier rebuild was interrupted; carry on from where it stopped
+            vector_store = self._load_existing(checkpoint, chunk_size, chunk_overlap)
+            resumed = vector_store is not None
+            if resumed:
+                self.stdout.write(f'Resuming interrupted rebuild from checkpoint {vector_store.version}')
+        current = snapshot_path(output)
+        if vector_store is None and not options['full'] and current is not None:
+            vector_store = self._load_existing(current, chunk_size, chunk_overlap)
+            if vector_store is not None:
+                self.stdout.write(f'Updating snapshot {vector_store.version} incrementally')
+
+        namespaces = ai_client.embedding_namespaces([key for key in options['providers'].split(',') if key])
+        if not namespaces:
+            raise CommandError(f'None of the providers {options["providers"]!r} is configured')
+
+        namespaces_changed = False
+        if vector_store is None:
+            # Create new vector store with specified parameters
+            vector_store = VectorStore(
+                chunk_size=chunk_size, 
+                chunk_overlap=chunk_overlap,
+                index_type=index_type,
+                namespaces=namespaces,
+            )
+            vector_store.embed_batch_size = options['batch_size']
+        else:
+            vector_store.embed_batch_size = options['batch_size']
+            # A newly configured provider's index is embedded from the stored chunk texts
+            namespaces_changed = vector_store.set_namespaces(namespaces, progress=True)
+            if namespaces_changed:
+                self.stdout.write(f'Embedding indexes: {", ".join(namespaces)}')
+
+        # Existing vectors are reused when switching index type or retraining
+        reindex = options['retrain'] or vector_store.index_type != index_type
 
         # Load documents from the documents folder
         docs_folder = os.path.join(settings.BASE_DIR, 'documents')
@@ -53,7 +184,31 @@ class Command(BaseCommand):
             return
 
         self.stdout.write('Loading and chunking documents...')
-        vector_store.load_from_folder(docs_folder)
+        try:
+            changes = vector_store.load_from_folder(
+                docs_folder,
+                checkpoint_path=checkpoint,
+                progress=True,
+                workers=options['workers'],
+                embed_workers=options['embed_workers'],
+            )
+        except (Exception, KeyboardInterrupt) as e:
+            if VectorStore.exists(checkpoint):
+                raise CommandError(
+                    f'Ingestion failed: {e!r}. Progress was saved to {checkpoint}; '
+                    'run the command again to resume.'
+                )
+            raise
+        self.stdout.write(
+            f'Files: {changes["added_files"]} added, {changes["changed_files"]} changed, '
+            f'{changes["removed_files"]} removed, {changes["unchanged_files"]} unchanged\n'
+            f'Chunks: {changes["embedded_chunks"]} embedded, {changes["reused_chunks"]} reused, '
+            f'{changes["removed_chunks"]} removed'
+        )
+
+        if reindex:
+            self.stdout.write(f'Building {index_type} index from {len(vector_store.documents)} stored vectors...')
+            vector_store.rebuild_index(index_type)
 
         if options['show_stats']:
             stats = vector_store.get_stats()
@@ -62,12 +217,29 @@ class Command(BaseCommand):
                     f'\nVector Store Statistics:\n'
                     f'- Total chunks: {stats["total_chunks"]}\n'
                     f'- Total files: {stats["total_files"]}\n'
+                    f'- Embedding indexes: {", ".join(stats["namespaces"])}\n'
                     f'- Files processed: {", ".join(stats["files"])}'
                 )
             )
 
+        if vector_store.version and not reindex and not resumed and not namespaces_changed and not any(
+            changes[key] for key in ('added_files', 'changed_files', 'removed_files')
+        ):
+            self.stdout.write(
+                self.style.SUCCESS(f'Vector store is up to date (snapshot {vector_store.version})')
+            )
+            return
+
+        # A new version directory; running servers pick it up when CURRENT changes
+        publish(vector_store, output, keep=options['keep_versions'])
+        if os.path.exists(checkpoint):
+            shutil.rmtree(checkpoint)
+
         self.stdout.write(
-            self.style.SUCCESS('Vector store rebuilt successfully!')
+            self.style.SUCCESS(
+                f'Vector store rebuilt successfully! Snapshot {vector_store.version} '
+                f'published in {output}'
+            )
         )
         
         # Test search functionality
@@ -78,8 +250,24 @@ class Command(BaseCommand):
             metadata = result.get('metadata', {})
             filename = metadata.get('filename', 'Unknown')
             chunk_idx = metadata.get('chunk_index', 'N/A')
-            distance = result.get('distance', 'N/A')
             
             self.stdout.write(
-                f'  {i}. {filename} (chunk {chunk_idx}, distance: {distance:.4f})'
+                f'  {i}. {filename} (chunk {chunk_idx}, {describe_score(result)})'
+            )
+
+    def _load_existing(self, path, chunk_size, chunk_overlap):
+        """Load the snapshot in ``path`` for updating, or None if it can't be reused."""
+        try:
+            vector_store = VectorStore.load(path, mmap=False)
+        except ValueError as e:
+            self.stdout.write(self.style.WARNING(f'{e}; doing a full rebuild'))
+            return None
+        if (vector_store.chunk_size, vector_store.chunk_overlap, vector_store.tokenizer) != (
+            chunk_size, chunk_overlap, settings.CHUNK_TOKENIZER
+        ):
+            # Chunk boundaries change with these settings, so nothing can be reused
+            self.stdout.write(
+                self.style.WARNING('Chunking parameters changed; doing a full rebuild')
             )
+            return None
+        return vector_store
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+import os
+import signal
+import socket
+import threading
+from chat import scheduler
+
+
+class Command(BaseCommand):
+    help = 'Run the periodic jobs; with several instances, only the lease holder runs them'
+
+    def handle(self, *args, **options):
+        holder = f"{socket.gethostname()}:{os.getpid()}"
+        stop_event = threading.Event()
+        # Shut down cleanly and hand the lease over on SIGTERM/SIGINT
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stop_event.set())
+        self.stdout.write(self.style.SUCCESS(f'Scheduler {holder} waiting for the lease'))
+        scheduler.run(holder, stop_event)
@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.db import connections
+import multiprocessing
+import signal
+from chat.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs (emails, reindexing, cleanup) from the job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=settings.JOB_WORKER_PROCESSES,
+            help='Worker processes to run (default: settings.JOB_WORKER_PROCESSES)'
+        )
+        parser.add_argument(
+            '--poll-seconds',
+            type=float,
+            default=settings.JOB_POLL_SECONDS,
+            help='Seconds to wait before polling an empty queue again (default: settings.JOB_POLL_SECONDS)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once no job is due instead of waiting for more'
+        )
+
+    def handle(self, *args, **options):
+        processes = max(1, options['processes'])
+        self.stdout.write(self.style.SUCCESS(f'Starting {processes} job worker(s)'))
+        if processes == 1:
+            _run(options['poll_seconds'], options['once'])
+            return
+
+        # Forked children must open their own database connections
+        connections.close_all()
+        children = [
+            multiprocessing.Process(target=_run, args=(options['poll_seconds'], options['once']))
+            for _ in range(processes)
+        ]
+        for child in children:
+            child.start()
+        try:
+            for child in children:
+                child.join()
+        except KeyboardInterrupt:
+            # Ctrl+C reaches the children too; wait for their current jobs
+            for child in children:
+                child.join()
+
+
+def _run(poll_seconds, once):
+    worker = Worker(poll_seconds=poll_seconds)
+    # Stop between jobs on SIGTERM/SIGINT rather than abandoning one midway
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: worker.stop())
+    worker.run(once=once)
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from chat.snapshots import current_version, list_versions, previous_version, set_current
+
+
+class Command(BaseCommand):
+    help = 'List vector store snapshot versions, or switch the one servers use'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dir',
+            default=settings.VECTORSTORE_DIR,
+            help='Snapshot directory (default: settings.VECTORSTORE_DIR)'
+        )
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--activate', metavar='VERSION', help='Make VERSION the current version')
+        group.add_argument(
+            '--rollback',
+            action='store_true',
+            help='Make the version published before the current one current again'
+        )
+
+    def handle(self, *args, **options):
+        root = options['dir']
+        version = options['activate']
+        if options['rollback']:
+            version = previous_version(root)
+            if version is None:
+                raise CommandError('There is no earlier version to roll back to')
+
+        if version:
+            try:
+                set_current(root, version)
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(
+                f'Version {version} is now current; servers switch to it within '
+                f'{settings.VECTORSTORE_RELOAD_POLL_SECONDS:g}s (or on SIGHUP)'
+            ))
+            return
+
+        current = current_version(root)
+        versions = list_versions(root)
+        if not versions:
+            self.stdout.write(f'No snapshot versions in {root}')
+        for name in versions:
+            self.stdout.write(f'{"*" if name == current else " "} {name}')
@@ -0,0 +1,126 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+from .chunker import SENTENCE_END, approx_token_count
+from .models import Conversation
+
+
+def _clip(text: str, max_tokens: int) -> str:
+    """Cut ``text`` to about ``max_tokens`` tokens, at a word boundary."""
+    if approx_token_count(text) <= max_tokens:
+        return text
+    limit = max_tokens * 4
+    cut = text.rfind(" ", 0, limit)
+    return text[:cut if cut > 0 else limit].rstrip() + "..."
+
+
+def _first_sentence(text: str) -> str:
+    text = " ".join(text.split())
+    match = SENTENCE_END.search(text)
+    return text[:match.start() + 1] if match else text
+
+
+class ConversationMemory:
+    """
+    Bounded memory of a Conversation, used to rewrite the retrieval query
+    and as extra prompt context.
+
+    Only the last ``turns`` (message, response) pairs are kept verbatim,
+    each clipped to ``turn_tokens`` tokens. Older turns are folded into the
+    conversation's extractive summary (the first sentence of each question
+    and answer), from which the oldest lines are dropped to stay under
+    ``summary_tokens``. The history added to a prompt is therefore bounded
+    however long the conversation gets.
+
+    Recent turns are kept in Django's cache, keyed by conversation and
+    validated against ``Conversation.turn_count``, so the messages table is
+    only read after a cache miss. Configure a shared CACHES backend (e.g.
+    Redis) to share them between workers; with the default per-process
+    cache a worker that hasn't seen the conversation reloads it once.
+    """
+
+    def __init__(self, turns: int = 3, turn_tokens: int = 150, summary_tokens: int = 200,
+                 cache_seconds: int = 3600):
+        self.turns = turns
+        self.turn_tokens = turn_tokens
+        self.summary_tokens = summary_tokens
+        self.cache_seconds = cache_seconds
+
+    @staticmethod
+    def _key(conversation_id) -> str:
+        return f"chat:conversation:{conversation_id}:turns"
+
+    def _clip_turn(self, message: str, response: str):
+        return [_clip(message, self.turn_tokens), _clip(response, self.turn_tokens)]
+
+    def recent_turns(self, conversation: Conversation):
+        """The last ``turns`` ``[message, response]`` pairs, oldest first."""
+        if not self.turns or not conversation.turn_count:
+            return []
+        entry = cache.get(self._key(conversation.pk))
+        if entry is not None and entry["turn_count"] == conversation.turn_count:
+            return entry["turns"]
+
+        rows = conversation.messages.order_by("-created_at").values_list("message", "response")[:self.turns]
+        turns = [self._clip_turn(message, response) for message, response in reversed(rows)]
+        cache.set(self._key(conversation.pk), {"turns": turns, "turn_count": conversation.turn_count},
+                  self.cache_seconds)
+        return turns
+
+    def rewrite_query(self, message: str, turns) -> str:
+        """
+        Retrieval query for ``message``: prefixed with the previous question,
+        so follow-ups like "and how long does that take?" still match the
+        chunks about the subject of the conversation.
+        """
+        if not turns:
+            return message
+        return f"{turns[-1][0]} {message}"
+
+    def format_history(self, conversation: Conversation, turns) -> str:
+        """Summary and recent turns as prompt text ("" for a new conversation)."""
+        parts = []
+        if conversation.summary:
+            parts.append(f"Summary of the earlier conversation:\n{conversation.summary}")
+        for message, response in turns:
+            parts.append(f"User: {message}\nCompany Assistant: {response}")
+        return "\n\n".join(parts)
+
+    def add_turn(self, conversation: Conversation, turns, message: str, response: str):
+        """
+        Record a finished turn, folding turns that leave the window into the
+        summary. Call it with the conversation row locked (see
+        chat.views.save_turn) so concurrent turns don't fold the same
+        summary; the turn count is incremented in the database either way.
+        """
+        turns = [*turns, self._clip_turn(message, response)]
+        if len(turns) > self.turns:
+            dropped, turns = turns[:len(turns) - self.turns], turns[len(turns) - self.turns:]
+            conversation.summary = self._summarize(conversation.summary, dropped)
+
+        conversation.updated_at = timezone.now()
+        Conversation.objects.filter(pk=conversation.pk).update(
+            summary=conversation.summary,
+            turn_count=F("turn_count") + 1,
+            updated_at=conversation.updated_at,
+        )
+        conversation.turn_count = Conversation.objects.values_list("turn_count", flat=True).get(pk=conversation.pk)
+        cache.set(self._key(conversation.pk), {"turns": turns, "turn_count": conversation.turn_count},
+                  self.cache_seconds)
+
+    def _summarize(self, summary: str, turns) -> str:
+        lines = summary.splitlines() if summary else []
+        for message, response in turns:
+            lines.append(f"- Q: {_first_sentence(message)} A: {_first_sentence(response)}")
+        while len(lines) > 1 and approx_token_count("\n".join(lines)) > self.summary_tokens:
+            lines.pop(0)
+        return _clip("\n".join(lines), self.summary_tokens)
+
+
+conversation_memory = ConversationMemory(
+    turns=settings.CHAT_MEMORY_TURNS,
+    turn_tokens=settings.CHAT_MEMORY_TURN_TOKENS,
+    summary_tokens=settings.CHAT_MEMORY_SUMMARY_TOKENS,
+    cache_seconds=settings.CHAT_MEMORY_CACHE_SECONDS,
+)
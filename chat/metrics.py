@@ -0,0 +1,184 @@
+from contextlib import contextmanager
+import bisect
+import threading
+import time
+
+# Upper bounds in seconds, from a local FAISS search to a slow LLM call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names (``name`` should end in ``_total``)."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed set of label names."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][slot] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the ``with`` block. Labels may be added to the yielded dict."""
+        labels = dict(labels)
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self.values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else repr(float(bound))
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', le)])} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}"
+
+
+class MetricsRegistry:
+    """
+    Holds this process's metrics and renders them in the Prometheus text
+    exposition format. Each worker process has its own registry, so
+    Prometheus should scrape every worker (or sum them by instance).
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+chat_requests = registry.register(Counter(
+    "chat_requests_total", "Chat requests by endpoint, outcome and whether the answer came from the cache",
+    ["endpoint", "status", "cache"],
+))
+chat_request_seconds = registry.register(Histogram(
+    "chat_request_seconds", "End-to-end latency of answered chat requests",
+    ["endpoint", "provider", "cache"],
+))
+chat_stage_seconds = registry.register(Histogram(
+    "chat_stage_seconds",
+    "Server-side latency of each stage of the chat pipeline, by the provider serving the stage, "
+    "whether it was a fallback and whether the answer came from the cache",
+    ["stage", "provider", "fallback", "cache"],
+))
+ai_call_seconds = registry.register(Histogram(
+    "ai_call_seconds", "Latency of AI provider calls (time to first token for streams)",
+    ["provider", "operation", "outcome"],
+))
+ai_fallbacks = registry.register(Counter(
+    "ai_fallbacks_total", "Operations retried on a lower-priority provider, by the provider fallen back to",
+    ["operation", "provider"],
+))
+ai_circuit_rejections = registry.register(Counter(
+    "ai_circuit_rejections_total", "Provider calls skipped because the circuit breaker was open",
+    ["provider"],
+))
+embedding_batch_size = registry.register(Histogram(
+    "embedding_batch_size", "Query embeddings sent per provider request by the coalescer (chat/coalescer.py)",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+))
+search_batch_size = registry.register(Histogram(
+    "search_batch_size", "Query vectors per FAISS search call made by the search coalescer (chat/coalescer.py)",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+))
+
+
+class StageTimings:
+    """
+    Durations of one request's chat pipeline stages. The provider and cache
+    labels are only known once the request is answered, so the stages are
+    collected here and observed in ``chat_stage_seconds`` by ``observe``.
+
+    ``labels`` apply to every stage that wasn't given its own (retrieval
+    sets the embedding provider there once the query is embedded).
+    """
+
+    def __init__(self):
+        self.stages = []
+        self.labels = {}
+
+    def add(self, stage: str, seconds: float, **labels):
+        self.stages.append((stage, seconds, labels))
+
+    @contextmanager
+    def time(self, stage: str, **labels):
+        """Time the ``with`` block as ``stage``. Labels may be added to the yielded dict."""
+        labels = dict(labels)
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.add(stage, time.perf_counter() - start, **labels)
+
+    def observe(self, **labels):
+        """Record the stages so far, with ``labels`` (e.g. ``cache``) added to each."""
+        stages, self.stages = self.stages, []
+        for stage, seconds, own in stages:
+            chat_stage_seconds.observe(seconds, stage=stage, **{**self.labels, **own, **labels})
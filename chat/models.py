@@ -1,8 +1,92 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+class Conversation(models.Model):
+    """A chat session: a user's sequence of messages and its rolling summary."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Condensed turns that no longer fit in the recent-turn window
+    summary = models.TextField(blank=True, default="")
+    # Messages so far; validates cached recent turns (see chat.memory)
+    turn_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["updated_at"], name="conversation_updated"),
+        ]
+
+
 class ChatMessage(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
+    conversation = models.ForeignKey(
+        Conversation, on_delete=models.CASCADE, null=True, blank=True, related_name="messages"
+    )
     message = models.TextField()
     response = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # A user's history, newest first (keyset pagination)
+            models.Index(fields=["user", "-created_at"], name="chat_message_user_created"),
+            # Retention cleanup by age across all users
+            models.Index(fields=["created_at"], name="chat_message_created"),
+            # Recent turns of a conversation
+            models.Index(fields=["conversation", "-created_at"], name="chat_message_conv_created"),
+        ]
+
+
+class Job(models.Model):
+    """A unit of background work, run by `python manage.py run_worker` (see chat.jobs)."""
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [(s, s) for s in (QUEUED, RUNNING, SUCCEEDED, FAILED)]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    # Not claimed before this time; pushed back after each failed attempt
+    run_after = models.DateTimeField()
+    locked_by = models.CharField(max_length=100, blank=True, default="")
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed by the worker while the job runs; a stale one means the worker died
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default="")
+    # Seconds the last attempt ran for
+    duration = models.FloatField(null=True, blank=True)
+    # Name and payload of jobs queued with unique=True; at most one of them waits at a time
+    unique_key = models.CharField(max_length=64, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Workers look for the next due queued job
+            models.Index(fields=["status", "run_after"], name="job_status_run_after"),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["unique_key"], condition=models.Q(status="queued"), name="job_unique_queued"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+
+class SchedulerLease(models.Model):
+    """
+    Leadership of a periodic scheduler. The `run_scheduler` instance holding
+    an unexpired lease runs the jobs; the others wait to take it over.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    holder = models.CharField(max_length=100, blank=True, default="")
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder or 'nobody'} until {self.expires_at}"
@@ -2,19 +2,36 @@ import openai
 from django.conf import settings
 
 class OpenAIClient:
+    CHAT_MODEL = "gpt-4o-mini"  # Latest and most cost-effective model
+    EMBED_MODEL = "text-embedding-3-small"
+    EMBED_DIM = 1536
+    # Largest number of inputs the embeddings endpoint accepts per request
+    MAX_EMBED_BATCH = 2048
+
     def __init__(self):
-        self.client = openai.OpenAI(api_key=settings.OPENAI_API_KEY)
+        self.client = openai.OpenAI(api_key=settings.OPENAI_API_KEY, timeout=settings.AI_REQUEST_TIMEOUT)
+        self.async_client = openai.AsyncOpenAI(api_key=settings.OPENAI_API_KEY, timeout=settings.AI_REQUEST_TIMEOUT)
     
     def embed_text(self, text: str):
         """Generate embeddings using OpenAI's latest embedding model."""
         response = self.client.embeddings.create(
-            model="text-embedding-3-small",
+            model=self.EMBED_MODEL,
             input=text
         )
         return response.data[0].embedding
+
+    def embed_texts(self, texts: list[str]):
+        """Embed up to MAX_EMBED_BATCH texts in a single request."""
+        response = self.client.embeddings.create(
+            model=self.EMBED_MODEL,
+            input=list(texts)
+        )
+        # The API documents `index` on each item; don't rely on response order
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
     
-    def chat_with_context(self, prompt: str, context: str):
-        """Generate chat response using OpenAI's latest chat model."""
+    def _build_messages(self, prompt: str, context: str, history: str = ""):
+        if history:
+            history = f"Conversation so far:\n        {history}\n"
         full_prompt = f"""
         You are a helpful assistant that represents our company. 
         Always answer as if you are the company itself, not an AI model. 
@@ -25,18 +42,35 @@ class OpenAIClient:
         Context:
         {context}
 
+        {history}
         User: {prompt}
         Company Assistant:
         """
+        return [
+            {"role": "system", "content": "You are a helpful company assistant."},
+            {"role": "user", "content": full_prompt}
+        ]
 
+    def chat_with_context(self, prompt: str, context: str, history: str = ""):
+        """Generate chat response using OpenAI's latest chat model."""
         response = self.client.chat.completions.create(
-            model="gpt-4o-mini",  # Latest and most cost-effective model
-            messages=[
-                {"role": "system", "content": "You are a helpful company assistant."},
-                {"role": "user", "content": full_prompt}
-            ],
+            model=self.CHAT_MODEL,
+            messages=self._build_messages(prompt, context, history),
             max_tokens=1000,
             temperature=0.7
         )
         
         return response.choices[0].message.content
+
+    async def stream_chat_with_context(self, prompt: str, context: str, history: str = ""):
+        """Yield the response text piece by piece as the model generates it."""
+        stream = await self.async_client.chat.completions.create(
+            model=self.CHAT_MODEL,
+            messages=self._build_messages(prompt, context, history),
+            max_tokens=1000,
+            temperature=0.7,
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from django.conf import settings
+import threading
+import time
+import faiss
+import numpy as np
+
+
+class SemanticResponseCache:
+    """
+    Answers to past questions, looked up by embedding similarity.
+
+    Question embeddings are L2-normalised and kept in a small inner-product
+    FAISS index, so the search score is the cosine similarity. A stored answer
+    is reused when the closest past question scores at least ``threshold``.
+
+    Entries expire after ``ttl`` seconds, the least recently used entry is
+    evicted once ``max_size`` is reached, and everything is dropped when the
+    document index changes version (answers may depend on the old documents)
+    or questions start being embedded into another namespace (after a
+    provider failover), since vectors of different models can't be compared.
+    The cache lives in process memory, so each worker has its own.
+    """
+
+    def __init__(self, threshold: float = 0.95, ttl: int = 3600, max_size: int = 1000):
+        self.enabled = max_size > 0
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._reset()
+
+    def _reset(self, dim: int = None, store_version: str = None, namespace: str = None):
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim)) if dim else None
+        # id -> {"response", "provider", "expires_at"}; ordered oldest use first
+        self.entries = OrderedDict()
+        self.next_id = 0
+        self.store_version = store_version
+        self.namespace = namespace
+
+    def clear(self):
+        with self.lock:
+            self._reset()
+
+    def lookup(self, query_vec, store_version: str, namespace: str = None):
+        """Return the cached entry for a similar enough question (embedded into ``namespace``), or None."""
+        if not self.enabled:
+            return None
+        vec = _normalize(query_vec)
+        with self.lock:
+            if (store_version, namespace) != (self.store_version, self.namespace):
+                self._reset(store_version=store_version, namespace=namespace)
+            if self.index is None or self.index.ntotal == 0 or self.index.d != vec.shape[1]:
+                self.misses += 1
+                return None
+
+            scores, ids = self.index.search(vec, 1)
+            entry_id = int(ids[0][0])
+            entry = self.entries.get(entry_id)
+            if entry is not None and entry["expires_at"] <= time.time():
+                self._remove(entry_id)
+                entry = None
+            if entry is None or scores[0][0] < self.threshold:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(entry_id)
+            self.hits += 1
+            return {**entry, "similarity": float(scores[0][0])}
+
+    def add(self, query_vec, response: str, provider: str, store_version: str, namespace: str = None):
+        if not self.enabled:
+            return
+        vec = _normalize(query_vec)
+        with self.lock:
+            if (store_version, namespace) != (self.store_version, self.namespace) or self.index is None:
+                self._reset(dim=vec.shape[1], store_version=store_version, namespace=namespace)
+            if self.index.d != vec.shape[1]:
+                # Embedded by a provider with another dimension; can't be compared
+                return
+
+            while len(self.entries) >= self.max_size:
+                self._remove(next(iter(self.entries)))
+
+            entry_id = self.next_id
+            self.next_id += 1
+            self.index.add_with_ids(vec, np.array([entry_id], dtype="int64"))
+            self.entries[entry_id] = {
+                "response": response,
+                "provider": provider,
+                "expires_at": time.time() + self.ttl,
+            }
+
+    def _remove(self, entry_id: int):
+        self.entries.pop(entry_id, None)
+        self.index.remove_ids(np.array([entry_id], dtype="int64"))
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+def _normalize(vec):
+    vec = np.array(vec, dtype="float32").reshape(1, -1)
+    faiss.normalize_L2(vec)
+    return vec
+
+
+# Global instance
+response_cache = SemanticResponseCache(
+    threshold=settings.RESPONSE_CACHE_THRESHOLD,
+    ttl=settings.RESPONSE_CACHE_TTL,
+    max_size=settings.RESPONSE_CACHE_SIZE,
+)
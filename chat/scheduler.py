@@ -1,40 +1,120 @@
 from apscheduler.schedulers.background import BackgroundScheduler
-from django_apscheduler.jobstores import DjangoJobStore, register_events
+from django_apscheduler.jobstores import DjangoJobStore
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import DateTimeField, ExpressionWrapper, Q
+from django.db.models.functions import Now
 from django.utils import timezone
-from chat.models import ChatMessage
+from chat.models import ChatMessage, Conversation, Job, SchedulerLease
+from chat.jobs import enqueue
 from datetime import timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+
+LEASE_NAME = "scheduler"
 
 def cleanup_old_messages():
     """
-    Delete chat messages older than 30 days.
-    """
-    threshold_date = timezone.now() - timedelta(days=30)
-    old_messages = ChatMessage.objects.filter(timestamp__lt=threshold_date)
-    count = old_messages.count()
-    old_messages.delete()
-    print(f"Deleted {count} old chat messages.")
+    Delete chat messages older than CHAT_RETENTION_DAYS.
 
-def send_verification_emails():
-    """
-    Placeholder function to send verification emails.
+    Deletes in batches of CHAT_CLEANUP_BATCH_SIZE rows, each its own short
+    statement, so the table is never locked for the whole cleanup.
     """
-    print("Sending verification emails to users... (functionality not implemented)")
+    threshold_date = timezone.now() - timedelta(days=settings.CHAT_RETENTION_DAYS)
+    count = _delete_in_batches(ChatMessage, ChatMessage.objects.filter(created_at__lt=threshold_date))
+    # Conversations idle for the whole retention period have no messages left
+    conversations = _delete_in_batches(Conversation, Conversation.objects.filter(updated_at__lt=threshold_date))
+    jobs = _delete_in_batches(Job, Job.objects.filter(
+        finished_at__lt=timezone.now() - timedelta(days=settings.JOB_RETENTION_DAYS)
+    ))
+    logger.info(f"Deleted {count} old chat messages, {conversations} idle conversations and {jobs} finished jobs")
 
 
-def start():
+def _delete_in_batches(model, queryset):
+    """Delete the rows of ``queryset`` CHAT_CLEANUP_BATCH_SIZE at a time; returns how many."""
+    count = 0
+    while True:
+        ids = list(queryset.values_list("id", flat=True)[:settings.CHAT_CLEANUP_BATCH_SIZE])
+        if not ids:
+            return count
+        model.objects.filter(id__in=ids).delete()
+        count += len(ids)
+
+
+def create_scheduler():
     scheduler = BackgroundScheduler()
+    # Records every run with its duration (admin: Django APScheduler -> Django job executions)
     scheduler.add_jobstore(DjangoJobStore(), "default")
 
-    # Schedule the cleanup job to run daily at midnight
+    # Queue the cleanup daily; a job worker runs it (see chat.jobs). A fixed
+    # time of day, unlike an interval, is not pushed back when leadership moves
     scheduler.add_job(
-        cleanup_old_messages,
-        'interval',
-        days=1,
+        enqueue,
+        'cron',
+        hour=settings.CHAT_CLEANUP_HOUR,
+        args=['cleanup_old_messages'],
+        kwargs={'unique': True},
         id='cleanup_old_messages',
-        replace_existing=True
+        replace_existing=True,
+        coalesce=True,
+        misfire_grace_time=3600,
+    )
+    return scheduler
+
+
+def acquire_lease(holder: str, name: str = LEASE_NAME) -> bool:
+    """
+    Take or renew the ``name`` lease for ``holder`` for SCHEDULER_LEASE_SECONDS;
+    returns whether ``holder`` now holds it. Expiry is computed with the
+    database's clock, so hosts with skewed clocks still agree on it.
+    """
+    expires_at = ExpressionWrapper(
+        Now() + timedelta(seconds=settings.SCHEDULER_LEASE_SECONDS), output_field=DateTimeField()
+    )
+    SchedulerLease.objects.get_or_create(name=name, defaults={"expires_at": timezone.now()})
+    # A single conditional UPDATE, so two contenders can't both win an expired lease
+    return bool(
+        SchedulerLease.objects.filter(name=name)
+        .filter(Q(holder=holder) | Q(holder="") | Q(expires_at__lt=Now()))
+        .update(holder=holder, expires_at=expires_at)
     )
 
 
-    register_events(scheduler)
-    scheduler.start()
-    print("Scheduler started...")
\ No newline at end of file
+def release_lease(holder: str, name: str = LEASE_NAME):
+    """Give up the lease, if ``holder`` has it, so another instance can take over at once."""
+    SchedulerLease.objects.filter(name=name, holder=holder).update(holder="")
+
+
+def run(holder: str, stop_event):
+    """
+    Run the periodic jobs while ``holder`` is the leader, until ``stop_event``
+    is set. Every instance keeps trying to acquire the lease; the one that
+    holds it starts the scheduler and renews the lease every
+    SCHEDULER_LEASE_RENEW_SECONDS, and shuts its scheduler down as soon as a
+    renewal fails, before the lease can expire and pass to another instance.
+    """
+    scheduler = None
+    try:
+        while not stop_event.is_set():
+            close_old_connections()
+            try:
+                leader = acquire_lease(holder)
+            except Exception as e:
+                logger.warning(f"Could not renew the scheduler lease: {e}")
+                leader = False
+            if leader and scheduler is None:
+                scheduler = create_scheduler()
+                scheduler.start()
+                logger.info(f"{holder} is the scheduler leader; scheduler started")
+            elif not leader and scheduler is not None:
+                scheduler.shutdown(wait=False)
+                scheduler = None
+                logger.warning(f"{holder} lost the scheduler lease; scheduler stopped")
+            stop_event.wait(settings.SCHEDULER_LEASE_RENEW_SECONDS)
+    finally:
+        if scheduler is not None:
+            scheduler.shutdown()
+            release_lease(holder)
+            logger.info(f"{holder} released the scheduler lease")
+        close_old_connections()
@@ -5,4 +5,5 @@ class ChatMessageSerializer(ModelSerializer):
     user = StringRelatedField(read_only=True)
     class Meta:
         model = ChatMessage
-        fields = ["user", "message", "response", "created_at"]
+        fields = ["user", "conversation", "message", "response", "created_at"]
+        read_only_fields = ["conversation"]
@@ -0,0 +1,244 @@
+from django.conf import settings
+import logging
+import os
+import shutil
+import signal
+import threading
+import uuid
+import numpy as np
+from .vectorstore import VectorStore
+
+logger = logging.getLogger(__name__)
+
+# Layout of VECTORSTORE_DIR: one directory per snapshot under versions/, and
+# CURRENT naming the one to serve. A snapshot directory is never modified
+# once published, so a process can keep searching it while a newer one is
+# written next to it.
+VERSIONS_DIRNAME = "versions"
+CURRENT_FILENAME = "CURRENT"
+
+
+def list_versions(root: str):
+    """Complete snapshot versions under ``root``, oldest first."""
+    versions_dir = os.path.join(root, VERSIONS_DIRNAME)
+    if not os.path.isdir(versions_dir):
+        return []
+    # Versions start with their creation time, so they sort chronologically
+    return sorted(
+        name for name in os.listdir(versions_dir)
+        if not name.startswith(".") and VectorStore.exists(os.path.join(versions_dir, name))
+    )
+
+
+def current_version(root: str):
+    """The version CURRENT points at, or None."""
+    try:
+        with open(os.path.join(root, CURRENT_FILENAME), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def snapshot_path(root: str, version: str = None):
+    """
+    Directory of ``version`` (default: the current one) under ``root``, or
+    None if there is none.
+    """
+    version = version or current_version(root)
+    if not version:
+        return None
+    path = os.path.join(root, VERSIONS_DIRNAME, version)
+    return path if VectorStore.exists(path) else None
+
+
+def set_current(root: str, version: str):
+    """Point CURRENT at ``version``, atomically: readers see the old or the new name, never a mix."""
+    if snapshot_path(root, version) is None:
+        raise ValueError(f"No vector store version {version!r} in {root}")
+    path = os.path.join(root, CURRENT_FILENAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def publish(store: VectorStore, root: str, keep: int = None):
+    """
+    Save ``store`` as a new version under ``root``, make it current and
+    prune old versions. The snapshot is written to a hidden staging
+    directory and renamed into place, so a version directory is always
+    complete. Returns the new version.
+    """
+    versions_dir = os.path.join(root, VERSIONS_DIRNAME)
+    staging = os.path.join(versions_dir, f".incoming-{uuid.uuid4().hex}")
+    store.save(staging)
+    os.rename(staging, os.path.join(versions_dir, store.version))
+    set_current(root, store.version)
+    prune(root, keep)
+    return store.version
+
+
+def previous_version(root: str):
+    """The newest version older than the current one, or None."""
+    current = current_version(root)
+    older = [version for version in list_versions(root) if current is None or version < current]
+    return older[-1] if older else None
+
+
+def prune(root: str, keep: int = None):
+    """
+    Delete all but the newest ``keep`` versions (default:
+    settings.VECTORSTORE_KEEP_VERSIONS; 0 keeps them all), never the
+    current one. Processes still searching a deleted version are
+    unaffected: its memory-mapped files stay readable until unmapped.
+    """
+    keep = settings.VECTORSTORE_KEEP_VERSIONS if keep is None else keep
+    if keep <= 0:
+        return
+    current = current_version(root)
+    versions = list_versions(root)
+    for version in versions[:max(len(versions) - keep, 0)]:
+        if version != current:
+            shutil.rmtree(os.path.join(root, VERSIONS_DIRNAME, version), ignore_errors=True)
+
+
+class IndexManager:
+    """
+    Owns the vector store this process serves and swaps in new versions
+    without a restart.
+
+    A reload loads the version CURRENT points at into a new VectorStore,
+    warms it up with a search and only then replaces the reference. Requests
+    take the reference once, so searches already running finish on the old
+    store, which is freed when the last of them drops it; no request ever
+    waits for a load. A version that fails to load is logged and the old
+    store keeps serving.
+
+    Reloads are triggered by a change of CURRENT (polled every
+    VECTORSTORE_RELOAD_POLL_SECONDS, so all worker processes follow a
+    publish or rollback), by SIGHUP, or by the admin reload endpoint.
+    """
+
+    def __init__(self, root: str = None):
+        self.root = root
+        self.store = None
+        # Serializes loads; readers never take it
+        self.lock = threading.Lock()
+        self.watcher = None
+
+    def get_root(self):
+        return self.root or settings.VECTORSTORE_DIR
+
+    def get(self):
+        """The store to search, loading the current version on first use."""
+        store = self.store
+        if store is None:
+            self.reload()
+            store = self.store
+            self.start_watching()
+        return store
+
+    def swap(self, store):
+        """Serve ``store`` from now on; returns the store it replaces."""
+        previous, self.store = self.store, store
+        return previous
+
+    def reload(self, version: str = None):
+        """
+        Load ``version`` (default: the current one) and swap it in if it
+        isn't the version already served. Returns the version served after
+        the call.
+        """
+        with self.lock:
+            return self._load(version)
+
+    def _load(self, version: str = None, make_current: bool = False):
+        # Called with self.lock held
+        root = self.get_root()
+        path = snapshot_path(root, version)
+        if path is None:
+            if self.store is None:
+                # The server never embeds the corpus itself; that is the job of
+                # `python manage.py rebuild_vectorstore`.
+                logger.warning(f"No vector store snapshot found in {root}. "
+                               "Run `python manage.py rebuild_vectorstore` to build it.")
+                return None
+            raise ValueError(f"No vector store version {version!r} in {root}")
+
+        store = None
+        if self.store is None or self.store.version != (version or current_version(root)):
+            logger.info(f"Loading vector store snapshot from {path}...")
+            store = VectorStore.load(path)
+            _warm_up(store)
+        if make_current:
+            # Before the swap, so this process never serves a version CURRENT doesn't name
+            set_current(root, version)
+        if store is not None:
+            previous = self.swap(store)
+            logger.info(
+                f"Vector store version {store.version} loaded"
+                + (f", replacing {previous.version}" if previous is not None else "")
+            )
+        return self.store.version
+
+    def activate(self, version: str):
+        """
+        Serve ``version`` here at once and make it current for every
+        process. It is loaded first, so a broken version never becomes
+        current, and CURRENT is written before the swap, under the load
+        lock, so the watcher can't reload the old version in between.
+        """
+        with self.lock:
+            self._load(version, make_current=True)
+        return version
+
+    def rollback(self):
+        """Go back to the version published before the current one."""
+        version = previous_version(self.get_root())
+        if version is None:
+            raise ValueError("There is no earlier vector store version to roll back to")
+        return self.activate(version)
+
+    def reload_in_background(self):
+        threading.Thread(target=self._safe_reload, name="vectorstore-reload", daemon=True).start()
+
+    def _safe_reload(self):
+        try:
+            self.reload()
+        except Exception as e:
+            logger.error(f"Vector store reload failed, still serving the old version: {e!r}")
+
+    def start_watching(self):
+        """Reload whenever CURRENT changes (polling thread, once per process)."""
+        if self.watcher is not None or settings.VECTORSTORE_RELOAD_POLL_SECONDS <= 0:
+            return
+        self.watcher = threading.Thread(target=self._watch, name="vectorstore-watch", daemon=True)
+        self.watcher.start()
+
+    def _watch(self):
+        event = threading.Event()
+        while not event.wait(settings.VECTORSTORE_RELOAD_POLL_SECONDS):
+            if self.lock.locked():
+                # A reload or activate is in progress; look again next time
+                continue
+            store = self.store
+            version = current_version(self.get_root())
+            if version and (store is None or store.version != version):
+                self._safe_reload()
+
+    def install_signal_handler(self):
+        """Reload on SIGHUP. Only possible from the main thread, on platforms with SIGHUP."""
+        if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGHUP, lambda *_: self.reload_in_background())
+
+
+def _warm_up(store: VectorStore):
+    """Run one search per index so a broken snapshot fails here, and its pages are mapped before requests arrive."""
+    for namespace, index in store.indexes.items():
+        if index is not None and index.ntotal:
+            store.search_by_vector(np.zeros((1, index.d), dtype="float32"), top_k=1, namespace=namespace)
+    store.lexical_search("warm up", top_k=1)
+
+
+index_manager = IndexManager()
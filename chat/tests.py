@@ -1,3 +1,1317 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import uuid
+import threading
+import time
+import faiss
+import numpy as np
+from datetime import timedelta
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from .ai_client import AIClient, Provider, ai_client
+from .bm25 import BM25Index, tokenize
+from .management.commands.rebuild_vectorstore import describe_score
+from .chunker import Chunker, approx_token_count
+from .coalescer import Coalescer, EmbeddingCoalescer, SearchCoalescer
+from .context import ContextPacker
+from .indexes import create_index, ivf_nlist
+from .ingest import Ingester
+from .embedding_cache import EmbeddingCache
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .fake_provider import FakeProvider, FakeProviderError
+from .jobs import SUPERSEDED, Worker, enqueue, job, retry_delay, unique_key
+from .memory import conversation_memory
+from .metrics import chat_stage_seconds
+from .models import ChatMessage, Conversation, Job, SchedulerLease
+from .response_cache import SemanticResponseCache, response_cache
+from . import scheduler
+from .snapshots import (
+    IndexManager, current_version, index_manager, list_versions, prune, publish, snapshot_path,
+)
+from .vectorstore import VectorStore
+from .views import save_turn
 
-# Create your tests here.
+# Breakers that trip quickly, for the AIClient tests
+FAST_BREAKER = dict(
+    AI_BREAKER_WINDOW_SECONDS=60,
+    AI_BREAKER_MIN_CALLS=3,
+    AI_BREAKER_FAILURE_RATE=0.5,
+    AI_BREAKER_SLOW_CALL_SECONDS=10,
+    AI_BREAKER_OPEN_SECONDS=0.05,
+)
+
+
+def fake_providers(primary_failure_rate=1.0, secondary_failure_rate=0.0):
+    """A failing primary and a healthy secondary fake provider."""
+    return [
+        Provider("primary", "Primary", FakeProvider(dim=8, failure_rate=primary_failure_rate, seed=1)),
+        Provider("secondary", "Secondary", FakeProvider(dim=8, failure_rate=secondary_failure_rate, seed=2)),
+    ]
+
+
+class FakeAIMixin:
+    """Serve the global ai_client from an offline fake provider during each test."""
+
+    def setUp(self):
+        super().setUp()
+        self._providers = ai_client.providers
+        # A key of its own, so cached embeddings of other providers are never mixed in
+        ai_client.set_providers([Provider("test", "Test Provider", FakeProvider(dim=32, seed=0))])
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        ai_client.set_providers(self._providers)
+        shutil.rmtree(self.tmp, ignore_errors=True)
+        super().tearDown()
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_failure_rate_reached(self):
+        breaker = CircuitBreaker("test", min_calls=3, failure_rate=0.5, open_seconds=60)
+        breaker.record_failure(0.01)
+        breaker.record_failure(0.01)
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure(0.01)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+    def test_slow_calls_count_as_failures(self):
+        breaker = CircuitBreaker("test", min_calls=2, failure_rate=1.0, slow_call_seconds=0.1)
+        breaker.record_success(0.5)
+        breaker.record_success(0.5)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_half_open_allows_a_single_probe(self):
+        breaker = CircuitBreaker("test", min_calls=1, failure_rate=0.5, open_seconds=0.05)
+        breaker.record_failure(0.01)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow_request())
+        breaker.record_success(0.01)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker("test", min_calls=1, failure_rate=0.5, open_seconds=0.05)
+        breaker.record_failure(0.01)
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure(0.01)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertEqual(breaker.times_opened, 2)
+
+
+@override_settings(**FAST_BREAKER)
+class AIClientFailoverTests(SimpleTestCase):
+    def test_fails_over_to_second_provider(self):
+        client = AIClient(providers=fake_providers())
+        provider, response = client.chat_with_context("hello", "context")
+        self.assertEqual(provider, "Secondary")
+        self.assertIn("hello", response)
+        self.assertEqual(client.breakers["primary"].get_status()["window_calls"], 1)
+
+    def test_breaker_opens_and_primary_is_skipped(self):
+        client = AIClient(providers=fake_providers())
+        primary = client.providers[0].client
+        calls = []
+        original = primary.chat_with_context
+        primary.chat_with_context = lambda *args: (calls.append(1), original(*args))[1]
+
+        for _ in range(5):
+            client.chat_with_context("hello", "context")
+        # Three failures open the breaker; later requests don't call the primary at all
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(client.breakers["primary"].state, CircuitBreaker.OPEN)
+        self.assertEqual(client.get_active_provider(), "Secondary")
+
+    def test_half_opens_after_cooldown_and_recovers(self):
+        client = AIClient(providers=fake_providers())
+        for _ in range(3):
+            client.chat_with_context("hello", "context")
+        self.assertEqual(client.breakers["primary"].state, CircuitBreaker.OPEN)
+
+        client.providers[0].client.failure_rate = 0.0
+        time.sleep(0.06)
+        self.assertEqual(client.get_active_provider(), "Primary")
+        self.assertEqual(client.chat_with_context("hello", "context")[0], "Primary")
+        self.assertEqual(client.breakers["primary"].state, CircuitBreaker.CLOSED)
+
+    def test_embed_texts_keeps_one_provider_across_batches(self):
+        providers = [
+            Provider("primary", "Primary", FakeProvider(dim=8, seed=1)),
+            Provider("secondary", "Secondary", FakeProvider(dim=16, seed=2)),
+        ]
+        client = AIClient(providers=providers)
+        primary = providers[0].client
+        original, calls = primary.embed_texts, []
+
+        def fail_first_call(texts):
+            calls.append(len(texts))
+            if len(calls) == 1:
+                raise FakeProviderError("first batch fails")
+            return original(texts)
+        primary.embed_texts = fail_first_call
+
+        vectors = client.embed_texts([f"text {i}" for i in range(6)], batch_size=2)
+        # The secondary took over on the first batch and embedded the rest too
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({len(vector) for vector in vectors}, {16})
+
+    def test_raises_when_every_provider_fails(self):
+        client = AIClient(providers=fake_providers(secondary_failure_rate=1.0))
+        for _ in range(3):
+            with self.assertRaises(FakeProviderError):
+                client.chat_with_context("hello", "context")
+        # Both breakers are open now, so neither provider is called
+        with self.assertRaises(CircuitOpenError):
+            client.chat_with_context("hello", "context")
+
+
+SAMPLE_TEXT = " ".join(
+    f"Sentence number {i} talks about policy {i % 7} and the refund window for order ST-{1000 + i}."
+    for i in range(60)
+)
+
+
+class ChunkerTests(SimpleTestCase):
+    def test_chunks_are_slices_within_size(self):
+        chunker = Chunker(chunk_size=300, chunk_overlap=50)
+        spans = chunker.split(SAMPLE_TEXT)
+        self.assertGreater(len(spans), 1)
+        for chunk in chunker.chunks(SAMPLE_TEXT):
+            metadata = chunk["metadata"]
+            self.assertEqual(chunk["text"], SAMPLE_TEXT[metadata["start"]:metadata["end"]])
+            self.assertLessEqual(len(chunk["text"]), 300)
+            self.assertEqual(metadata["total_chunks"], len(spans))
+
+    def test_chunks_cover_text_and_overlap(self):
+        chunker = Chunker(chunk_size=300, chunk_overlap=50)
+        spans = chunker.split(SAMPLE_TEXT)
+        self.assertEqual(spans[0][0], 0)
+        self.assertEqual(spans[-1][1], len(SAMPLE_TEXT))
+        for (_, previous_end), (start, _) in zip(spans, spans[1:]):
+            # Each chunk starts inside the previous one, at most chunk_overlap back
+            self.assertLess(start, previous_end)
+            self.assertLessEqual(previous_end - start, 50)
+
+    def test_chunk_text_is_whitespace_normalized(self):
+        text = SAMPLE_TEXT.replace(". ", ".\n\n    ").replace(" and ", " \t and  ")
+        chunker = Chunker(chunk_size=300, chunk_overlap=50)
+        chunks = chunker.chunks(text)
+        self.assertEqual([(c["metadata"]["start"], c["metadata"]["end"]) for c in chunks], chunker.split(text))
+        for chunk in chunks:
+            metadata = chunk["metadata"]
+            self.assertEqual(chunk["text"], " ".join(text[metadata["start"]:metadata["end"]].split()))
+
+    def test_no_overlap(self):
+        spans = Chunker(chunk_size=300, chunk_overlap=0).split(SAMPLE_TEXT)
+        for (_, previous_end), (start, _) in zip(spans, spans[1:]):
+            self.assertGreaterEqual(start, previous_end)
+
+    def test_oversized_sentence_is_split_at_words(self):
+        text = " ".join(f"word{i}" for i in range(200))
+        chunker = Chunker(chunk_size=100, chunk_overlap=20)
+        for chunk in chunker.chunks(text):
+            self.assertLessEqual(len(chunk["text"]), 100)
+            self.assertFalse(chunk["text"].startswith(" "))
+            self.assertTrue(all(word.startswith("word") for word in chunk["text"].split()))
+
+    def test_token_sizes(self):
+        chunker = Chunker(chunk_size=60, chunk_overlap=10, tokenizer=approx_token_count)
+        for chunk in chunker.chunks(SAMPLE_TEXT):
+            self.assertLessEqual(approx_token_count(chunk["text"]), 60)
+
+    def test_empty_text(self):
+        self.assertEqual(Chunker().split("   "), [])
+
+
+class BM25Tests(SimpleTestCase):
+    TEXTS = [
+        "Ticket ST-7842: refund not received after cancellation.",
+        "Refund policy: refunds are issued within 14 days.",
+        "The chat/stream endpoint streams answers as server-sent events.",
+        "Travel policy for international trips and visas.",
+    ]
+
+    def build(self):
+        index = BM25Index()
+        index.add(range(len(self.TEXTS)), self.TEXTS)
+        return index
+
+    def test_tokenize_keeps_identifiers_whole_and_split(self):
+        tokens = tokenize("What is ticket ST-7842 about chat/stream?")
+        self.assertIn("st-7842", tokens)
+        self.assertIn("7842", tokens)
+        self.assertIn("chat/stream", tokens)
+        self.assertNotIn("what", tokens)
+
+    def test_exact_identifier_ranks_first(self):
+        results = self.build().search("ST-7842", top_k=2)
+        self.assertEqual(results[0][0], 0)
+        self.assertEqual(self.build().search("chat/stream")[0][0], 2)
+
+    def test_removed_chunks_are_not_returned(self):
+        index = self.build()
+        index.remove([1])
+        self.assertEqual(len(index), 3)
+        self.assertNotIn(1, [chunk_id for chunk_id, _ in index.search("refund")])
+
+    def test_written_index_with_delta_and_removals_matches_fresh_index(self):
+        index = self.build()
+        index.write(self.tmp)
+        loaded = BM25Index.load(self.tmp)
+        self.assertEqual(loaded.search("refund"), index.search("refund"))
+
+        # Changes after loading go to the delta and the removal mask
+        loaded.add([10], ["Refund for visa fees on travel."])
+        loaded.remove([0])
+        fresh = BM25Index()
+        fresh.add([1, 2, 3, 10], self.TEXTS[1:] + ["Refund for visa fees on travel."])
+        for query in ("refund", "travel visa", "ST-7842"):
+            self.assertEqual(
+                [(chunk_id, round(score, 6)) for chunk_id, score in loaded.search(query)],
+                [(chunk_id, round(score, 6)) for chunk_id, score in fresh.search(query)],
+            )
+
+        # ...and are merged into the arrays by the next write
+        merged_path = os.path.join(self.tmp, "merged")
+        os.makedirs(merged_path)
+        loaded.write(merged_path)
+        merged = BM25Index.load(merged_path)
+        self.assertEqual(len(merged), 4)
+        self.assertFalse(merged.delta_postings)
+        self.assertEqual(merged.search("refund"), loaded.search("refund"))
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+
+class RebuildVectorstoreCommandTests(FakeAIMixin, SimpleTestCase):
+    def test_rebuild_publishes_and_prints_test_search(self):
+        out = io.StringIO()
+        call_command("rebuild_vectorstore", output=self.tmp, workers=1, stdout=out)
+        output = out.getvalue()
+        self.assertIn("published", output)
+        self.assertIn("Testing search functionality", output)
+        self.assertRegex(output, r"\((chunk \d+), (rrf score|distance|bm25 score): ")
+
+    def write_documents(self, documents):
+        folder = os.path.join(self.tmp, "documents")
+        os.makedirs(folder, exist_ok=True)
+        for filename, text in documents.items():
+            with open(os.path.join(folder, filename), "w", encoding="utf-8") as f:
+                f.write(text)
+
+    def rebuild(self):
+        out = io.StringIO()
+        with override_settings(BASE_DIR=self.tmp):
+            call_command("rebuild_vectorstore", output=os.path.join(self.tmp, "store"), workers=1,
+                         chunk_size=200, chunk_overlap=0, stdout=out)
+        return out.getvalue()
+
+    def test_unchanged_files_are_skipped(self):
+        self.write_documents({"a.txt": SAMPLE_TEXT, "b.txt": SAMPLE_TEXT.upper()})
+        self.assertIn("Files: 2 added", self.rebuild())
+        output = self.rebuild()
+        self.assertIn("0 changed, 0 removed, 2 unchanged", output)
+        self.assertIn("Chunks: 0 embedded", output)
+        self.assertIn("Vector store is up to date", output)
+
+    def test_changed_file_reuses_unchanged_chunk_vectors(self):
+        self.write_documents({"a.txt": SAMPLE_TEXT, "b.txt": SAMPLE_TEXT.upper()})
+        self.rebuild()
+        store_dir = os.path.join(self.tmp, "store")
+        before = VectorStore.load(snapshot_path(store_dir), mmap=False)
+
+        self.write_documents({"a.txt": SAMPLE_TEXT + " A new closing sentence about the refund window."})
+        output = self.rebuild()
+        self.assertIn("Files: 0 added, 1 changed, 0 removed, 1 unchanged", output)
+        embedded, reused = map(int, re.search(r"Chunks: (\d+) embedded, (\d+) reused", output).groups())
+        # Only the chunk(s) at the end of the changed file are embedded again
+        self.assertGreater(reused, 0)
+        self.assertLessEqual(embedded, 2)
+
+        after = VectorStore.load(snapshot_path(store_dir), mmap=False)
+        self.assertNotEqual(after.version, before.version)
+        namespace = after.namespaces[0]
+        old_chunks = dict((chunk_hash, chunk_id) for chunk_id, chunk_hash in before.manifest["a.txt"]["chunks"])
+        for chunk_id, chunk_hash in after.manifest["a.txt"]["chunks"]:
+            if chunk_hash in old_chunks:
+                np.testing.assert_array_equal(
+                    after._reconstruct(chunk_id, namespace), before._reconstruct(old_chunks[chunk_hash], namespace)
+                )
+
+    def test_describe_score_without_distance(self):
+        self.assertEqual(describe_score({"bm25_score": 7.25}), "bm25 score: 7.2500")
+        self.assertEqual(describe_score({"rrf_score": 0.0325, "distance": 0.5}), "rrf score: 0.0325")
+        self.assertEqual(describe_score({"distance": 0.5}), "distance: 0.5000")
+        self.assertEqual(describe_score({}), "no score")
+
+
+class ChatViewMixin(FakeAIMixin):
+    """A user, an authenticated API client and a small vector store served by index_manager."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="alice", password="secret-password")
+        self.api = APIClient()
+        self.api.force_authenticate(self.user)
+        store = VectorStore(index_type="flat")
+        store.add_document(SAMPLE_TEXT, {"filename": "policies.txt"})
+        self._store = index_manager.swap(store)
+        response_cache.clear()
+
+    def tearDown(self):
+        index_manager.swap(self._store)
+        response_cache.clear()
+        super().tearDown()
+
+
+class ConversationTurnTests(ChatViewMixin, TestCase):
+
+    def test_history_rejects_non_integer_conversation(self):
+        response = self.api.get("/chat-history/", {"conversation": "abc"})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("conversation", response.json())
+
+    def history_pages(self, params):
+        """Follow the ``next`` links of /chat-history/; returns the message texts of each page."""
+        pages = []
+        response = self.api.get("/chat-history/", params).json()
+        while True:
+            pages.append([item["message"] for item in response["results"]])
+            if not response["next"]:
+                return pages
+            response = self.api.get(response["next"]).json()
+
+    def test_history_cursor_pages_have_no_gaps_or_duplicates(self):
+        other = get_user_model().objects.create_user(username="bob", password="secret-password")
+        ChatMessage.objects.bulk_create(
+            ChatMessage(user=user, message=f"{user.username} {i}", response="r")
+            for i in range(7) for user in (self.user, other)
+        )
+        now = timezone.now()
+        for i, message in enumerate(ChatMessage.objects.filter(user=self.user).order_by("id")):
+            # Messages 2-4 share a timestamp, so a page boundary falls inside a tie
+            offset = 3 if 2 <= i <= 4 else i + 1
+            ChatMessage.objects.filter(pk=message.pk).update(created_at=now - timedelta(minutes=10 - offset))
+
+        pages = self.history_pages({"page_size": 3})
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        messages = [message for page in pages for message in page]
+        self.assertEqual(sorted(messages), [f"alice {i}" for i in range(7)])
+        self.assertEqual(messages[:2], ["alice 6", "alice 5"])
+        self.assertEqual(messages[-2:], ["alice 1", "alice 0"])
+
+    def test_history_page_size_boundaries(self):
+        ChatMessage.objects.bulk_create(
+            ChatMessage(user=self.user, message=f"alice {i}", response="r") for i in range(4)
+        )
+        self.assertEqual(self.history_pages({"page_size": 4}), [[f"alice {i}" for i in range(3, -1, -1)]])
+        self.assertEqual([len(page) for page in self.history_pages({"page_size": 2})], [2, 2])
+        self.assertEqual(self.history_pages({"conversation": 999}), [[]])
+
+    def test_chat_saves_turns_of_a_conversation(self):
+        first = self.api.post("/chat/", {"message": "What is the refund window?"}, format="json").json()
+        self.assertEqual(first["provider"], "Test Provider")
+        conversation_id = first["conversation_id"]
+        self.api.post("/chat/", {"message": "And for policy 3?", "conversation_id": conversation_id}, format="json")
+
+        self.assertEqual(Conversation.objects.get(pk=conversation_id).turn_count, 2)
+        history = self.api.get("/chat-history/", {"conversation": conversation_id}).json()
+        self.assertEqual([item["message"] for item in history["results"]],
+                         ["And for policy 3?", "What is the refund window?"])
+
+    def test_chat_reports_the_provider_that_answered(self):
+        primary = ai_client.providers[0]
+        ai_client.set_providers([primary, Provider("backup", "Backup Provider", FakeProvider(dim=32, seed=0))])
+
+        def fail(*args):
+            raise FakeProviderError("chat is down")
+        primary.client.chat_with_context = fail
+
+        chats, _ = stage_observations("chat", "backup", fallback="true")
+        embeds, _ = stage_observations("embed_query", "test")
+        response = self.api.post("/chat/", {"message": "What is the refund window?"}, format="json").json()
+        # The query was embedded by the primary and answered by the fallback
+        self.assertEqual(stage_observations("chat", "backup", fallback="true")[0], chats + 1)
+        self.assertEqual(stage_observations("embed_query", "test")[0], embeds + 1)
+        # One failure doesn't open the breaker, so the primary is still the "active" provider
+        self.assertEqual(ai_client.get_active_provider(), "Test Provider")
+        self.assertEqual(response["provider"], "Backup Provider")
+        cached = self.api.post("/chat/", {"message": "What is the refund window?"}, format="json").json()
+        self.assertTrue(cached["cached"])
+        self.assertEqual(cached["provider"], "Backup Provider")
+        self.assertGreater(stage_observations("response_cache", "test", cache="hit")[0], 0)
+
+    def test_concurrent_turns_keep_every_increment(self):
+        conversation = Conversation.objects.create(user=self.user)
+        # Two requests that loaded the conversation before either saved its turn
+        first, second = Conversation.objects.get(pk=conversation.pk), Conversation.objects.get(pk=conversation.pk)
+        save_turn(self.user, first, [], "first question", "first answer")
+        save_turn(self.user, second, [], "second question", "second answer")
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.turn_count, 2)
+        self.assertEqual(ChatMessage.objects.filter(conversation=conversation).count(), 2)
+        self.assertEqual([turn[0] for turn in conversation_memory.recent_turns(conversation)],
+                         ["first question", "second question"])
+
+
+# Calls of the test job, and how many of them fail first
+JOB_CALLS = []
+
+
+@job("test_job")
+def run_test_job(failures: int = 0):
+    JOB_CALLS.append(failures)
+    if len(JOB_CALLS) <= failures:
+        raise RuntimeError("test job failed")
+
+
+@job("slow_test_job")
+def run_slow_test_job():
+    time.sleep(0.1)
+
+
+@override_settings(JOB_RETRY_BACKOFF_SECONDS=10, JOB_RETRY_BACKOFF_MAX_SECONDS=60, JOB_LOCK_TIMEOUT_SECONDS=60)
+class JobTests(TestCase):
+    def setUp(self):
+        JOB_CALLS.clear()
+
+    def test_enqueue_rejects_unknown_jobs_and_dedupes_unique(self):
+        with self.assertRaises(ValueError):
+            enqueue("no_such_job")
+        first = enqueue("test_job", {"failures": 0}, unique=True)
+        self.assertEqual(enqueue("test_job", {"failures": 0}, unique=True).pk, first.pk)
+        self.assertNotEqual(enqueue("test_job", {"failures": 1}, unique=True).pk, first.pk)
+
+    def test_claim_takes_due_jobs_once_oldest_first(self):
+        later = enqueue("test_job", delay=60)
+        second = enqueue("test_job", delay=-10)
+        first = enqueue("test_job", delay=-20)
+
+        claimed = Worker(name="a").claim()
+        self.assertEqual(claimed.pk, first.pk)
+        self.assertEqual((claimed.status, claimed.locked_by, claimed.attempts), (Job.RUNNING, "a", 1))
+        self.assertEqual(Worker(name="b").claim().pk, second.pk)
+        # Not due yet
+        self.assertIsNone(Worker(name="c").claim())
+        self.assertEqual(Job.objects.get(pk=later.pk).status, Job.QUEUED)
+
+    def test_failed_job_is_retried_with_backoff_then_succeeds(self):
+        queued = enqueue("test_job", {"failures": 1})
+        worker = Worker(name="a")
+        before = timezone.now()
+        worker.execute(worker.claim())
+
+        queued.refresh_from_db()
+        self.assertEqual(queued.status, Job.QUEUED)
+        self.assertIn("test job failed", queued.last_error)
+        # First retry after 0.5-1x JOB_RETRY_BACKOFF_SECONDS
+        self.assertGreaterEqual(queued.run_after, before + timedelta(seconds=5))
+        self.assertLessEqual(queued.run_after, timezone.now() + timedelta(seconds=10))
+        self.assertIsNone(worker.claim())
+
+        Job.objects.filter(pk=queued.pk).update(run_after=timezone.now())
+        worker.run(once=True)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts, queued.last_error), (Job.SUCCEEDED, 2, ""))
+
+    def test_job_fails_after_max_attempts(self):
+        queued = enqueue("test_job", {"failures": 5}, max_attempts=2)
+        worker = Worker(name="a")
+        for _ in range(2):
+            Job.objects.filter(pk=queued.pk).update(run_after=timezone.now())
+            worker.run(once=True)
+        queued.refresh_from_db()
+        self.assertEqual((queued.status, queued.attempts), (Job.FAILED, 2))
+        self.assertEqual(len(JOB_CALLS), 2)
+
+    def test_retry_delay_is_capped(self):
+        for attempts in (1, 3, 10):
+            delay = retry_delay(attempts)
+            expected = min(10 * 2 ** (attempts - 1), 60)
+            self.assertTrue(expected * 0.5 <= delay <= expected)
+
+    def test_unique_jobs_are_enforced_by_the_database(self):
+        first = enqueue("test_job", {"failures": 0, "tag": "x"}, unique=True)
+        self.assertEqual(first.unique_key, unique_key("test_job", {"tag": "x", "failures": 0}))
+        # What a concurrent enqueue that missed the waiting job would do
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Job.objects.create(name="test_job", payload=first.payload, run_after=timezone.now(),
+                               unique_key=first.unique_key)
+        # Once the job runs, the next trigger queues a new one
+        Worker(name="a").claim()
+        second = enqueue("test_job", {"failures": 0, "tag": "x"}, unique=True)
+        self.assertNotEqual(second.pk, first.pk)
+        self.assertEqual(enqueue("test_job", {"failures": 0, "tag": "x"}, unique=True).pk, second.pk)
+
+    def test_failed_unique_job_defers_to_the_one_queued_again(self):
+        first = enqueue("test_job", {"failures": 1}, unique=True)
+        worker = Worker(name="a")
+        worker.claim()
+        second = enqueue("test_job", {"failures": 1}, unique=True)
+        worker.execute(Job.objects.get(pk=first.pk))
+
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.last_error), (Job.FAILED, SUPERSEDED))
+        self.assertEqual(Job.objects.get(pk=second.pk).status, Job.QUEUED)
+
+    def test_requeue_stale_running_jobs(self):
+        stale, fresh, long_running, legacy = (enqueue("test_job") for _ in range(4))
+        long_ago = timezone.now() - timedelta(seconds=120)
+        Job.objects.filter(pk=stale.pk).update(
+            status=Job.RUNNING, locked_by="dead", started_at=long_ago, heartbeat_at=long_ago
+        )
+        Job.objects.filter(pk=fresh.pk).update(
+            status=Job.RUNNING, locked_by="alive", started_at=timezone.now(), heartbeat_at=timezone.now()
+        )
+        # Started long ago, but its worker is still beating
+        Job.objects.filter(pk=long_running.pk).update(
+            status=Job.RUNNING, locked_by="busy", started_at=timezone.now() - timedelta(hours=7),
+            heartbeat_at=timezone.now(),
+        )
+        # Claimed before heartbeats existed
+        Job.objects.filter(pk=legacy.pk).update(status=Job.RUNNING, locked_by="old", started_at=long_ago)
+
+        Worker(name="a").requeue_stale()
+        for queued in (stale, fresh, long_running, legacy):
+            queued.refresh_from_db()
+        self.assertEqual((stale.status, stale.locked_by), (Job.QUEUED, ""))
+        self.assertEqual((legacy.status, legacy.locked_by), (Job.QUEUED, ""))
+        self.assertEqual((fresh.status, fresh.locked_by), (Job.RUNNING, "alive"))
+        self.assertEqual((long_running.status, long_running.locked_by), (Job.RUNNING, "busy"))
+
+    def test_stale_unique_job_defers_to_the_one_queued_again(self):
+        first = enqueue("test_job", unique=True)
+        Worker(name="dead").claim()
+        second = enqueue("test_job", unique=True)
+        Job.objects.filter(pk=first.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=120))
+
+        Worker(name="a").requeue_stale()
+        first.refresh_from_db()
+        self.assertEqual((first.status, first.last_error), (Job.FAILED, SUPERSEDED))
+        self.assertEqual(Job.objects.get(pk=second.pk).status, Job.QUEUED)
+
+    def test_heartbeat_keeps_a_long_job_from_being_requeued(self):
+        enqueue("test_job")
+        worker = Worker(name="a")
+        claimed = worker.claim()
+        Job.objects.filter(pk=claimed.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=120))
+        worker.heartbeat(claimed)
+        Worker(name="b").requeue_stale()
+        self.assertEqual(Job.objects.get(pk=claimed.pk).status, Job.RUNNING)
+        # Only the worker holding the job beats for it
+        Job.objects.filter(pk=claimed.pk).update(heartbeat_at=timezone.now() - timedelta(seconds=120))
+        Worker(name="b").heartbeat(claimed)
+        Worker(name="b").requeue_stale()
+        self.assertEqual(Job.objects.get(pk=claimed.pk).status, Job.QUEUED)
+
+    @override_settings(JOB_HEARTBEAT_SECONDS=0.01)
+    def test_execute_beats_while_the_job_runs(self):
+        enqueue("slow_test_job")
+        worker = Worker(name="a")
+        beats = []
+        worker.heartbeat = beats.append
+        claimed = worker.claim()
+        worker.execute(claimed)
+        self.assertGreater(len(beats), 2)
+        self.assertTrue(all(beat.pk == claimed.pk for beat in beats))
+        count = len(beats)
+        time.sleep(0.05)
+        # The heartbeat thread stops with the job
+        self.assertEqual(len(beats), count)
+
+
+class MetricsEndpointTests(SimpleTestCase):
+    @override_settings(METRICS_TOKEN="", DEBUG=False)
+    def test_forbidden_without_token_in_production(self):
+        self.assertEqual(self.client.get("/metrics/").status_code, 403)
+
+    @override_settings(METRICS_TOKEN="", DEBUG=True)
+    def test_open_without_token_in_debug(self):
+        self.assertEqual(self.client.get("/metrics/").status_code, 200)
+
+    @override_settings(METRICS_TOKEN="scrape-me", DEBUG=False)
+    def test_requires_token_when_set(self):
+        self.assertEqual(self.client.get("/metrics/").status_code, 401)
+        self.assertEqual(self.client.get("/metrics/", HTTP_AUTHORIZATION="Bearer wrong").status_code, 401)
+        response = self.client.get("/metrics/", HTTP_AUTHORIZATION="Bearer scrape-me")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"chat_requests_total", response.content)
+
+
+class OneRoundEvent(threading.Event):
+    """A stop event that is set by the first wait, so scheduler.run does one round."""
+
+    def wait(self, timeout=None):
+        self.set()
+        return True
+
+
+class SchedulerLeaseTests(TestCase):
+    def test_only_one_holder_until_expiry(self):
+        self.assertTrue(scheduler.acquire_lease("a"))
+        self.assertFalse(scheduler.acquire_lease("b"))
+        # The holder renews
+        self.assertTrue(scheduler.acquire_lease("a"))
+        self.assertEqual(SchedulerLease.objects.get(name=scheduler.LEASE_NAME).holder, "a")
+
+        SchedulerLease.objects.filter(name=scheduler.LEASE_NAME).update(
+            expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertTrue(scheduler.acquire_lease("b"))
+        self.assertFalse(scheduler.acquire_lease("a"))
+
+    def test_release_hands_over_at_once(self):
+        self.assertTrue(scheduler.acquire_lease("a"))
+        # Only the holder can release it
+        scheduler.release_lease("b")
+        self.assertFalse(scheduler.acquire_lease("b"))
+        scheduler.release_lease("a")
+        self.assertTrue(scheduler.acquire_lease("b"))
+
+    def test_leases_are_independent(self):
+        self.assertTrue(scheduler.acquire_lease("a"))
+        self.assertTrue(scheduler.acquire_lease("b", name="other"))
+
+    def test_run_starts_scheduler_as_leader_and_releases_on_stop(self):
+        started = []
+
+        class FakeScheduler:
+            def start(self):
+                started.append("start")
+
+            def shutdown(self, wait=True):
+                started.append("shutdown")
+
+        original = scheduler.create_scheduler
+        scheduler.create_scheduler = FakeScheduler
+        try:
+            scheduler.run("a", OneRoundEvent())
+        finally:
+            scheduler.create_scheduler = original
+        self.assertEqual(started, ["start", "shutdown"])
+        self.assertEqual(SchedulerLease.objects.get(name=scheduler.LEASE_NAME).holder, "")
+
+    def test_run_waits_while_another_instance_leads(self):
+        scheduler.acquire_lease("a")
+        original = scheduler.create_scheduler
+        scheduler.create_scheduler = lambda: self.fail("a follower must not start the scheduler")
+        try:
+            scheduler.run("b", OneRoundEvent())
+        finally:
+            scheduler.create_scheduler = original
+        self.assertEqual(SchedulerLease.objects.get(name=scheduler.LEASE_NAME).holder, "a")
+
+    @override_settings(CHAT_RETENTION_DAYS=30)
+    def test_cleanup_logs_what_it_deleted(self):
+        user = get_user_model().objects.create_user(username="bob", password="secret-password")
+        old = ChatMessage.objects.create(user=user, message="old", response="old")
+        ChatMessage.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=31))
+        ChatMessage.objects.create(user=user, message="new", response="new")
+
+        with self.assertLogs("chat.scheduler", level="INFO") as logs:
+            scheduler.cleanup_old_messages()
+        self.assertIn("Deleted 1 old chat messages", logs.output[0])
+        self.assertEqual(list(ChatMessage.objects.values_list("message", flat=True)), ["new"])
+
+
+    @override_settings(CHAT_RETENTION_DAYS=30, JOB_RETENTION_DAYS=30, CHAT_CLEANUP_BATCH_SIZE=3)
+    def test_cleanup_deletes_exactly_the_expired_messages_in_batches(self):
+        user = get_user_model().objects.create_user(username="bob", password="secret-password")
+        ChatMessage.objects.bulk_create(
+            ChatMessage(user=user, message=f"message {i}", response="r") for i in range(17)
+        )
+        ids = list(ChatMessage.objects.order_by("id").values_list("id", flat=True))
+        # Expired rows interleaved with current ones; one is just inside the retention period
+        expired = ids[::2]
+        ChatMessage.objects.filter(id__in=expired).update(created_at=timezone.now() - timedelta(days=31))
+        ChatMessage.objects.filter(id=ids[1]).update(created_at=timezone.now() - timedelta(days=29))
+
+        with self.assertLogs("chat.scheduler", level="INFO") as logs:
+            scheduler.cleanup_old_messages()
+        self.assertIn(f"Deleted {len(expired)} old chat messages", logs.output[0])
+        self.assertEqual(sorted(ChatMessage.objects.values_list("id", flat=True)), ids[1::2])
+
+
+class SnapshotTests(FakeAIMixin, SimpleTestCase):
+    def publish_versions(self, count):
+        versions = []
+        for i in range(count):
+            if versions:
+                # Versions are named after the second they were saved in
+                time.sleep(1.05)
+            store = VectorStore(index_type="flat")
+            store.add_document(f"Version {i} of the refund policy.", {"filename": "policy.txt"})
+            versions.append(publish(store, self.tmp, keep=0))
+        return versions
+
+    def test_publish_makes_version_current_and_prunes(self):
+        first, second, third = self.publish_versions(3)
+        self.assertEqual(current_version(self.tmp), third)
+        self.assertEqual(list_versions(self.tmp), [first, second, third])
+
+        manager = IndexManager(root=self.tmp)
+        self.assertEqual(manager.reload(), third)
+        self.assertEqual(manager.store.version, third)
+
+        prune(self.tmp, keep=2)
+        self.assertEqual(list_versions(self.tmp), [second, third])
+
+    def test_rollback_and_activate(self):
+        first, second = self.publish_versions(2)
+        manager = IndexManager(root=self.tmp)
+        manager.reload()
+
+        self.assertEqual(manager.rollback(), first)
+        self.assertEqual((current_version(self.tmp), manager.store.version), (first, first))
+        with self.assertRaises(ValueError):
+            manager.rollback()
+
+        self.assertEqual(manager.activate(second), second)
+        self.assertEqual((current_version(self.tmp), manager.store.version), (second, second))
+
+    def test_activate_writes_current_before_swapping(self):
+        first, second = self.publish_versions(2)
+        manager = IndexManager(root=self.tmp)
+        manager.reload()
+        seen = []
+        swap = manager.swap
+        manager.swap = lambda store: (seen.append((current_version(self.tmp), manager.lock.locked())), swap(store))[1]
+
+        manager.activate(first)
+        self.assertEqual(seen, [(first, True)])
+
+    def test_broken_version_never_becomes_current(self):
+        _, second = self.publish_versions(2)
+        manager = IndexManager(root=self.tmp)
+        manager.reload()
+        with self.assertRaises(ValueError):
+            manager.activate("19990101T000000-000000")
+        self.assertEqual((current_version(self.tmp), manager.store.version), (second, second))
+
+    def test_snapshot_outside_versions_is_not_served(self):
+        store = VectorStore(index_type="flat")
+        store.add_document("The refund policy.", {"filename": "policy.txt"})
+        store.save(self.tmp)
+        self.assertIsNone(snapshot_path(self.tmp))
+        with self.assertLogs("chat.snapshots", level="WARNING") as logs:
+            self.assertIsNone(IndexManager(root=self.tmp).reload())
+        self.assertIn("rebuild_vectorstore", logs.output[0])
+
+
+def stage_observations(stage, provider, fallback="false", cache="miss"):
+    """``(count, total seconds)`` observed so far in chat_stage_seconds for these labels."""
+    entry = chat_stage_seconds.values.get((stage, provider, fallback, cache))
+    return (sum(entry[0]), entry[1]) if entry else (0, 0.0)
+
+
+def hit(chunk_index, text, filename="policy.txt", **scores):
+    """A search result for chunk ``chunk_index`` of ``filename``."""
+    return {"id": chunk_index, "text": text, "metadata": {"filename": filename, "chunk_index": chunk_index}, **scores}
+
+
+class ContextPackerTests(SimpleTestCase):
+    def test_cutoff_is_relative_to_the_best_hit(self):
+        packer = ContextPacker(distance_ratio=1.5, bm25_ratio=0.5)
+        docs = [
+            hit(0, "a", distance=0.4),
+            hit(5, "b", distance=0.55),
+            hit(9, "c", distance=0.7),
+            hit(12, "d", bm25_score=6.0),
+            hit(20, "e", bm25_score=2.0),
+        ]
+        self.assertEqual([doc["id"] for doc in packer.select(docs)], [0, 5, 12])
+        # The same hits on a model with 10x larger distances are cut the same way
+        scaled = [{**doc, "distance": doc["distance"] * 10} if "distance" in doc else doc for doc in docs]
+        self.assertEqual([doc["id"] for doc in packer.select(scaled)], [0, 5, 12])
+        self.assertEqual(len(ContextPacker().select(docs)), 5)
+
+    def test_exact_match_does_not_cut_every_other_hit(self):
+        packer = ContextPacker(distance_ratio=1.5, bm25_ratio=0.5)
+        docs = [hit(0, "a", distance=0.0), hit(5, "b", distance=0.3), hit(9, "c", distance=0.6)]
+        self.assertEqual([doc["id"] for doc in packer.select(docs)], [0, 5, 9])
+
+    def test_best_hit_is_always_kept(self):
+        packer = ContextPacker(distance_ratio=1.5, bm25_ratio=0.5)
+        self.assertEqual([doc["id"] for doc in packer.select([hit(3, "only", bm25_score=0.1)])], [3])
+
+    def test_merges_consecutive_chunks_using_offsets(self):
+        text = "First sentence here. Second sentence here. Third sentence here."
+        docs = [
+            {**hit(1, text[21:]), "metadata": {"filename": "f.txt", "chunk_index": 1, "start": 21, "end": len(text)}},
+            hit(7, "Another file.", filename="g.txt"),
+            {**hit(0, text[0:42]), "metadata": {"filename": "f.txt", "chunk_index": 0, "start": 0, "end": 42}},
+        ]
+        passages = ContextPacker().merge(docs)
+        self.assertEqual(len(passages), 2)
+        self.assertEqual(passages[0]["text"], text)
+        self.assertEqual(passages[0]["metadata"]["last_chunk_index"], 1)
+        self.assertEqual(passages[0]["chunk_ids"], [0, 1])
+        self.assertEqual(passages[1]["text"], "Another file.")
+
+    def test_merges_whitespace_normalized_chunks(self):
+        text = SAMPLE_TEXT.replace(". ", ".\n\n  ")
+        chunks = Chunker(chunk_size=300, chunk_overlap=50).chunks(text, {"filename": "f.txt"})
+        self.assertGreater(len(chunks), 2)
+        docs = [{**chunk, "id": i, "distance": 0.1} for i, chunk in enumerate(chunks)]
+        passages = ContextPacker().merge(docs)
+        self.assertEqual(len(passages), 1)
+        self.assertEqual(passages[0]["text"], " ".join(text.split()))
+
+    def test_merges_overlap_without_offsets(self):
+        docs = [hit(0, "alpha beta gamma delta"), hit(1, "gamma delta epsilon zeta")]
+        self.assertEqual(ContextPacker().merge(docs)[0]["text"], "alpha beta gamma delta epsilon zeta")
+
+    def test_non_consecutive_chunks_stay_separate(self):
+        docs = [hit(0, "zero"), hit(2, "two")]
+        self.assertEqual([p["text"] for p in ContextPacker().merge(docs)], ["zero", "two"])
+
+    def test_fits_token_budget_best_first(self):
+        packer = ContextPacker(token_budget=10)
+        passages = [{"text": "x" * 24}, {"text": "y" * 24}, {"text": "z" * 12}]
+        # 6 + 6 tokens would go over the budget; the 3-token passage still fits
+        self.assertEqual([p["text"][0] for p in packer.fit(passages)], ["x", "z"])
+
+    def test_oversized_best_passage_is_truncated(self):
+        packer = ContextPacker(token_budget=5)
+        text = " ".join(f"w{i}" for i in range(40))
+        packed = packer.fit([{"text": text}, {"text": "short"}])
+        self.assertEqual(len(packed), 1)
+        self.assertLessEqual(approx_token_count(packed[0]["text"]), 5)
+        self.assertTrue(text.startswith(packed[0]["text"]))
+
+
+class RecordingCoalescer(Coalescer):
+    """Doubles numbers, recording each batch; a batch holding 0 takes ``delay`` seconds."""
+
+    name = "test-coalescer"
+
+    def __init__(self, *args, delay=0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.delay = delay
+        self.batches = []
+
+    def process(self, key, items):
+        self.batches.append(list(items))
+        if 0 in items:
+            time.sleep(self.delay)
+        return [item * 2 for item in items]
+
+
+class CoalescerTests(SimpleTestCase):
+    def test_idle_item_is_not_held_for_the_window(self):
+        coalescer = RecordingCoalescer(window_ms=2000, max_batch=8)
+        started = time.monotonic()
+        self.assertEqual(coalescer.wait(coalescer.submit("k", 21), timeout=5), 42)
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_items_are_batched_while_a_batch_is_in_flight(self):
+        coalescer = RecordingCoalescer(window_ms=200, max_batch=8, workers=2, delay=0.3)
+        first = coalescer.submit("k", 0)
+        time.sleep(0.05)
+        futures = [coalescer.submit("k", i) for i in range(1, 5)]
+        self.assertEqual([coalescer.wait(future, timeout=5) for future in futures], [2, 4, 6, 8])
+        self.assertEqual(coalescer.wait(first, timeout=5), 0)
+        self.assertEqual(coalescer.batches, [[0], [1, 2, 3, 4]])
+
+    def test_wait_times_out_and_drops_unstarted_items(self):
+        coalescer = RecordingCoalescer(window_ms=10, max_batch=8, workers=1, delay=0.5)
+        busy = coalescer.submit("k", 0)
+        time.sleep(0.05)
+        waiting = coalescer.submit("k", 1)
+        with self.assertRaises(TimeoutError):
+            coalescer.wait(waiting, timeout=0.1)
+        self.assertTrue(waiting.cancelled())
+        self.assertEqual(coalescer.wait(busy, timeout=5), 0)
+        time.sleep(0.05)
+        self.assertEqual(coalescer.batches, [[0]])
+
+    def test_search_gives_up_after_its_timeout(self):
+        class SlowStore:
+            def normalize_filters(self, filters):
+                return ()
+
+            def search_many(self, query_vecs, top_k, lexicals=None, namespace=None, filters=None):
+                time.sleep(0.5)
+                return [[] for _ in query_vecs]
+
+        coalescer = SearchCoalescer(window_ms=1, max_batch=8, timeout=0.1)
+        with self.assertRaises(TimeoutError):
+            coalescer.search(SlowStore(), [0.0, 1.0])
+        with self.assertRaises(TimeoutError):
+            async_to_sync(coalescer.asearch)(SlowStore(), [0.0, 1.0])
+
+    async def test_await_result_times_out_and_drops_unstarted_items(self):
+        coalescer = RecordingCoalescer(window_ms=10, max_batch=8, workers=1, delay=0.5)
+        busy = coalescer.submit("k", 0)
+        await asyncio.sleep(0.05)
+        waiting = coalescer.submit("k", 1)
+        with self.assertRaises(TimeoutError):
+            await coalescer.await_result(waiting, timeout=0.1)
+        self.assertTrue(waiting.cancelled())
+        self.assertEqual(await coalescer.await_result(busy, timeout=5), 0)
+
+    async def test_aembed_batches_concurrent_callers(self):
+        class SlowClient:
+            def __init__(self):
+                self.batches = []
+
+            def embed_queries(self, texts, namespaces):
+                self.batches.append(list(texts))
+                time.sleep(0.2)
+                return namespaces[0], [np.full(4, len(text), dtype="float32") for text in texts]
+
+        client = SlowClient()
+        coalescer = EmbeddingCoalescer(window_ms=100, max_batch=8, workers=2, client=client)
+        first = asyncio.ensure_future(coalescer.aembed("a", ["ns"]))
+        await asyncio.sleep(0.05)
+        # The event loop keeps running while the first batch is embedded
+        results = await asyncio.gather(*(coalescer.aembed("b" * n, ["ns"]) for n in range(2, 6)))
+        self.assertEqual([(namespace, vector[0]) for namespace, vector in results],
+                         [("ns", n) for n in range(2, 6)])
+        self.assertEqual((await first)[1][0], 1)
+        self.assertEqual(client.batches, [["a"], ["bb", "bbb", "bbbb", "bbbbb"]])
+
+
+class FilteredSearchTests(FakeAIMixin, SimpleTestCase):
+    FILES = {
+        "hr_policy_001.txt": "Leave requests go to your manager. Parental leave lasts sixteen weeks. ",
+        "hr_policy_002.txt": "Performance reviews happen twice a year. Bonuses follow the review. ",
+        "travel_policy_001.txt": "Book flights through the portal. Hotels are reimbursed up to a cap. ",
+    }
+    QUERIES = ["How long is parental leave?", "Are hotels reimbursed?", "When are performance reviews?"]
+
+    def build(self, index_type="flat"):
+        store = VectorStore(chunk_size=80, chunk_overlap=0, index_type=index_type)
+        for filename, text in self.FILES.items():
+            store.add_document(text * 4, {"filename": filename})
+        return store
+
+    def query_vecs(self, store):
+        return np.array(ai_client.embed_texts(self.QUERIES, namespace=store.namespaces[0]), dtype="float32")
+
+    def test_filtered_results_are_the_best_matching_chunks(self):
+        store = self.build()
+        query_vecs = self.query_vecs(store)
+        everything = store.search_many(query_vecs, top_k=store.index.ntotal)
+        filtered = store.search_many(query_vecs, top_k=3, filters={"category": "travel_policy"})
+        for unfiltered, results in zip(everything, filtered):
+            expected = [r["id"] for r in unfiltered if r["metadata"]["filename"] == "travel_policy_001.txt"][:3]
+            self.assertEqual([r["id"] for r in results], expected)
+
+    def test_brute_force_and_selector_paths_agree(self):
+        store = self.build()
+        query_vecs = self.query_vecs(store)
+        filters = {"filename": ["hr_policy_001.txt", "travel_policy_001.txt"]}
+        brute_force = store.search_many(query_vecs, top_k=4, filters=filters)
+        with override_settings(VECTORSTORE_FILTER_BRUTE_FORCE_MAX=0):
+            selector = store.search_many(query_vecs, top_k=4, filters=filters)
+        self.assertEqual([[r["id"] for r in row] for row in brute_force], [[r["id"] for r in row] for row in selector])
+        for row in selector:
+            self.assertTrue(all(r["metadata"]["filename"] != "hr_policy_002.txt" for r in row))
+
+    def test_hnsw_selector_only_returns_matching_chunks(self):
+        store = self.build("hnsw")
+        with override_settings(VECTORSTORE_FILTER_BRUTE_FORCE_MAX=0):
+            rows = store.search_many(self.query_vecs(store), top_k=5, filters={"category": "hr_policy"})
+        for row in rows:
+            self.assertEqual(len(row), 5)
+            self.assertTrue(all(r["metadata"]["filename"].startswith("hr_policy") for r in row))
+
+    def test_batch_matches_single_searches(self):
+        store = self.build()
+        query_vecs = self.query_vecs(store)
+        filters = {"category": "hr_policy"}
+        rows = store.search_many(query_vecs, top_k=3, filters=filters)
+        for query_vec, row in zip(query_vecs, rows):
+            single = store.search_by_vector(query_vec.reshape(1, -1), top_k=3, filters=filters)
+            self.assertEqual([r["id"] for r in row], [r["id"] for r in single])
+
+    def test_filter_cache_follows_added_chunks(self):
+        store = self.build()
+        filters = {"category": "faq"}
+        self.assertEqual(store.search_many(self.query_vecs(store), top_k=3, filters=filters), [[], [], []])
+        store.add_document("Hotels near the office are listed in the FAQ.", {"filename": "faq_001.txt"})
+        rows = store.search_many(self.query_vecs(store), top_k=3, filters=filters)
+        self.assertTrue(all(len(row) == 1 and row[0]["metadata"]["filename"] == "faq_001.txt" for row in rows))
+
+    def test_invalid_filters_are_rejected(self):
+        store = self.build()
+        for filters in ({"author": "me"}, {"category": []}, ["category"]):
+            with self.assertRaises(ValueError):
+                store.search_many(self.query_vecs(store), top_k=3, filters=filters)
+
+
+@override_settings(**FAST_BREAKER)
+class NamespaceFailoverTests(FakeAIMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.primary = FakeProvider(dim=16, seed=1)
+        ai_client.set_providers([
+            Provider("primary", "Primary", self.primary),
+            Provider("secondary", "Secondary", FakeProvider(dim=24, seed=2)),
+        ])
+
+    def test_search_fails_over_to_the_secondary_namespace_after_reload(self):
+        store = VectorStore(index_type="flat", chunk_size=200, chunk_overlap=0)
+        store.add_document(SAMPLE_TEXT, {"filename": "policy.txt"})
+        store.save(os.path.join(self.tmp, "store"))
+        loaded = VectorStore.load(os.path.join(self.tmp, "store"))
+        primary, secondary = loaded.namespaces
+        self.assertEqual((loaded.indexes[primary].d, loaded.indexes[secondary].d), (16, 24))
+
+        self.primary.failure_rate = 1.0
+        for _ in range(settings.AI_BREAKER_MIN_CALLS + 1):
+            namespace, query_vec = ai_client.embed_query("How long is the refund window?", loaded.namespaces)
+            self.assertEqual(namespace, secondary)
+            hits = loaded.search_by_vector(query_vec, top_k=3, namespace=namespace)
+            self.assertEqual(len(hits), 3)
+            self.assertTrue(all(hit["text"] for hit in hits))
+        self.assertEqual(ai_client.breakers["primary"].state, CircuitBreaker.OPEN)
+        # The store's own search goes the same way
+        self.assertTrue(loaded.search("How long is the refund window?", top_k=3))
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp, ignore_errors=True)
+
+    def test_hit_only_for_the_same_provider_and_model(self):
+        cache = EmbeddingCache(maxsize=10)
+        cache.set_many("fake", "model-a", ["hello"], [[1.0, 2.0]])
+        np.testing.assert_array_equal(cache.get_many("fake", "model-a", ["hello"])[0], [1.0, 2.0])
+        self.assertEqual(cache.get_many("fake", "model-b", ["hello"]), [None])
+        self.assertEqual(cache.get_many("other", "model-a", ["hello", "bye"]), [None, None])
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = EmbeddingCache(maxsize=2)
+        cache.set_many("fake", "m", ["a", "b"], [[1.0], [2.0]])
+        cache.get_many("fake", "m", ["a"])
+        cache.set_many("fake", "m", ["c"], [[3.0]])
+        hits = [vector is not None for vector in cache.get_many("fake", "m", ["a", "b", "c"])]
+        self.assertEqual(hits, [True, False, True])
+
+    def test_persists_across_instances(self):
+        db_path = os.path.join(self.tmp, "embeddings.sqlite3")
+        EmbeddingCache(maxsize=10, db_path=db_path).set_many("fake", "m", ["a", "b"], [[1.0], [2.0]])
+
+        cache = EmbeddingCache(maxsize=1, db_path=db_path)
+        vectors = cache.get_many("fake", "m", ["a", "b", "c"])
+        self.assertEqual([None if v is None else float(v[0]) for v in vectors], [1.0, 2.0, None])
+        self.assertEqual(cache.persistent_hits, 2)
+        # Evicted from memory, still on disk
+        self.assertEqual(float(cache.get_many("fake", "m", ["a"])[0][0]), 1.0)
+
+    def test_disabled(self):
+        cache = EmbeddingCache(maxsize=0)
+        cache.set_many("fake", "m", ["a"], [[1.0]])
+        self.assertEqual(cache.get_many("fake", "m", ["a"]), [None])
+
+
+class StreamingChatTests(ChatViewMixin, TestCase):
+    async def stream(self, body, user=None):
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(user or self.user).access_token))()
+        response = await self.async_client.post(
+            "/chat/stream/", body, content_type="application/json", headers={"Authorization": f"Bearer {token}"}
+        )
+        if not response.streaming:
+            return response, None
+        content = b"".join([chunk async for chunk in response.streaming_content]).decode()
+        events = [
+            (block.split("\n")[0].removeprefix("event: "), json.loads(block.split("\n")[1].removeprefix("data: ")))
+            for block in content.strip().split("\n\n")
+        ]
+        return response, events
+
+    async def test_events_arrive_in_order_and_turn_is_saved(self):
+        response, events = await self.stream({"message": "What is the refund window for policy 3?"})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        names = [name for name, _ in events]
+        self.assertEqual(names[0], "meta")
+        self.assertEqual(names[-1], "done")
+        self.assertTrue(len(names) > 2 and set(names[1:-1]) == {"token"})
+        self.assertEqual(events[0][1], {"provider": "Test Provider", "cached": False})
+
+        conversation_id = events[-1][1]["conversation_id"]
+        message = await ChatMessage.objects.aget(conversation_id=conversation_id)
+        self.assertEqual(message.response, "".join(data["text"] for name, data in events if name == "token"))
+
+    async def test_chat_stage_excludes_time_the_client_spends_reading(self):
+        count, seconds = stage_observations("chat", "test")
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.user).access_token))()
+        response = await self.async_client.post(
+            "/chat/stream/", {"message": "What is the refund window for policy 5?"},
+            content_type="application/json", headers={"Authorization": f"Bearer {token}"},
+        )
+        events = 0
+        async for _ in response.streaming_content:
+            events += 1
+            await asyncio.sleep(0.05)  # A slow client
+        self.assertGreater(events, 3)
+        new_count, new_seconds = stage_observations("chat", "test")
+        self.assertEqual(new_count, count + 1)
+        self.assertLess(new_seconds - seconds, 0.05)
+
+    async def test_foreign_conversation_is_not_found(self):
+        other = await get_user_model().objects.acreate_user(username="mallory", password="secret-password")
+        conversation = await Conversation.objects.acreate(user=other)
+        response, _ = await self.stream({"message": "Hello", "conversation_id": conversation.pk})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_unavailable_when_every_breaker_is_open(self):
+        breaker = ai_client.breakers["test"]
+        for _ in range(settings.AI_BREAKER_MIN_CALLS):
+            breaker.record_failure(0.01)
+        response, _ = await self.stream({"message": "Something nobody asked before about visas"})
+        self.assertEqual(response.status_code, 503)
+
+
+class IndexTypeTests(FakeAIMixin, SimpleTestCase):
+    def test_training_on_a_small_first_batch_warns(self):
+        store = VectorStore(chunk_size=200, chunk_overlap=0, index_type="ivf")
+        with self.assertLogs("chat.vectorstore", level="WARNING") as logs:
+            store.add_document(SAMPLE_TEXT, {"filename": "policy.txt"})
+        self.assertIn("fixes it at 1 lists", logs.output[0])
+        self.assertEqual(store.index.ntotal, len(store.documents))
+
+    def test_pq_falls_back_to_ivf_flat_with_a_warning(self):
+        with self.assertLogs("chat.indexes", level="WARNING") as logs:
+            index = create_index("ivfpq", 8, np.random.default_rng(0).random((100, 8), dtype="float32"))
+        self.assertIn("using IVF-Flat instead", logs.output[0])
+        self.assertTrue(index.is_trained)
+
+
+class SemanticResponseCacheTests(SimpleTestCase):
+    QUESTION = [1.0, 0.0, 0.0, 0.0]
+
+    def cache(self, **kwargs):
+        cache = SemanticResponseCache(**{"threshold": 0.95, "ttl": 60, "max_size": 10, **kwargs})
+        cache.add(self.QUESTION, "answer", "Test Provider", "v1", "ns")
+        return cache
+
+    def test_hit_above_threshold(self):
+        # cos = 0.98: a rephrasing of the same question
+        entry = self.cache().lookup([0.98, 0.199, 0.0, 0.0], "v1", "ns")
+        self.assertEqual((entry["response"], entry["provider"]), ("answer", "Test Provider"))
+        self.assertGreaterEqual(entry["similarity"], 0.95)
+
+    def test_miss_below_threshold(self):
+        cache = self.cache()
+        # cos = 0.8
+        self.assertIsNone(cache.lookup([0.8, 0.6, 0.0, 0.0], "v1", "ns"))
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+    def test_new_index_version_drops_entries(self):
+        cache = self.cache()
+        self.assertIsNone(cache.lookup(self.QUESTION, "v2", "ns"))
+        # ...for good: going back to v1 doesn't bring them back
+        self.assertIsNone(cache.lookup(self.QUESTION, "v1", "ns"))
+        self.assertEqual(cache.get_stats()["size"], 0)
+
+    def test_other_namespace_drops_entries(self):
+        cache = self.cache()
+        self.assertIsNone(cache.lookup(self.QUESTION, "v1", "other"))
+        self.assertIsNone(cache.lookup(self.QUESTION, "v1", "ns"))
+
+    def test_expired_and_evicted_entries_miss(self):
+        cache = self.cache(ttl=0)
+        self.assertIsNone(cache.lookup(self.QUESTION, "v1", "ns"))
+
+        cache = self.cache(max_size=1)
+        cache.add([0.0, 1.0, 0.0, 0.0], "other answer", "Test Provider", "v1", "ns")
+        self.assertIsNone(cache.lookup(self.QUESTION, "v1", "ns"))
+        self.assertEqual(cache.lookup([0.0, 1.0, 0.0, 0.0], "v1", "ns")["response"], "other answer")
+
+
+class IngesterTests(FakeAIMixin, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        self.folder = os.path.join(self.tmp, "documents")
+        self.checkpoint = os.path.join(self.tmp, "checkpoint")
+        os.makedirs(self.folder)
+        # Unique texts, so no embedding comes from the cache
+        run = uuid.uuid4().hex
+        for i in range(4):
+            with open(os.path.join(self.folder, f"doc_{i}.txt"), "w", encoding="utf-8") as f:
+                f.write(" ".join(f"Document {i} sentence {j} of run {run}." for j in range(8)))
+
+    def new_store(self, index_type="flat", chunk_size=100):
+        store = VectorStore(chunk_size=chunk_size, chunk_overlap=0, index_type=index_type)
+        store.embed_batch_size = 2
+        return store
+
+    def ingest(self, store):
+        return Ingester(store, workers=1, embed_workers=1, checkpoint_path=self.checkpoint,
+                        checkpoint_seconds=0).run(self.folder)
+
+    def test_interrupted_ingest_resumes_from_checkpoint(self):
+        store = self.new_store()
+        with open(os.path.join(self.folder, "doc_0.txt"), encoding="utf-8") as f:
+            first_file_batches = -(-len(store.chunker.split(f.read())) // store.embed_batch_size)
+        provider = ai_client.providers[0].client
+        original, calls = provider.embed_texts, []
+
+        def fail_after_first_file(texts):
+            calls.append(len(texts))
+            if len(calls) == first_file_batches + 1:
+                # Fail once the writer has checkpointed the first file
+                deadline = time.monotonic() + 5
+                while not VectorStore.exists(self.checkpoint) and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                raise FakeProviderError("interrupted")
+            return original(texts)
+        provider.embed_texts = fail_after_first_file
+        with self.assertRaises(FakeProviderError):
+            self.ingest(store)
+        provider.embed_texts = original
+
+        self.assertTrue(VectorStore.exists(self.checkpoint))
+        resumed = VectorStore.load(self.checkpoint, mmap=False)
+        done = len(resumed.manifest)
+        self.assertTrue(0 < done < 4)
+        stats = self.ingest(resumed)
+        self.assertEqual(stats["added_files"], 4 - done)
+
+        clean = self.new_store()
+        Ingester(clean, workers=1, embed_workers=1).run(self.folder)
+        self.assertEqual(len(resumed.documents), len(clean.documents))
+        self.assertEqual(resumed.index.ntotal, clean.index.ntotal)
+        self.assertEqual(
+            {filename: [h for _, h in entry["chunks"]] for filename, entry in resumed.manifest.items()},
+            {filename: [h for _, h in entry["chunks"]] for filename, entry in clean.manifest.items()},
+        )
+
+    @override_settings(VECTORSTORE_IVF_NLIST=4)
+    def test_fresh_ivf_store_is_filled_flat_then_trained_on_everything(self):
+        store = self.new_store("ivf", chunk_size=30)
+        with self.assertNoLogs("chat.vectorstore", level="WARNING"):
+            self.ingest(store)
+        total = len(store.documents)
+        self.assertGreaterEqual(total, 2 * 39)
+        self.assertEqual(store.index_type, "ivf")
+        self.assertEqual(store.index.ntotal, total)
+        # Trained on every chunk, not on the first embedding batch of 2
+        self.assertEqual(faiss.extract_index_ivf(store.index).nlist, ivf_nlist(total))
+        self.assertGreater(ivf_nlist(total), 1)
@@ -0,0 +1,64 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from contextvars import ContextVar
+import logging
+import re
+import uuid
+
+# Trace ID of the request being handled; "-" outside of requests
+trace_id_var = ContextVar("trace_id", default="-")
+
+TRACE_HEADER = "X-Request-ID"
+# Accept IDs from a proxy or client only if they are short and harmless in logs
+VALID_TRACE_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+def get_trace_id() -> str:
+    return trace_id_var.get()
+
+
+class TraceIDMiddleware:
+    """
+    Gives every request a trace ID, taken from the ``X-Request-ID`` header
+    when a proxy already set one and generated otherwise. It is stored in a
+    context variable, so log records emitted while handling the request
+    (including in threads started with sync_to_async) carry it, and
+    returned in the ``X-Request-ID`` response header.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _start(self, request):
+        trace_id = request.headers.get(TRACE_HEADER, "")
+        if not VALID_TRACE_ID.match(trace_id):
+            trace_id = uuid.uuid4().hex
+        trace_id_var.set(trace_id)
+        request.trace_id = trace_id
+        return trace_id
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trace_id = self._start(request)
+        response = self.get_response(request)
+        response[TRACE_HEADER] = trace_id
+        return response
+
+    async def __acall__(self, request):
+        trace_id = self._start(request)
+        response = await self.get_response(request)
+        response[TRACE_HEADER] = trace_id
+        return response
+
+
+class TraceIDFilter(logging.Filter):
+    """Adds ``trace_id`` to every log record, for use in formatters."""
+
+    def filter(self, record):
+        record.trace_id = trace_id_var.get()
+        return True
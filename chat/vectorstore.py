@@ -1,141 +1,558 @@
 import faiss
 import numpy as np
 from django.conf import settings
+from cachetools import LRUCache
+import json
+import logging
 import os
-import re
-from .ai_client import ai_client
+import threading
+import time
+import uuid
+from tqdm import tqdm
+from .ai_client import ai_client, namespace_dim
+from .indexes import create_index, ivf_nlist, search_params, TRAINED_INDEX_TYPES
+from .chunker import Chunker, load_tokenizer
+from .chunkstore import ChunkStore, CHUNK_TEXT_FILENAME, CHUNK_ARRAY_FILENAMES, FILTER_FIELDS
+from .bm25 import BM25Index, BM25_VOCABULARY_FILENAME, BM25_ARRAY_FILENAMES
+from .ingest import Ingester
+
+logger = logging.getLogger(__name__)
+
+# Files making up an on-disk snapshot (see VectorStore.save / VectorStore.load);
+# there is one FAISS index file per embedding namespace
+INDEX_FILENAME = "index-{}.faiss"
+DOCUMENTS_FILENAME = "documents.json"
+MANIFEST_FILENAME = "manifest.json"
+
+# Bumped whenever the snapshot layout changes; older snapshots need a full rebuild
+SNAPSHOT_FORMAT = 7
+
 
 class VectorStore:
-    def __init__(self, dim=768, chunk_size=500, chunk_overlap=50):
-        self.index = faiss.IndexFlatL2(dim)
-        self.documents = []
+    """
+    Chunks of the document corpus, searchable by BM25 and by vector.
+
+    There is one FAISS index per embedding namespace (provider, model and
+    dimension, see ai_client.embedding_namespace), all holding a vector for
+    every chunk under the same chunk ID, and sharing the chunk texts and the
+    BM25 index. A query is embedded by the first available provider that has
+    an index here, so failing over to another provider costs one embedding
+    call rather than an error or a re-embed of the corpus.
+    """
+
+    def __init__(self, chunk_size=500, chunk_overlap=50, embed_batch_size=None,
+                 index_type=None, tokenizer: str = None, namespaces: list = None):
+        self.index_type = index_type or settings.VECTORSTORE_INDEX_TYPE
+        # Priority order; the first is the primary namespace
+        if namespaces is None:
+            namespaces = ai_client.embedding_namespaces(settings.VECTORSTORE_EMBED_PROVIDERS)
+        # Chunks keep a stable ID in the index so they can be removed and their
+        # vectors reconstructed during incremental rebuilds. IVF indexes are
+        # created on the first add, once there is data to train them on.
+        self.indexes = {namespace: self._empty_index(namespace) for namespace in namespaces}
+        self.documents = ChunkStore()
+        # Lexical index over the same chunk IDs, for hybrid search
+        self.bm25 = BM25Index()
+        self.next_id = 0
+        # filename -> {"hash": file hash, "chunks": [[chunk_id, chunk_hash], ...]}
+        self.manifest = {}
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        # Dotted path of the token counter chunk sizes are measured with ("" = characters)
+        self.tokenizer = settings.CHUNK_TOKENIZER if tokenizer is None else tokenizer
+        self.chunker = Chunker(chunk_size, chunk_overlap, load_tokenizer(self.tokenizer))
+        self.embed_batch_size = embed_batch_size
+        self.version = None
+        # True when loaded from memory-mapped files, which can't be modified
+        self.read_only = False
+        # Normalized filters -> (chunk store generation, allowed chunk IDs, IDSelector)
+        self.filter_cache = LRUCache(maxsize=settings.VECTORSTORE_FILTER_CACHE_SIZE)
+        self.filter_lock = threading.Lock()
+
+    @property
+    def namespaces(self):
+        return list(self.indexes)
+
+    @property
+    def index(self):
+        """The index of the primary namespace."""
+        return next(iter(self.indexes.values()), None)
+
+    @property
+    def dim(self):
+        """The vector dimension of the primary namespace."""
+        return namespace_dim(self.namespaces[0])
+
+    def _empty_index(self, namespace):
+        if self.index_type in TRAINED_INDEX_TYPES:
+            return None
+        return create_index(self.index_type, namespace_dim(namespace))
 
     def _split_text_into_chunks(self, text: str, metadata: dict = None):
         """Split text into overlapping chunks while preserving sentence boundaries."""
-        # Clean up text
-        text = re.sub(r'\s+', ' ', text.strip())
-        
-        # Split by sentences first
-        sentences = re.split(r'(?<=[.!?])\s+', text)
-        
-        chunks = []
-        current_chunk = ""
-        current_length = 0
-        
-        for sentence in sentences:
-            sentence_length = len(sentence)
-            
-            # If adding this sentence would exceed chunk_size, save current chunk
-            if current_length + sentence_length > self.chunk_size and current_chunk:
-                chunks.append({
-                    "text": current_chunk.strip(),
-                    "metadata": {
-                        **(metadata or {}),
-                        "chunk_index": len(chunks),
-                        "total_chunks": None  # Will be set later
-                    }
-                })
-                
-                # Start new chunk with overlap
-                overlap_text = self._get_overlap_text(current_chunk, self.chunk_overlap)
-                current_chunk = overlap_text + " " + sentence if overlap_text else sentence
-                current_length = len(current_chunk)
-            else:
-                # Add sentence to current chunk
-                if current_chunk:
-                    current_chunk += " " + sentence
-                else:
-                    current_chunk = sentence
-                current_length = len(current_chunk)
-        
-        # Don't forget the last chunk
-        if current_chunk.strip():
-            chunks.append({
-                "text": current_chunk.strip(),
-                "metadata": {
-                    **(metadata or {}),
-                    "chunk_index": len(chunks),
-                    "total_chunks": None
-                }
-            })
-        
-        # Update total_chunks count
-        for chunk in chunks:
-            chunk["metadata"]["total_chunks"] = len(chunks)
-        
-        return chunks
-
-    def _get_overlap_text(self, text: str, overlap_size: int):
-        """Get the last overlap_size characters from text, preferring word boundaries."""
-        if len(text) <= overlap_size:
-            return text
-        
-        # Try to find a good word boundary within the overlap region
-        overlap_text = text[-overlap_size:]
-        space_index = overlap_text.find(' ')
-        
-        if space_index != -1:
-            return overlap_text[space_index:].strip()
-        return overlap_text
+        return self.chunker.chunks(text, metadata)
 
     def add_document(self, doc_text: str, metadata: dict = None):
-        """Add a document by splitting it into chunks and embedding each chunk."""
-        chunks = self._split_text_into_chunks(doc_text, metadata)
-        
-        for chunk in chunks:
-            vec = np.array([ai_client.embed_text(chunk["text"])], dtype="float32")
-            self.index.add(vec)
-            self.documents.append(chunk)
+        """Add a document by splitting it into chunks and embedding the chunks in batches."""
+        self.add_chunks(self._split_text_into_chunks(doc_text, metadata))
 
     def add_chunk(self, chunk_text: str, metadata: dict = None):
         """Add a single chunk directly without splitting."""
-        vec = np.array([ai_client.embed_text(chunk_text)], dtype="float32")
-        self.index.add(vec)
-        self.documents.append({"text": chunk_text, "metadata": metadata})
-
-    def search(self, query: str, top_k=3):
-        """Search for the most relevant chunks."""
-        query_vec = np.array([ai_client.embed_text(query)], dtype="float32")
-        distances, indices = self.index.search(query_vec, top_k)
+        self.add_chunks([{"text": chunk_text, "metadata": metadata}])
+
+    def add_chunks(self, chunks: list):
+        """Embed chunks with batched provider calls, in every namespace, and add them to the index in one go."""
+        if not chunks:
+            return []
+        texts = [chunk["text"] for chunk in chunks]
+        return self._add_vectors(chunks, {
+            namespace: np.array(
+                ai_client.embed_texts(texts, batch_size=self.embed_batch_size, namespace=namespace),
+                dtype="float32",
+            )
+            for namespace in self.indexes
+        })
+
+    def _add_vectors(self, chunks: list, vectors: dict):
+        """Assign IDs to already-embedded chunks and add them to the indexes ({namespace: vectors})."""
+        self._check_writable()
+        ids = np.arange(self.next_id, self.next_id + len(chunks), dtype="int64")
+        self.next_id += len(chunks)
+        for namespace, index in self.indexes.items():
+            if index is None:
+                nlist = ivf_nlist(len(chunks))
+                if nlist < settings.VECTORSTORE_IVF_NLIST:
+                    # load_from_folder trains on the whole corpus instead; see Ingester
+                    logger.warning(
+                        f"Training the {self.index_type} index of {namespace} on only {len(chunks)} vectors "
+                        f"fixes it at {nlist} lists (VECTORSTORE_IVF_NLIST={settings.VECTORSTORE_IVF_NLIST}); "
+                        "call rebuild_index() once more chunks are added"
+                    )
+                index = self.indexes[namespace] = create_index(
+                    self.index_type, namespace_dim(namespace), vectors[namespace]
+                )
+            index.add_with_ids(vectors[namespace], ids)
+        self.documents.add(ids, chunks)
+        self.bm25.add(ids, [chunk["text"] for chunk in chunks])
+        return ids.tolist()
+
+    def remove_chunks(self, chunk_ids: list):
+        """Remove chunks (and their vectors) by ID."""
+        if not chunk_ids:
+            return
+        self._check_writable()
+        self.documents.remove(chunk_ids)
+        self.bm25.remove(chunk_ids)
+        for namespace, index in self.indexes.items():
+            try:
+                index.remove_ids(np.array(chunk_ids, dtype="int64"))
+            except RuntimeError:
+                # HNSW graphs don't support removal; rebuild from the remaining vectors
+                self.indexes[namespace] = self._rebuilt_index(index, namespace, self.index_type)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError("This vector store is memory-mapped read-only; load it with mmap=False to modify it")
+
+    def rebuild_index(self, index_type: str = None):
+        """
+        Build fresh indexes (optionally of another type) from the stored
+        vectors of the current chunks. IVF types are retrained on all of
+        them. No embedding calls are made.
+        """
+        self._check_writable()
+        self.index_type = index_type or self.index_type
+        for namespace, index in self.indexes.items():
+            self.indexes[namespace] = self._rebuilt_index(index, namespace, self.index_type)
+
+    def _rebuilt_index(self, index, namespace, index_type):
+        ids = self.documents.ids()
+        if not len(ids):
+            return self._empty_index(namespace)
+        vectors = index.reconstruct_batch(ids)
+        rebuilt = create_index(index_type, namespace_dim(namespace), vectors)
+        rebuilt.add_with_ids(vectors, ids)
+        return rebuilt
+
+    def add_namespace(self, namespace: str, progress: bool = False):
+        """
+        Add an index for ``namespace`` (e.g. a newly configured provider),
+        embedding every stored chunk with its provider. Chunk texts come
+        from the store, so the documents aren't read again.
+        """
+        self._check_writable()
+        ids = self.documents.ids()
+        batch_size = self.embed_batch_size or settings.EMBEDDING_BATCH_SIZE
+        vectors = np.zeros((len(ids), namespace_dim(namespace)), dtype="float32")
+        for start in tqdm(range(0, len(ids), batch_size), desc=f"Embedding {namespace}", disable=not progress):
+            batch = ids[start:start + batch_size]
+            texts = [self.documents[int(chunk_id)]["text"] for chunk_id in batch]
+            vectors[start:start + len(batch)] = ai_client.embed_texts(texts, batch_size=batch_size, namespace=namespace)
+        index = self._empty_index(namespace)
+        if len(ids):
+            if index is None:
+                index = create_index(self.index_type, namespace_dim(namespace), vectors)
+            index.add_with_ids(vectors, ids)
+        self.indexes[namespace] = index
+
+    def set_namespaces(self, namespaces: list, progress: bool = False):
+        """
+        Keep an index for exactly ``namespaces``, in that (priority) order:
+        missing ones are embedded with ``add_namespace`` and others dropped.
+        Returns whether anything changed.
+        """
+        self._check_writable()
+        before = self.namespaces
+        for namespace in namespaces:
+            if namespace not in self.indexes:
+                self.add_namespace(namespace, progress=progress)
+        self.indexes = {namespace: self.indexes[namespace] for namespace in namespaces}
+        return self.namespaces != before
+
+    def search(self, query: str, top_k=3, nprobe: int = None, ef_search: int = None, filters=None):
+        """
+        Search for the most relevant chunks, combining BM25 keyword matches
+        with vector similarity. When the keyword match is decisive (see
+        ``is_decisive``) the query isn't embedded at all. ``nprobe`` (IVF) and
+        ``ef_search`` (HNSW) override the index defaults for this query.
+        ``filters`` restricts the results, see ``normalize_filters``.
+        """
+        lexical = self.lexical_search(query, filters=filters)
+        if self.is_decisive(lexical):
+            return lexical[:top_k]
+        namespace, query_vec = ai_client.embed_query(query, self.namespaces)
+        return self.search_by_vector(
+            query_vec, top_k, nprobe=nprobe, ef_search=ef_search, lexical=lexical, namespace=namespace,
+            filters=filters,
+        )
+
+    def search_by_vector(self, query_vec, top_k=3, nprobe: int = None, ef_search: int = None,
+                         lexical: list = None, namespace: str = None, filters=None):
+        """
+        Search with a query vector embedded into ``namespace`` (default: the
+        primary one). If ``lexical`` results (from ``lexical_search``) are
+        given they are fused with the vector results by reciprocal-rank
+        fusion. ``filters`` restricts the results, see ``normalize_filters``.
+        """
+        query_vec = np.asarray(query_vec, dtype="float32").reshape(1, -1)
+        return self.search_many(
+            query_vec, top_k, nprobe=nprobe, ef_search=ef_search,
+            lexicals=[lexical] if lexical else None, namespace=namespace, filters=filters
+        )[0]
+
+    def search_many(self, query_vecs, top_k=3, nprobe: int = None, ef_search: int = None,
+                    lexicals: list = None, namespace: str = None, filters=None):
+        """
+        ``search_by_vector`` for a matrix of query vectors (one per row), in
+        a single FAISS search call, which is cheaper than one call per query
+        and runs on FAISS's OpenMP threads (FAISS_OMP_THREADS). ``lexicals``
+        optionally gives each query's BM25 results (None or empty for
+        none). Returns one result list per query.
+
+        With ``filters`` only matching chunks are searched, rather than
+        filtering a top-k afterwards (which wastes the search on chunks
+        that are dropped and returns too few hits). Up to
+        VECTORSTORE_FILTER_BRUTE_FORCE_MAX matching chunks are compared
+        with the queries directly; larger selections are searched in the
+        index with an ID selector.
+        """
+        namespace = namespace or self.namespaces[0]
+        index = self.indexes.get(namespace)
+        query_vecs = np.asarray(query_vecs, dtype="float32")
+        if query_vecs.ndim == 1:
+            query_vecs = query_vecs.reshape(1, -1)
+        lexicals = lexicals or [None] * len(query_vecs)
+        if len(lexicals) != len(query_vecs):
+            raise ValueError(f"Got {len(lexicals)} lexical result lists for {len(query_vecs)} queries")
+        if index is None:
+            if namespace not in self.indexes:
+                raise ValueError(f"This vector store has no index for {namespace}")
+            return [[] for _ in query_vecs]
+        if query_vecs.shape[1] != index.d:
+            raise ValueError(f"Query vector has dimension {query_vecs.shape[1]}, the {namespace} index {index.d}")
+        k = max(top_k, settings.HYBRID_CANDIDATES) if any(lexicals) else top_k
+        allowed, selector = self._select(filters)
+        if allowed is not None and len(allowed) <= settings.VECTORSTORE_FILTER_BRUTE_FORCE_MAX:
+            distances, indices = _search_subset(index, query_vecs, allowed, k)
+        else:
+            params = search_params(self.index_type, nprobe=nprobe, ef_search=ef_search, selector=selector, index=index)
+            distances, indices = index.search(query_vecs, k, params=params)
+
+        all_results = []
+        for row, lexical in enumerate(lexicals):
+            results = []
+            for i, idx in enumerate(indices[row]):
+                # The chunk dict is built fresh here, only for the hits
+                result = self.documents.get(int(idx))
+                if result is not None:
+                    result["id"] = int(idx)
+                    result["distance"] = float(distances[row][i])
+                    results.append(result)
+            if lexical:
+                results = _reciprocal_rank_fusion([results, lexical], top_k)
+            else:
+                results = results[:top_k]
+            all_results.append(results)
+        return all_results
+
+    def lexical_search(self, query: str, top_k: int = None, filters=None):
+        """
+        BM25 keyword search; results carry a ``bm25_score`` instead of a
+        distance. ``filters`` restricts the results, see ``normalize_filters``.
+        """
+        allowed, _ = self._select(filters)
         results = []
-        
-        for i, idx in enumerate(indices[0]):
-            if idx < len(self.documents):
-                result = self.documents[idx].copy()
-                result["distance"] = float(distances[0][i])
+        for chunk_id, score in self.bm25.search(query, top_k or settings.HYBRID_CANDIDATES, allowed=allowed):
+            result = self.documents.get(chunk_id)
+            if result is not None:
+                result["id"] = chunk_id
+                result["bm25_score"] = score
                 results.append(result)
-        
         return results
 
-    def load_from_folder(self, folder_path: str):
-        """Load all text files from folder and split them into chunks."""
-        for filename in os.listdir(folder_path):
-            if filename.endswith(".txt"):
-                file_path = os.path.join(folder_path, filename)
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
-                
-                base_metadata = {
-                    "filename": filename,
-                    "file_path": file_path
-                }
-                
-                self.add_document(text, metadata=base_metadata)
-                print(f"Loaded and chunked: {filename}")
+    @staticmethod
+    def normalize_filters(filters):
+        """
+        Validate search ``filters`` and return them in canonical, hashable
+        form, or None for no filtering. ``filters`` maps metadata fields
+        (chunkstore.FILTER_FIELDS: ``filename``, ``category``) to a value or
+        a list of accepted values, e.g. ``{"category": ["hr_policy",
+        "travel_policy"]}``; a chunk must match every field given. Already
+        normalized filters are returned as they are.
+        """
+        if not filters:
+            return None
+        if isinstance(filters, tuple):
+            filters = dict(filters)
+        if not isinstance(filters, dict):
+            raise ValueError("Filters must be an object mapping a field to a value or list of values")
+        normalized = []
+        for field, values in filters.items():
+            if field not in FILTER_FIELDS:
+                raise ValueError(f"Unknown filter field {field!r}. Choose from: {', '.join(FILTER_FIELDS)}")
+            values = [values] if isinstance(values, str) else values
+            if not isinstance(values, (list, tuple)) or not values or not all(isinstance(v, str) for v in values):
+                raise ValueError(f"Filter {field!r} must be a string or a non-empty list of strings")
+            normalized.append((field, tuple(sorted(set(values)))))
+        return tuple(sorted(normalized))
+
+    def _select(self, filters):
+        """
+        ``(allowed chunk IDs, faiss.IDSelector)`` for ``filters``, or
+        ``(None, None)`` without filters. Cached per filter until the
+        chunks change.
+        """
+        filters = self.normalize_filters(filters)
+        if filters is None:
+            return None, None
+        generation = self.documents.generation
+        with self.filter_lock:
+            cached = self.filter_cache.get(filters)
+        if cached is not None and cached[0] == generation:
+            return cached[1], cached[2]
+        allowed = np.ascontiguousarray(self.documents.select(filters), dtype="int64")
+        selector = faiss.IDSelectorBatch(allowed)
+        with self.filter_lock:
+            self.filter_cache[filters] = (generation, allowed, selector)
+        return allowed, selector
+
+    @staticmethod
+    def is_decisive(lexical: list):
+        """
+        Whether the best keyword match is good enough to answer from on its
+        own: it scores at least HYBRID_LEXICAL_MIN_SCORE and at least
+        HYBRID_LEXICAL_RATIO times the runner-up, as with an exact ticket ID
+        or endpoint name. A ratio of 0 disables this shortcut.
+        """
+        if not settings.HYBRID_LEXICAL_RATIO or not lexical:
+            return False
+        best = lexical[0]["bm25_score"]
+        runner_up = lexical[1]["bm25_score"] if len(lexical) > 1 else 0.0
+        return best >= settings.HYBRID_LEXICAL_MIN_SCORE and best >= settings.HYBRID_LEXICAL_RATIO * runner_up
+
+    def load_from_folder(self, folder_path: str, checkpoint_path: str = None, progress: bool = False,
+                         workers: int = None, embed_workers: int = None):
+        """
+        Bring the store in line with the text files in ``folder_path``.
+
+        Files whose hash matches the manifest are skipped. For changed files,
+        chunks whose text hash is unchanged reuse their stored vector, so only
+        new or edited chunks are embedded. Chunks of deleted files are removed.
+        Reading, chunking and embedding run as a concurrent pipeline (see
+        chat/ingest.py); with ``checkpoint_path`` progress is saved there
+        periodically so an interrupted run can be resumed. ``workers`` and
+        ``embed_workers`` default to settings.INGEST_WORKERS and
+        settings.INGEST_EMBED_WORKERS.
+
+        Returns a dict of counters describing what changed.
+        """
+        ingester = Ingester(
+            self, workers=workers, embed_workers=embed_workers,
+            checkpoint_path=checkpoint_path, progress=progress,
+        )
+        return ingester.run(folder_path)
+
+    def _reconstruct(self, chunk_id, namespace: str):
+        """Return the stored ``namespace`` vector for ``chunk_id``, or None if it is unknown."""
+        index = self.indexes.get(namespace)
+        if chunk_id is None or index is None:
+            return None
+        try:
+            return index.reconstruct(int(chunk_id))
+        except RuntimeError:
+            return None
+
+    def save(self, path: str):
+        """
+        Write the FAISS indexes, chunk columns and manifest to ``path``.
+
+        Files are written to a temporary name first and then renamed.
+        ``documents.json`` is renamed last and records the chunk count, so a
+        loader racing with a save either sees the old snapshot or detects
+        the mismatch.
+        """
+        if not self.indexes or any(index is None for index in self.indexes.values()):
+            raise ValueError("Cannot save an empty vector store")
+        os.makedirs(path, exist_ok=True)
+        self.version = time.strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+        index_filenames = [INDEX_FILENAME.format(i) for i in range(len(self.indexes))]
+        for filename, index in zip(index_filenames, self.indexes.values()):
+            faiss.write_index(index, os.path.join(path, filename + ".tmp"))
+
+        chunk_tables = self.documents.write(path, suffix=".tmp")
+        self.bm25.write(path, suffix=".tmp")
+
+        documents_path = os.path.join(path, DOCUMENTS_FILENAME)
+        payload = {
+            "format": SNAPSHOT_FORMAT,
+            "version": self.version,
+            "index_type": self.index_type,
+            "namespaces": self.namespaces,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "tokenizer": self.tokenizer,
+            "next_id": self.next_id,
+            "total_chunks": len(self.documents),
+            **chunk_tables,
+        }
+        _write_json(documents_path + ".tmp", payload)
+
+        manifest_path = os.path.join(path, MANIFEST_FILENAME)
+        _write_json(manifest_path + ".tmp", self.manifest)
+
+        for filename in (*index_filenames, CHUNK_TEXT_FILENAME, *CHUNK_ARRAY_FILENAMES.values(),
+                         BM25_VOCABULARY_FILENAME, *BM25_ARRAY_FILENAMES.values(),
+                         MANIFEST_FILENAME, DOCUMENTS_FILENAME):
+            os.replace(os.path.join(path, filename + ".tmp"), os.path.join(path, filename))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = None):
+        """
+        Load a snapshot written by ``save``. No embedding calls are made.
+
+        With ``mmap`` (default: settings.VECTORSTORE_MMAP) the FAISS indexes and
+        the chunk columns are memory-mapped read-only, so worker processes
+        share one copy through the page cache instead of each holding its
+        own. A mapped store can be searched but not modified; pass
+        ``mmap=False`` to load a store that will be updated.
+        """
+        if mmap is None:
+            mmap = settings.VECTORSTORE_MMAP
+
+        with open(os.path.join(path, DOCUMENTS_FILENAME), "r", encoding="utf-8") as f:
+            payload = json.load(f)
+
+        if payload.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError(
+                f"Vector store snapshot in {path} uses an old format; "
+                "run `python manage.py rebuild_vectorstore --full`"
+            )
+
+        store = cls(
+            chunk_size=payload["chunk_size"],
+            chunk_overlap=payload["chunk_overlap"],
+            tokenizer=payload["tokenizer"],
+            index_type=payload["index_type"],
+            namespaces=[],
+        )
+        # MMAP_IFC maps the vector codes in place instead of copying them
+        io_flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if mmap else 0
+        for i, namespace in enumerate(payload["namespaces"]):
+            store.indexes[namespace] = faiss.read_index(os.path.join(path, INDEX_FILENAME.format(i)), io_flags)
+        store.documents = ChunkStore.load(path, payload["files"], payload["extra"], mmap_mode=mmap)
+        store.bm25 = BM25Index.load(path, mmap_mode=mmap)
+        store.next_id = payload["next_id"]
+        store.version = payload["version"]
+        store.read_only = mmap
+
+        manifest_path = os.path.join(path, MANIFEST_FILENAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                store.manifest = json.load(f)
+
+        for namespace, index in store.indexes.items():
+            if not (index.ntotal == len(store.documents) == len(store.bm25) == payload["total_chunks"]):
+                raise ValueError(
+                    f"Corrupt vector store snapshot in {path}: {namespace} index has {index.ntotal} "
+                    f"vectors but {len(store.documents)} chunks"
+                )
+        return store
+
+    @staticmethod
+    def exists(path: str):
+        """Return True if ``path`` holds a complete snapshot."""
+        # documents.json is written last, after the index files it lists
+        return all(
+            os.path.exists(os.path.join(path, name))
+            for name in (DOCUMENTS_FILENAME, CHUNK_TEXT_FILENAME, *CHUNK_ARRAY_FILENAMES.values(),
+                         BM25_VOCABULARY_FILENAME, *BM25_ARRAY_FILENAMES.values())
+        )
 
     def get_stats(self):
         """Get statistics about the vector store."""
         total_chunks = len(self.documents)
-        files = set()
-        
-        for doc in self.documents:
-            if doc.get("metadata", {}).get("filename"):
-                files.add(doc["metadata"]["filename"])
+        files = self.documents.filenames()
         
         return {
+            "index_type": self.index_type,
+            "namespaces": self.namespaces,
             "total_chunks": total_chunks,
             "total_files": len(files),
-            "files": list(files)
+            "lexical_terms": len(self.bm25.vocabulary) + len(self.bm25.delta_postings),
+            "files": list(files),
+            "categories": self.documents.categories(),
+            "version": self.version
         }
+
+
+def _write_json(path: str, data):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+
+
+def _search_subset(index, query_vecs, ids, k):
+    """
+    Exact search of ``query_vecs`` against only the vectors of chunk ``ids``
+    (a sorted array), like ``index.search``: ``(distances, chunk IDs)``,
+    with -1 for missing hits.
+    """
+    if not len(ids):
+        return (np.zeros((len(query_vecs), 0), dtype="float32"),
+                np.zeros((len(query_vecs), 0), dtype="int64"))
+    distances, positions = faiss.knn(query_vecs, index.reconstruct_batch(ids), min(k, len(ids)))
+    return distances, np.where(positions >= 0, ids[positions], -1)
+
+
+def _reciprocal_rank_fusion(result_lists, top_k):
+    """
+    Merge ranked result lists by reciprocal-rank fusion: each chunk scores
+    sum(1 / (HYBRID_RRF_K + rank)) over the lists it appears in.
+    """
+    fused = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, 1):
+            entry = fused.setdefault(result["id"], {**result, "rrf_score": 0.0})
+            entry.update({key: value for key, value in result.items() if key in ("distance", "bm25_score")})
+            entry["rrf_score"] += 1.0 / (settings.HYBRID_RRF_K + rank)
+    return sorted(fused.values(), key=lambda entry: entry["rrf_score"], reverse=True)[:top_k]
@@ -1,27 +1,50 @@
 from django.shortcuts import render
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from django.db import transaction
+from asgiref.sync import sync_to_async
 from rest_framework.generics import ListAPIView
-from .models import ChatMessage
+from rest_framework.pagination import CursorPagination
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from .models import ChatMessage, Conversation
 from .serializers import ChatMessageSerializer
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.conf import settings
+from .snapshots import index_manager, list_versions
 from .vectorstore import VectorStore
+import hmac
+import json
+import logging
 import os
 import sys
+import time
 from .ai_client import ai_client
+from .circuit_breaker import CircuitOpenError
+from .coalescer import embedding_coalescer, search_coalescer
+from .response_cache import response_cache
+from .context import context_packer
+from .memory import conversation_memory
+from .jobs import enqueue
+from .metrics import registry, StageTimings, chat_requests, chat_request_seconds
 
-# Global variable to store the vector store instance
-_vector_store = None
+logger = logging.getLogger(__name__)
+
+# Returned when every AI provider's circuit breaker is open
+PROVIDERS_UNAVAILABLE = {"error": "AI service is temporarily unavailable, please try again shortly"}
+CONVERSATION_NOT_FOUND = {"error": "Conversation not found"}
 
 def get_vector_store():
     """
     Lazy-load the vector store only when needed and only for server operations.
     This prevents loading during management commands like migrate, makemigrations, etc.
+    The store is owned by ``index_manager``, which swaps in new versions as they
+    are published; callers should fetch it once per request.
     """
-    global _vector_store
-    
     # Check if we're in a management command context that shouldn't load vectorstore
     if len(sys.argv) > 1:
         command = sys.argv[1]
@@ -36,37 +59,201 @@ def get_vector_store():
         if command in skip_commands:
             return None
     
-    if _vector_store is None:
-        _vector_store = VectorStore()
-        docs_folder = os.path.join(settings.BASE_DIR, 'documents')
-        print("Loading vector store from documents folder...")
-        _vector_store.load_from_folder(docs_folder)
-        print("Vector store loaded successfully!")
-    
-    return _vector_store
+    return index_manager.get()
 
 
 def initialize_vector_store():
     """
     Initialize the vector store. This is called during app startup for runserver.
     """
-    global _vector_store
-    if _vector_store is None:
+    if index_manager.store is None:
         get_vector_store()  # This will load it if appropriate
 
 
+def build_context(docs):
+    """Format retrieved passages (see chat.context), with their source, into the prompt context."""
+    context_parts = []
+    for doc in docs:
+        metadata = doc.get('metadata') or {}
+        filename = metadata.get('filename', 'Unknown')
+        chunk_info = f"(from {filename}"
+        if 'chunk_index' in metadata and 'total_chunks' in metadata:
+            if metadata.get('last_chunk_index', metadata['chunk_index']) != metadata['chunk_index']:
+                chunk_info += (f", parts {metadata['chunk_index'] + 1}-{metadata['last_chunk_index'] + 1}"
+                               f"/{metadata['total_chunks']}")
+            else:
+                chunk_info += f", part {metadata['chunk_index'] + 1}/{metadata['total_chunks']}"
+        chunk_info += ")"
+        
+        context_parts.append(f"{chunk_info}:\n{doc['text']}")
+    
+    return "\n\n---\n\n".join(context_parts)
+
+
+def retrieve(vector_store, message, stages, top_k=None, use_cache=True, filters=None):
+    """
+    Find the passages to answer ``message`` from, returning
+    ``(query, cached, docs)``. Each stage is timed in ``stages`` (a
+    StageTimings), labelled with the provider that embedded the query.
+
+    BM25 runs first: when its best match is decisive (an exact ticket ID,
+    error code or endpoint name) those chunks are used as they are and the
+    message is never embedded, so ``query`` is None. Otherwise ``query`` is
+    ``(namespace, query_vec)``, the message embedded by the first available
+    provider the store has an index for (batched with concurrent requests'
+    messages, see chat.coalescer). It is looked up in the response
+    cache (``cached``, unless ``use_cache`` is false) and, on a miss, used
+    for a vector search of that namespace's index fused with the BM25
+    results.
+
+    Up to ``top_k`` (default: CONTEXT_CANDIDATES) hits are retrieved and
+    packed by ``context_packer``: irrelevant hits are dropped, adjacent
+    chunks merged and the result fitted to the prompt token budget.
+    With ``filters`` (see VectorStore.normalize_filters) only matching
+    chunks are searched; cached answers aren't filtered, so callers pass
+    ``use_cache=False`` with them.
+    """
+    top_k = top_k or settings.CONTEXT_CANDIDATES
+    with stages.time("lexical_search"):
+        lexical = vector_store.lexical_search(message, filters=filters)
+    if vector_store.is_decisive(lexical):
+        with stages.time("pack_context"):
+            return None, None, context_packer.pack(lexical[:top_k])
+
+    # The query embedding serves both the answer cache and the search
+    with stages.time("embed_query"):
+        namespace, query_vec = embedding_coalescer.embed(message, vector_store.namespaces)
+    stages.labels.update(provider_labels(namespace.split(":", 1)[0]))
+    if use_cache:
+        with stages.time("response_cache"):
+            cached = response_cache.lookup(query_vec, vector_store.version, namespace)
+        if cached:
+            return (namespace, query_vec), cached, None
+    with stages.time("vector_search"):
+        docs = search_coalescer.search(
+            vector_store, query_vec, top_k=top_k, lexical=lexical, namespace=namespace, filters=filters
+        )
+    with stages.time("pack_context"):
+        docs = context_packer.pack(docs, query_vec, vector_store, namespace)
+    return (namespace, query_vec), None, docs
+
+
+async def aretrieve(vector_store, message, stages, top_k=None, use_cache=True, filters=None):
+    """
+    ``retrieve`` for asyncio code. The coalesced query embedding and vector
+    search are awaited (see chat.coalescer), and the other CPU-bound steps
+    run in a thread, so the event loop is never blocked.
+    """
+    top_k = top_k or settings.CONTEXT_CANDIDATES
+    with stages.time("lexical_search"):
+        lexical = await sync_to_async(vector_store.lexical_search, thread_sensitive=False)(message, filters=filters)
+    if vector_store.is_decisive(lexical):
+        with stages.time("pack_context"):
+            return None, None, context_packer.pack(lexical[:top_k])
+
+    with stages.time("embed_query"):
+        namespace, query_vec = await embedding_coalescer.aembed(message, vector_store.namespaces)
+    stages.labels.update(provider_labels(namespace.split(":", 1)[0]))
+    if use_cache:
+        with stages.time("response_cache"):
+            cached = response_cache.lookup(query_vec, vector_store.version, namespace)
+        if cached:
+            return (namespace, query_vec), cached, None
+    with stages.time("vector_search"):
+        docs = await search_coalescer.asearch(
+            vector_store, query_vec, top_k=top_k, lexical=lexical, namespace=namespace, filters=filters
+        )
+    with stages.time("pack_context"):
+        docs = await sync_to_async(context_packer.pack, thread_sensitive=False)(
+            docs, query_vec, vector_store, namespace
+        )
+    return (namespace, query_vec), None, docs
+
+
+def provider_labels(key):
+    """``chat_stage_seconds`` labels for a stage served by provider ``key``."""
+    return {"provider": key, "fallback": "true" if key and ai_client.is_fallback(key) else "false"}
+
+
+def load_conversation(user, conversation_id, stages):
+    """
+    Return ``(conversation, turns, history)`` for the user's Conversation
+    with ``conversation_id`` (a new, unsaved one if no ID was given), or
+    None if it doesn't exist or isn't theirs.
+    """
+    with stages.time("load_conversation"):
+        if conversation_id in (None, ""):
+            conversation = Conversation(user=user)
+        else:
+            try:
+                conversation = Conversation.objects.get(pk=int(conversation_id), user=user)
+            except (Conversation.DoesNotExist, TypeError, ValueError):
+                return None
+        turns = conversation_memory.recent_turns(conversation)
+        return conversation, turns, conversation_memory.format_history(conversation, turns)
+
+
+def save_turn(user, conversation, turns, message, response, stages=None):
+    """
+    Store a finished turn: the ChatMessage and the conversation's memory.
+    Turns of one conversation are saved one at a time (the row is locked),
+    and ``turns`` is reloaded if another turn was saved since it was read.
+    The save is timed in ``stages``, if given.
+    """
+    stages = stages or StageTimings()
+    with stages.time("save"), transaction.atomic():
+        if conversation.pk is None:
+            conversation.save()
+        else:
+            current = Conversation.objects.select_for_update().only("summary", "turn_count").get(pk=conversation.pk)
+            if current.turn_count != conversation.turn_count:
+                conversation.summary, conversation.turn_count = current.summary, current.turn_count
+                turns = conversation_memory.recent_turns(conversation)
+        ChatMessage.objects.create(user=user, conversation=conversation, message=message, response=response)
+        conversation_memory.add_turn(conversation, turns, message, response)
+
+
+def record_request(endpoint, request_status, started, stages, provider="", cached=False):
+    """Count a chat request, observe its stages and, if it was answered, its latency."""
+    cache = "hit" if cached else "miss"
+    stages.observe(cache=cache)
+    chat_requests.inc(endpoint=endpoint, status=request_status, cache=cache)
+    if request_status == "ok":
+        chat_request_seconds.observe(time.perf_counter() - started, endpoint=endpoint, provider=provider, cache=cache)
+
+
+class ChatHistoryPagination(CursorPagination):
+    """
+    Keyset pagination, newest first: each page is an index range scan on
+    (user, created_at), however far back the client pages.
+    """
+    ordering = "-created_at"
+    page_size = settings.CHAT_HISTORY_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.CHAT_HISTORY_MAX_PAGE_SIZE
+
 
 class MessageListView(ListAPIView):
     serializer_class = ChatMessageSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = ChatHistoryPagination
     
     def get_queryset(self):
-        return ChatMessage.objects.filter(user=self.request.user)
+        queryset = ChatMessage.objects.filter(user=self.request.user)
+        conversation_id = self.request.query_params.get("conversation")
+        if conversation_id:
+            try:
+                queryset = queryset.filter(conversation_id=int(conversation_id))
+            except ValueError:
+                raise ValidationError({"conversation": "A conversation ID must be an integer."})
+        return queryset
 
 
 class ChatMessageCreateView(APIView):
     permission_classes = [IsAuthenticated]
     def post(self, request, *args, **kwargs):
+        started = time.perf_counter()
+        stages = StageTimings()
         message = request.data.get('message')
         if not message:
             return Response({"error": "Message content is required"}, status=status.HTTP_400_BAD_REQUEST)
@@ -76,39 +263,212 @@ class ChatMessageCreateView(APIView):
         if vector_store is None:
             return Response({"error": "Vector store not available"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         
-        # Search for relevant chunks (increased to 4 for better context)
-        docs = vector_store.search(message, top_k=4)
-        
-        # Create context from chunks with metadata
-        context_parts = []
-        for doc in docs:
-            metadata = doc.get('metadata', {})
-            filename = metadata.get('filename', 'Unknown')
-            chunk_info = f"(from {filename}"
-            if 'chunk_index' in metadata and 'total_chunks' in metadata:
-                chunk_info += f", part {metadata['chunk_index'] + 1}/{metadata['total_chunks']}"
-            chunk_info += ")"
-            
-            context_parts.append(f"{chunk_info}:\n{doc['text']}")
-        
-        context = "\n\n---\n\n".join(context_parts)
+        try:
+            filters = VectorStore.normalize_filters(request.data.get('filters'))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        loaded = load_conversation(request.user, request.data.get('conversation_id'), stages)
+        if loaded is None:
+            stages.observe()
+            return Response(CONVERSATION_NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+        conversation, turns, history = loaded
+        # Cached answers were given without history or filters, so those bypass the cache
+        use_cache = not history and not filters
         
-        response = ai_client.chat_with_context(message, context)
-        active_provider = ai_client.get_active_provider()
+        try:
+            query = conversation_memory.rewrite_query(message, turns)
+            embedded, cached, docs = retrieve(vector_store, query, stages, use_cache=use_cache, filters=filters)
+            if cached:
+                response = cached['response']
+                active_provider = cached['provider']
+            else:
+                # Create context from chunks with metadata
+                context = build_context(docs)
+                
+                with stages.time("chat") as labels:
+                    active_provider, response = ai_client.chat_with_context(message, context, history)
+                    labels.update(provider_labels(ai_client.provider_key(active_provider)))
+                if embedded is not None and use_cache:
+                    namespace, query_vec = embedded
+                    response_cache.add(query_vec, response, active_provider, vector_store.version, namespace)
+        except CircuitOpenError:
+            record_request("chat", "unavailable", started, stages)
+            return Response(PROVIDERS_UNAVAILABLE, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except Exception:
+            record_request("chat", "error", started, stages)
+            raise
         
-        data = {
-            'message': message,
-            'response': response,
-            'user': request.user.id
-        }
-        serializer = ChatMessageSerializer(data=data)
-        if serializer.is_valid():
-            serializer.save(user=request.user)
-            return Response({
-                "response": response,
-                "provider": active_provider
-            }, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        save_turn(request.user, conversation, turns, message, response, stages)
+        record_request("chat", "ok", started, stages, active_provider, cached)
+        return Response({
+            "response": response,
+            "provider": active_provider,
+            "cached": bool(cached),
+            "conversation_id": conversation.pk
+        }, status=status.HTTP_200_OK)
+
+
+def _sse(event, data):
+    """Encode one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@csrf_exempt
+@require_POST
+async def chat_stream(request):
+    """
+    Streaming variant of ChatMessageCreateView for ASGI deployments.
+
+    The answer is sent as Server-Sent Events while the provider generates it:
+    a ``meta`` event naming the provider, one ``token`` event per text piece
+    and a final ``done`` event (with the ``conversation_id``) once the
+    ChatMessage has been saved. Retrieval awaits the coalescers (see
+    ``aretrieve``) and the answer is streamed as it arrives; other blocking
+    work (BM25, packing, the database) runs in threads, so the event loop
+    is never held up and one process can serve many concurrent streams.
+    """
+    try:
+        auth = await sync_to_async(JWTAuthentication().authenticate)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({"error": str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+    if auth is None:
+        return JsonResponse(
+            {"error": "Authentication credentials were not provided."},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    user = auth[0]
+    started = time.perf_counter()
+    stages = StageTimings()
+
+    try:
+        body = json.loads(request.body or b"{}")
+        message = body.get('message')
+    except (ValueError, AttributeError):
+        body, message = {}, None
+    if not message:
+        return JsonResponse({"error": "Message content is required"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        filters = VectorStore.normalize_filters(body.get('filters'))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    vector_store = await sync_to_async(get_vector_store)()
+    if vector_store is None:
+        return JsonResponse({"error": "Vector store not available"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    loaded = await sync_to_async(load_conversation)(user, body.get('conversation_id'), stages)
+    if loaded is None:
+        stages.observe()
+        return JsonResponse(CONVERSATION_NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+    conversation, turns, history = loaded
+    use_cache = not history and not filters
+
+    try:
+        query = conversation_memory.rewrite_query(message, turns)
+        embedded, cached, docs = await aretrieve(vector_store, query, stages, use_cache=use_cache, filters=filters)
+    except CircuitOpenError:
+        record_request("chat_stream", "unavailable", started, stages)
+        return JsonResponse(PROVIDERS_UNAVAILABLE, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    except Exception:
+        record_request("chat_stream", "error", started, stages)
+        raise
+
+    async def cached_stream():
+        await sync_to_async(save_turn)(user, conversation, turns, message, cached['response'], stages)
+        record_request("chat_stream", "ok", started, stages, cached['provider'], cached=True)
+        yield _sse("meta", {"provider": cached['provider'], "cached": True})
+        yield _sse("token", {"text": cached['response']})
+        yield _sse("done", {"provider": cached['provider'], "conversation_id": conversation.pk})
+
+    if cached:
+        return _sse_response(cached_stream())
+
+    context = build_context(docs)
+
+    async def event_stream():
+        provider = None
+        parts = []
+        # Time spent waiting for the provider; the time the client takes to
+        # read each event (while this generator is suspended) isn't counted
+        chat_seconds, resumed = 0.0, time.perf_counter()
+        try:
+            async for provider_name, text in ai_client.stream_chat_with_context(message, context, history):
+                chat_seconds += time.perf_counter() - resumed
+                if provider is None:
+                    provider = provider_name
+                    yield _sse("meta", {"provider": provider, "cached": False})
+                parts.append(text)
+                yield _sse("token", {"text": text})
+                resumed = time.perf_counter()
+            chat_seconds += time.perf_counter() - resumed
+        except Exception as e:
+            logger.error(f"Streaming chat failed: {e}")
+            stages.add("chat", chat_seconds + time.perf_counter() - resumed,
+                       **provider_labels(ai_client.provider_key(provider)))
+            record_request("chat_stream", "error", started, stages)
+            yield _sse("error", {"error": "Failed to generate a response"})
+            return
+        stages.add("chat", chat_seconds, **provider_labels(ai_client.provider_key(provider)))
+
+        response = "".join(parts)
+        await sync_to_async(save_turn)(user, conversation, turns, message, response, stages)
+        if embedded is not None and use_cache:
+            namespace, query_vec = embedded
+            response_cache.add(query_vec, response, provider, vector_store.version, namespace)
+        record_request("chat_stream", "ok", started, stages, provider)
+        yield _sse("done", {"provider": provider, "conversation_id": conversation.pk})
+
+    return _sse_response(event_stream())
+
+
+def _sse_response(events):
+    streaming_response = StreamingHttpResponse(events, content_type="text/event-stream")
+    streaming_response["Cache-Control"] = "no-cache"
+    # Stop nginx from buffering the stream
+    streaming_response["X-Accel-Buffering"] = "no"
+    return streaming_response
+
+
+class VectorStoreReindexView(APIView):
+    """Queue a rebuild of the vector store for a job worker (admins only)."""
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        job = enqueue("rebuild_vectorstore", {"full": bool(request.data.get("full"))}, unique=True)
+        return Response({"job_id": job.pk, "status": job.status}, status=status.HTTP_202_ACCEPTED)
+
+
+class VectorStoreReloadView(APIView):
+    """
+    Switch the served vector store version (admins only). With no body the
+    current version is reloaded if it changed; ``{"version": "..."}``
+    activates that version and ``{"rollback": true}`` the one before the
+    current. Other worker processes follow within
+    VECTORSTORE_RELOAD_POLL_SECONDS. GET lists the available versions.
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        store = index_manager.store
+        return Response({
+            "active": store.version if store is not None else None,
+            "versions": list_versions(index_manager.get_root()),
+        }, status=status.HTTP_200_OK)
+
+    def post(self, request):
+        try:
+            if request.data.get("rollback"):
+                version = index_manager.rollback()
+            elif request.data.get("version"):
+                version = index_manager.activate(str(request.data["version"]))
+            else:
+                version = index_manager.reload()
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_409_CONFLICT)
+        if version is None:
+            return Response({"error": "Vector store not available"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({"active": version}, status=status.HTTP_200_OK)
 
 
 class VectorStoreStatsView(APIView):
@@ -121,6 +481,7 @@ class VectorStoreStatsView(APIView):
             return Response({"error": "Vector store not available"}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         
         stats = vector_store.get_stats()
+        stats["response_cache"] = response_cache.get_stats()
         return Response(stats, status=status.HTTP_200_OK)
 
 
@@ -130,4 +491,18 @@ class AIProviderStatusView(APIView):
     
     def get(self, request):
         status_info = ai_client.get_provider_status()
-        return Response(status_info, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response(status_info, status=status.HTTP_200_OK)
+
+
+def metrics(request):
+    """
+    This process's metrics in the Prometheus text format, for scraping.
+    Requires METRICS_TOKEN as a bearer token; without one configured,
+    metrics are only served in DEBUG.
+    """
+    if not settings.METRICS_TOKEN:
+        if not settings.DEBUG:
+            return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    elif not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}"):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -38,8 +38,8 @@ def test_ai_client():
     try:
         test_prompt = "What is the company's mission?"
         test_context = "Our company mission is to provide excellent customer service and innovative solutions."
-        response = ai_client.chat_with_context(test_prompt, test_context)
-        print(f"✅ Chat response generated successfully")
+        provider, response = ai_client.chat_with_context(test_prompt, test_context)
+        print(f"✅ Chat response generated successfully by {provider}")
         print(f"   Response: {response[:100]}...")
     except Exception as e:
         print(f"❌ Chat test failed: {e}")
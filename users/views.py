@@ -5,7 +5,7 @@ from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
-from django.core.mail import send_mail
+from chat.jobs import enqueue
 
 
 class SignupView(APIView):
@@ -21,17 +21,8 @@ class SignupView(APIView):
         user = User.objects.create_user(username=username, email=email, password=password)
         user.save()
 
-        try:
-            send_mail(
-            subject='Verify your email',
-            message='Thank you for signing up. Please verify your email address.',
-            from_email='no-reply@example.com',
-            recipient_list=[user.email],
-            fail_silently=False,
-            )
-        except Exception as e:
-            # Log the error but don't fail the signup
-            print(f"Email sending failed: {e}")
+        # A job worker sends the mail (and retries it), outside of the request
+        enqueue('send_verification_email', {'user_id': user.id})
         return Response({
             "success": True,
             "message": "User signed up successfully",